@@ -0,0 +1,402 @@
+"""Non-interactive batch processing of page scans from a zip archive or a directory: every page goes through
+a pipeline of steps (binarize, smart-binarize, preprocess, recognize) in a pool of worker processes, one per core
+by default. Results come back in page order whatever order the pages finish in; a page that fails is reported
+and skipped without stopping the batch.
+Image results are saved as png; recognized texts are saved per page and, in page order, to a text file named after
+the source, pages separated by form feeds. All of them go to an output directory, or, if the output is a .zip or
+.tar(.gz) path, are streamed into that archive in page order with a manifest (see `ArchiveSink`).
+Pages done are recorded in a checkpoint manifest (see `Checkpoint`), so a run that died halfway is resumed by
+running it again: only pages not done yet, or changed since, are processed (--restart to process all anew).
+
+Run from the project root:
+python -m pages2Text.batch scans.zip --pipeline smart-binarize,recognize --output scans_out [--workers 4]
+or use `run_batch` / `iter_batch` from Python."""
+
+import argparse
+import contextlib
+import io
+import ntpath
+import os
+import posixpath
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from time import perf_counter
+
+from PIL import Image
+
+from pages2Text import ocr_engine as ocr
+from pages2Text.checkpoint import Checkpoint, content_hash, params_hash
+from pages2Text.page_sink import ArchiveReader, ArchiveSink
+from pages2Text.page_source import PageSource, list_pages
+from pages2Text.stage_cache import StageCache
+from pages2Text.preprocessing import load_image, binarize_as_array, smart_binarize_as_array, preprocess
+
+
+def as_im(image):
+    """Returns :image: as a PIL image in 'L' mode, loading it if it is a file"""
+    return image if isinstance(image, Image.Image) else load_image(image)
+
+
+def as_file(image):
+    """Returns :image: as a file, encoding it as png if it is a PIL image"""
+    if not isinstance(image, Image.Image):
+        return image
+    buffer = io.BytesIO()
+    image.save(buffer, 'png')
+    buffer.seek(0)
+    return buffer
+
+
+# pipeline steps: each takes an image file or PIL image and the batch options, returns a PIL image or a text
+STEPS = {
+    'binarize': lambda image, options: binarize_as_array(as_im(image), threshold=options.get('threshold')),
+    'smart-binarize': lambda image, options: smart_binarize_as_array(as_im(image), edges=False),
+    'preprocess': lambda image, options: preprocess(as_file(image), threshold=options.get('threshold'),
+                                                    cache=_stage_cache),
+    'recognize': lambda image, options: ocr.image_to_string(as_im(image), lang=options.get('lang', 'tha'),
+                                                            config=f'--psm {options.get("psm", 4)}'),
+}
+TEXT_STEPS = ('recognize',)
+# options the steps read, with their defaults: only these make a difference to the results
+STEP_OPTIONS = {
+    'binarize': dict(threshold=None),
+    'smart-binarize': {},
+    'preprocess': dict(threshold=None),
+    'recognize': dict(lang='tha', psm=4),
+}
+
+
+def step_options(steps, options):
+    """Returns the :options: the pipeline :steps: read, defaults filled in, leaving out those none of them reads"""
+    return {name: options.get(name, default) for step in steps for name, default in STEP_OPTIONS[step].items()}
+
+
+def output_stem(name):
+    """Returns the relative path, without extension, results of the page :name: (an archive member or file name)
+    are saved under, raising ValueError for a name that would have them land outside the output (absolute, with
+    a drive or going up with ..)"""
+    path = posixpath.normpath(name.replace('\\', '/'))
+    if posixpath.isabs(path) or ntpath.splitdrive(path)[0] or path == '..' or path.startswith('../'):
+        raise ValueError(f'unsafe page name {name!r}')
+    return posixpath.splitext(path)[0]
+
+
+def parse_pipeline(spec):
+    """Takes a comma separated pipeline spec, returns the list of step names, checking them"""
+    steps = [step.strip() for step in spec.split(',') if step.strip()]
+    if not steps:
+        raise ValueError('empty pipeline')
+    for i, step in enumerate(steps):
+        if step not in STEPS:
+            raise ValueError(f'unknown step {step!r}, expected one of {", ".join(STEPS)}')
+        if step in TEXT_STEPS and i != len(steps) - 1:
+            raise ValueError(f'{step} produces text and can only be the last step')
+    return steps
+
+
+@dataclass
+class PageResult:
+    index: int  # position of the page in the batch
+    name: str
+    seconds: float = 0.
+    output: str = None  # path of the saved image or the recognized text
+    error: str = None
+    data: bytes = None  # png encoded image result, when not saved by the worker
+    hash: str = None  # of the page content
+    resumed: bool = False  # result of an earlier run, found in the checkpoint
+
+
+_stage_cache = None  # StageCache of the worker process, if preprocessing stages are cached
+
+
+def _init_worker(stage_cache=None, single_threaded_ocr=True):
+    global _stage_cache
+    if stage_cache:
+        _stage_cache = StageCache(stage_cache)
+    if single_threaded_ocr:
+        # pages are processed in parallel already, tesseract's own threads would only compete for the cores
+        os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def process_page(index, name, data, steps, output_dir, options):
+    """Runs a page (file content :data:) through the pipeline :steps: in a worker process,
+    saving an image result to :output_dir: or, if it is None, returning it png encoded"""
+    start = perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # the steps report as they go, for interactive use
+            result = io.BytesIO(data)
+            for step in steps:
+                result = STEPS[step](result, options)
+        if isinstance(result, str):
+            output = result
+        elif output_dir is None:
+            return PageResult(index, name, perf_counter() - start, data=ArchiveSink.encode(as_im(result)))
+        else:
+            output = os.path.join(output_dir, output_stem(name) + '.png')
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            as_im(result).save(output)
+        return PageResult(index, name, perf_counter() - start, output)
+    except Exception as e:
+        return PageResult(index, name, perf_counter() - start, error=f'{type(e).__name__}: {e}')
+
+
+def iter_batch(source, steps, output_dir, workers=None, names=None, prefetch=None, resume=None, stage_cache=None,
+               **options):
+    """
+    Processes pages of :source: (zip archive or directory) through the pipeline :steps: in a process pool,
+    yielding a tuple of a PageResult and the number of pages handed over so far, in page order.
+    Pages are read ahead on background threads (see `PageSource`) and handed to the workers as they come,
+    with at most :prefetch: pages in memory at a time: up to one per worker read ahead, the rest being processed
+    or waiting for the pages before them. A page with a name unsafe to save results
+    under (see `output_stem`) fails; so do the pages in a worker pool that broke (a worker killed or out of memory),
+    the others going to a new pool.
+    :param output_dir: directory image results are saved to, None to have them in PageResult.data.
+    :param workers: number of worker processes, all available cores by default.
+    :param names: page names to process, all pages of the source by default.
+    :param prefetch: pages in memory at most, three times the number of workers by default.
+    :param resume: function taking a Page and its content hash, returning a PageResult to skip the page with
+    (done in an earlier run) or None to process it.
+    :param stage_cache: path of a StageCache database for the preprocessing stages, None not to cache them.
+    :param options: step options: threshold (binarize, preprocess), lang and psm (recognize).
+    """
+    workers = workers or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count())
+    prefetch = max(2, prefetch or 3 * workers)
+    read_ahead = min(workers, prefetch // 2)  # the part of the budget the source reads ahead with
+    finished = {}  # results waiting for the pages before them
+    hashes = {}
+    next_index = 0
+    running = {}  # futures of the pages being processed, with their index, name and pool
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(stage_cache,))
+
+    def submit(page):
+        nonlocal executor
+        try:
+            future = executor.submit(process_page, page.index, page.name, page.data, steps, output_dir, options)
+        except BrokenProcessPool:  # broken by a worker that died, before any of its futures was waited for
+            executor.shutdown(wait=False)
+            executor = new_pool()
+            future = executor.submit(process_page, page.index, page.name, page.data, steps, output_dir, options)
+        running[future] = page.index, page.name, executor
+
+    executor = new_pool()
+    try:
+        with PageSource(source, names, prefetch=read_ahead, decode=False) as source_pages:
+            pages = iter(source_pages)
+            exhausted = False
+            while not exhausted or running:
+                # taking the next page only once there is room keeps the pages in memory bounded
+                while not exhausted and len(running) + len(finished) < prefetch - read_ahead:
+                    page = next(pages, None)
+                    if page is None:
+                        exhausted = True
+                        continue
+                    error = page.error
+                    if not error:
+                        try:
+                            output_stem(page.name)
+                        except ValueError as e:
+                            error = f'{type(e).__name__}: {e}'
+                    if error:
+                        finished[page.index] = PageResult(page.index, page.name, error=error)
+                        continue
+                    hashes[page.index] = page_hash = content_hash(page.data)
+                    resumed = resume(page, page_hash) if resume else None
+                    if resumed:
+                        finished[page.index] = resumed
+                    else:
+                        submit(page)
+                if running:
+                    completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        index, name, pool = running.pop(future)
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool as e:
+                            # all pages in the pool are lost with it, the pages after them go to a new one
+                            result = PageResult(index, name, error=f'{type(e).__name__}: {e}')
+                            if pool is executor:
+                                executor.shutdown(wait=False)
+                                executor = new_pool()
+                        finished[result.index] = result
+                while next_index in finished:  # hand results over in page order as soon as the next one is in
+                    result = finished.pop(next_index)
+                    result.hash = hashes.pop(next_index, None)
+                    yield result, next_index + 1
+                    next_index += 1
+    finally:
+        executor.shutdown()
+
+
+def report_progress(result, done, total):
+    status = f'failed: {result.error}' if result.error else 'done before' if result.resumed else 'ok'
+    print(f'{done} of {total}: {result.name} - {result.seconds:.1f} s, {status}')
+
+
+def is_archive(path):
+    return path.endswith(('.zip', '.tar', '.tar.gz', '.tgz'))
+
+
+def open_previous(output):
+    """Sets aside the archive :output: of an earlier run to take resumed pages from, returning readers of all
+    archives set aside so far, latest first. Archives are set aside under numbered names until a run completes,
+    as one cut short by a crash holds only some of the pages of those before it"""
+    tar = output.endswith(('.tar', '.tar.gz', '.tgz'))
+    numbers = []
+    folder = os.path.dirname(output) or '.'
+    prefix = os.path.basename(output) + '.previous'
+    for name in os.listdir(folder):
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            numbers.append(int(name[len(prefix):]))
+    if os.path.exists(output):
+        current = ArchiveReader(output, tar)
+        current.close()
+        if len(current):
+            number = max(numbers, default=-1) + 1
+            os.replace(output, f'{output}.previous{number}')
+            numbers.append(number)
+        else:
+            os.remove(output)
+    return [ArchiveReader(f'{output}.previous{number}', tar) for number in sorted(numbers, reverse=True)]
+
+
+def run_batch(source, steps, output, workers=None, progress=report_progress, resume=True, stage_cache=None,
+              prefetch=None, **options):
+    """
+    Processes all pages of :source: through the pipeline :steps: (a list of step names or a comma separated spec),
+    reporting each page with :progress: (a function taking the result, the number of pages done and their total).
+    Results are written to :output:, a directory or an archive (.zip, .tar, .tar.gz) path; recognized texts
+    per page and all together in page order.
+    Pages done are recorded in a checkpoint manifest (checkpoint.jsonl in the output directory, or next to the
+    archive); with :resume:, pages recorded there with the same content and parameters are not processed again,
+    their earlier results being used. Only the options the steps read count as parameters (see `step_options`).
+    :param stage_cache: path of a StageCache database for the preprocessing stages, None not to cache them.
+    :param prefetch: pages in memory at most (see `iter_batch`), making no difference to the results.
+    :return: list of PageResult in page order.
+    """
+    if isinstance(steps, str):
+        steps = parse_pipeline(steps)
+    text = steps[-1] in TEXT_STEPS
+    options = step_options(steps, options)
+    params = params_hash(steps, options)
+    archive = is_archive(output)
+    if not archive:
+        os.makedirs(output, exist_ok=True)
+    checkpoint_path = output + '.checkpoint.jsonl' if archive else os.path.join(output, 'checkpoint.jsonl')
+    if not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    previous = open_previous(output) if archive and resume else []
+    sink = ArchiveSink(output) if archive else None
+
+    def resumed(page, page_hash):
+        record = checkpoint.done(page.name, page_hash, params)
+        if not record:
+            return None
+        if sink:
+            content = None
+            for reader in previous:
+                content = reader.read(record['output'])
+                if content is not None:
+                    break
+        elif os.path.exists(record['output']):
+            if not text:
+                return PageResult(page.index, page.name, output=record['output'], resumed=True)
+            with open(record['output'], 'rb') as file:
+                content = file.read()
+        else:
+            content = None
+        if content is None:  # the result is gone, the page is to be done again
+            return None
+        if text:
+            return PageResult(page.index, page.name, output=content.decode('utf-8'), resumed=True)
+        return PageResult(page.index, page.name, data=content, resumed=True)
+
+    names = list_pages(source)
+    results = []
+    all_done = False
+    start = perf_counter()
+    try:
+        for result, done in iter_batch(source, steps, None if sink else output, workers, names, prefetch=prefetch,
+                                       resume=resumed if resume else None, stage_cache=stage_cache, **options):
+            reference = result.output
+            if sink:
+                files = {}
+                if text and result.output is not None:
+                    reference = output_stem(result.name) + '.txt'
+                    files[reference] = result.output
+                elif result.data is not None:
+                    reference = output_stem(result.name) + '.png'
+                    files[reference] = result.data
+                    result.output = f'{output}/{reference}'
+                    result.data = None
+                sink.put(result.index, files, name=result.name, seconds=round(result.seconds, 3), error=result.error)
+            elif text and result.output is not None:
+                reference = os.path.join(output, output_stem(result.name) + '.txt')
+                if not result.resumed:
+                    os.makedirs(os.path.dirname(reference), exist_ok=True)
+                    with open(reference, 'w', encoding='utf-8') as file:
+                        file.write(result.output)
+            if not result.error and not result.resumed:
+                checkpoint.record(result.name, result.hash, params, reference, seconds=round(result.seconds, 3))
+            if progress:
+                progress(result, done, len(names))
+            results.append(result)
+        all_done = True
+    finally:
+        checkpoint.close()
+        combined = {}
+        if text:
+            stem = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+            combined[stem + '.txt'] = '\f'.join(result.output or '' for result in results)
+        if sink:
+            sink.close(combined, source=os.path.basename(os.path.normpath(source)), pipeline=steps,
+                       seconds=round(perf_counter() - start, 3), failed=sum(bool(result.error) for result in results),
+                       resumed=sum(result.resumed for result in results))
+            for reader in previous:
+                reader.close()
+                if all_done:  # all pages taken from them, otherwise they may still be needed
+                    os.remove(reader.path)
+        else:
+            for name, content in combined.items():
+                with open(os.path.join(output, name), 'w', encoding='utf-8') as file:
+                    file.write(content)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Processes page scans from a zip archive or directory in parallel.')
+    parser.add_argument('source', help='zip archive or directory of page images')
+    parser.add_argument('--pipeline', default='preprocess,recognize',
+                        help=f'comma separated steps out of: {", ".join(STEPS)}')
+    parser.add_argument('--output', help='output directory or .zip/.tar(.gz) archive, the source path with _out '
+                        'by default')
+    parser.add_argument('--workers', type=int, help='worker processes, all available cores by default')
+    parser.add_argument('--prefetch', type=int, help='pages in memory at most, read ahead or being processed, '
+                        'three times the workers by default')
+    parser.add_argument('--restart', action='store_true',
+                        help='process all pages again instead of resuming from the checkpoint of an earlier run')
+    parser.add_argument('--stage-cache', help='database caching preprocessing stage outputs, for reruns with '
+                        'other parameters to redo only the stages affected')
+    parser.add_argument('--threshold', help='binarization threshold value or method (min, otsu)')
+    parser.add_argument('--lang', default='tha', help='recognition language(s)')
+    parser.add_argument('--psm', type=int, default=4, help='tesseract page segmentation mode')
+    args = parser.parse_args()
+    steps = parse_pipeline(args.pipeline)
+    output = args.output or os.path.splitext(os.path.normpath(args.source))[0] + '_out'
+    threshold = int(args.threshold) if args.threshold and args.threshold.isdigit() else args.threshold
+    start = perf_counter()
+    results = run_batch(args.source, steps, output, args.workers, resume=not args.restart, stage_cache=args.stage_cache,
+                        prefetch=args.prefetch, threshold=threshold, lang=args.lang, psm=args.psm)
+    failed = [result for result in results if result.error]
+    resumed = sum(result.resumed for result in results)
+    print(f'{len(results) - len(failed)} of {len(results)} pages done in {perf_counter() - start:.1f} s '
+          f'({resumed} in an earlier run), {len(failed)} failed; results in {output}')
+    for result in failed:
+        print(f' - {result.name}: {result.error}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Measures per-call recognition latency of the subprocess and the pool engines of `ocr_engine`,
+sequentially and from concurrent threads as in `ClipImg2Text.threads_recognize`.
+Run from the project root: python -m pages2Text.benchmarks.ocr_engine [image_path] [lang] [calls]
+"""
+import sys
+import threading
+from statistics import median
+from time import perf_counter
+
+from PIL import Image
+
+from pages2Text import ocr_engine
+
+
+def time_calls(engine, im, lang, calls, threads=1):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n):
+        for _ in range(n):
+            start = perf_counter()
+            engine.image_to_string(im, lang=lang, config='--psm 7')
+            with lock:
+                latencies.append(perf_counter() - start)
+
+    workers = [threading.Thread(target=worker, args=(calls // threads,)) for _ in range(threads)]
+    start = perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, perf_counter() - start
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'screen2Text/test_image.png'
+    lang = sys.argv[2] if len(sys.argv) > 2 else 'tha'
+    calls = int(sys.argv[3]) if len(sys.argv) > 3 else 42
+    im = Image.open(path)
+    print(f'{calls} calls on {path} {im.size}, lang {lang}, psm 7')
+    for name in ('subprocess', 'pool'):
+        try:
+            engine = ocr_engine.create_engine(name)
+        except ImportError as e:
+            print(f'{name}: skipped ({e})')
+            continue
+        engine.image_to_string(im, lang=lang)  # warming up: loads the model into the pool
+        for threads in (1, 6):
+            latencies, total = time_calls(engine, im, lang, calls, threads)
+            print(f'{name:>10}, {threads} thread(s): median {median(latencies) * 1000:.1f} ms per call, '
+                  f'max {max(latencies) * 1000:.1f} ms, {len(latencies) / total:.1f} calls/s')
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Compares reading pages from a zip archive on the consumer's thread, opening and decoding each member just before
+processing it, against the streaming PageSource reading and decoding ahead on background threads, with the same
+processing (binarization) of every page. Shows the total times and how often and how long the consumer had to wait
+for a page with PageSource - ideally never once the window is filled.
+Run from the project root: python -m pages2Text.benchmarks.page_source [archive.zip] [--pages 500] [--prefetch 8]"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import zipfile
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+from pages2Text.page_source import PageSource, list_pages
+from pages2Text.preprocessing import binarize_as_array, load_image
+
+
+def synthetic_archive(path, pages=500, width=1240, height=1754, seed=0):
+    """Writes a zip archive of :pages: jpeg scans (A4 at 150 dpi, grey 'text' bands on a noisy background)"""
+    rng = np.random.default_rng(seed)
+    base = rng.normal(225, 3, (height, width)).clip(0, 255).astype(np.uint8)
+    for y in range(150, height - 150, 35):
+        band = base[y:y + 18, 120:width - 120]
+        band[rng.random(band.shape) < .3] = 40
+    with zipfile.ZipFile(path, 'w') as archive:
+        for i in range(pages):
+            buffer = io.BytesIO()
+            Image.fromarray(np.roll(base, i, axis=0)).save(buffer, 'jpeg', quality=85)
+            archive.writestr(f'page_{i:04}.jpg', buffer.getvalue())
+
+
+def process(im):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return binarize_as_array(im, threshold=128)
+
+
+def inline(path):
+    start = perf_counter()
+    with zipfile.ZipFile(path) as archive:
+        for name in list_pages(path):
+            with archive.open(name) as file:
+                process(load_image(file))
+    return perf_counter() - start
+
+
+def streamed(path, prefetch, threads):
+    start = perf_counter()
+    with PageSource(path, prefetch=prefetch, threads=threads) as pages:
+        for page in pages:
+            process(page.im)
+    return perf_counter() - start, pages.stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archive', nargs='?', help='zip archive of page scans, a synthetic one by default')
+    parser.add_argument('--pages', type=int, default=500, help='pages of the synthetic archive')
+    parser.add_argument('--prefetch', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=2)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.archive
+        if not path:
+            path = os.path.join(tmp, 'pages.zip')
+            synthetic_archive(path, args.pages)
+        n = len(list_pages(path))
+        print(f'{n} pages, {os.path.getsize(path) / 2 ** 20:.1f} MB')
+        before = inline(path)
+        print(f'inline read and decode: {before:.2f} s ({before / n * 1000:.1f} ms per page)')
+        after, stats = streamed(path, args.prefetch, args.threads)
+        print(f'PageSource (prefetch {args.prefetch}, {args.threads} threads): {after:.2f} s '
+              f'({after / n * 1000:.1f} ms per page) | x{before / after:.2f}')
+        print(f'consumer waited for {stats["waits"]} of {stats["pages"]} pages, {stats["wait_seconds"]:.2f} s in all; '
+              f'read {stats["read_seconds"]:.2f} s, decode {stats["decode_seconds"]:.2f} s on background threads')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Compares the vectorized smart_binarize_as_array against the former per-pixel loop,
+checking that the outputs are bit-identical and timing both.
+Run from the project root: python -m pages2Text.benchmarks.smart_binarize [image_path]"""
+
+import sys
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+from pages2Text.preprocessing import load_image, smart_binarize_as_array
+
+
+def reference_smart_binarize(im, threshold=None, t_factor=2.2):
+    """The former implementation walking every pixel of every row in Python (edges cleaning left out)"""
+    array = np.asarray(im).copy()
+    floor = int(np.min(array))
+    ceiling = int(np.max(array))
+    if threshold is None:
+        threshold = int((floor + ceiling) / t_factor)
+    transposed = False
+    if len(array) < len(array[0]):
+        array = array.T
+        transposed = True
+    for row in array:
+        bottom = int(row.min())
+        top = int(row.max())
+        if bottom > threshold * 1.5:
+            row[:] = 255
+        elif bottom > (floor + (ceiling - floor) * .02):
+            row_threshold = (bottom + top) // t_factor
+            for i in range(len(row) - 1):
+                if row[i] > row_threshold:
+                    row[i] = 255
+                else:
+                    row[i] = 0
+        else:
+            for i in range(len(row) - 1):
+                if row[i] > threshold:
+                    row[i] = 255
+                else:
+                    row[i] = 0
+    if transposed:
+        array = array.T
+    return Image.fromarray(array).convert('1', dither=0)
+
+
+def synthetic_page(width=1000, height=1400, seed=0):
+    """Builds a grayscale page with dark and pale 'text' bands, blank gaps and noise"""
+    rng = np.random.default_rng(seed)
+    array = rng.integers(200, 250, size=(height, width), dtype=np.uint8)
+    for y in range(40, height - 40, 36):
+        ink = 10 if (y // 36) % 3 else 120  # every third band is pale
+        band = array[y:y + 18, 50:width - 50]
+        band[rng.random(band.shape) < .3] = ink
+    return Image.fromarray(array)
+
+
+def timed(func, *args, **kwargs):
+    start = perf_counter()
+    result = func(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+def main():
+    im = load_image(sys.argv[1]) if len(sys.argv) > 1 else synthetic_page()
+    print(f'image size: {im.size}')
+    expected, old = timed(reference_smart_binarize, im)
+    actual, new = timed(smart_binarize_as_array, im)
+    identical = np.array_equal(np.asarray(expected), np.asarray(actual))
+    print(f'\nper-pixel loop: {old:.3f} s\nvectorized: {new:.3f} s\nspeed-up: x{old / new:.0f}')
+    print(f'bit-identical: {identical}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Append-only checkpoint manifest of a batch job, for resuming it after a crash or interruption: a line of JSON for
+every page done, with the hash of its content, the hash of the pipeline parameters and a reference to its output.
+Rerunning the job skips pages whose content and parameters are the same as recorded, so only pages not done yet or
+changed since are processed again.
+Every line is flushed and fsync'd as it is written; a last line torn by a crash is dropped when the manifest is
+opened. The manifest is read once into a dict by page name, so consulting it costs a lookup per page."""
+
+import hashlib
+import json
+import os
+import threading
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def params_hash(steps, options):
+    """Hash of the pipeline :steps: and their :options:, changing whenever the results would"""
+    return content_hash(json.dumps(dict(steps=list(steps), options=options), sort_keys=True, default=str).encode())
+
+
+class Checkpoint:
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}  # page name -> its latest record
+        self.lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.load()
+        self.file = open(path, 'ab')
+
+    def load(self):
+        """Reads the records, cutting off a torn last line (and skipping any other unreadable one)"""
+        if not os.path.exists(self.path):
+            return
+        good_end = 0
+        with open(self.path, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break  # torn by a crash mid-write
+                good_end += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.records[record['name']] = record
+        if good_end < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as file:
+                file.truncate(good_end)
+
+    def done(self, name, page_hash, params):
+        """Returns the record of page :name: if it was done with the same content and parameters, None otherwise"""
+        record = self.records.get(name)
+        if record and record['hash'] == page_hash and record['params'] == params:
+            return record
+        return None
+
+    def record(self, name, page_hash, params, output, **extra):
+        """Records page :name: as done, :output: referring to its result (a path or an archive member)"""
+        record = dict(name=name, hash=page_hash, params=params, output=output, **extra)
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.records[name] = record
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,167 @@
+"""Vectorized NumPy kernels shared by the preprocessing functions in `pages2Text.preprocessing`
+and `sipSongPanNa.img2text`. The kernels work on plain arrays and know nothing about PIL,
+so that the wrappers keep their image-in/image-out interface and the copies don't drift apart."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def smart_binarize_rows(array, threshold, floor, ceiling, t_factor=2.2, last_pixel_quirk=True):
+    """Binarizes a 2d grayscale :array: in place row by row, classifying each row into one of three regimes:
+    - blank: the darkest pixel is well above the base :threshold: - the whole row turns white;
+    - pale text: the darkest pixel is above the bottom 2% of the [:floor: : :ceiling:] range - binarized over
+      the row-specific threshold (row min + row max) // :t_factor:;
+    - normal text: binarized over the base :threshold:.
+    All thresholds are gathered in one column and broadcast against the array in a single comparison.
+    :last_pixel_quirk: leave the last pixel of non-blank rows untouched, as the original per-pixel loop did
+    :returns: the modified array
+    """
+    bottom = array.min(axis=1).astype(np.int64)
+    top = array.max(axis=1).astype(np.int64)
+    blank = bottom > threshold * 1.5
+    pale = ~blank & (bottom > (floor + (ceiling - floor) * .02))
+    row_thresholds = np.where(pale, (bottom + top) // t_factor, threshold).astype(np.float64)
+    binary = np.where(array > row_thresholds[:, np.newaxis], 255, 0).astype(array.dtype)
+    if last_pixel_quirk:
+        binary[:, -1] = array[:, -1]
+    binary[blank] = 255
+    array[:] = binary
+    return array
+
+
+def clear_ray_positions(array, ray_width, start, trigger=.995, left_start=None):
+    """Finds content boundaries on a binary 2d :array: (True for white) the way a scanning 'ray' of :ray_width:
+    columns would, but from prefix sums of per-column white counts computed once instead of averaging every window.
+    The right ray starts :start: columns from the right edge and moves right, the left one starts at :left_start:
+    (:start: by default) and moves left down to column 1; each stops at the first window whose white fraction
+    exceeds :trigger:.
+    :returns: a 2-tuple of left and right window positions (first column of the window), None where the ray never
+    got through"""
+    height, width = array.shape
+    if not height or width <= ray_width:
+        return None, None
+    cumulative = np.concatenate(([0], np.cumsum(np.count_nonzero(array, axis=0))))
+    clear = (cumulative[ray_width:] - cumulative[:-ray_width]) / (height * ray_width) > trigger  # window i:i+ray_width
+    right = None
+    right_rays = clear[width - start: width - ray_width]
+    if right_rays.any():
+        right = width - start + int(np.argmax(right_rays))
+    left = None
+    left_start = start if left_start is None else left_start
+    if left_start >= 1:
+        left_rays = clear[left_start:0:-1]
+        if left_rays.any():
+            left = left_start - int(np.argmax(left_rays))
+    return left, right
+
+
+def clean_margins_array(array, ray_fraction=.02, trigger=.995):
+    """Clears all black pixels of a binary 2d :array: (True for white) outwards from the left and right content
+    boundaries found with `clear_ray_positions`. The ray is :ray_fraction: of the width wide (but no less than
+    3 pixels) and starts a quarter of the width in. Upper and lower halves of vertical images are processed
+    separately to deal with possible distortions.
+    :returns: modified array"""
+    height, width = array.shape
+    ray_width = max(int(width * ray_fraction), 3)
+    start = width // 4
+    if width < height:  # vertical image processing in two halves
+        halves = (slice(None, height // 2), slice(height // 2, None))
+    else:  # horizontal image, processing entire image in one go
+        halves = (slice(None),)
+    for half in halves:
+        left, right = clear_ray_positions(array[half], ray_width, start, trigger)
+        if right is not None:
+            array[half, (right + ray_width):] = True
+        if left is not None:
+            array[half, :left] = True
+    return array
+
+
+def projection_variances(ink, angles, workers=None):
+    """Scores candidate rotation :angles: (degrees, counterclockwise as in PIL's Image.rotate) of a boolean 2d :ink:
+    mask by the variance of its horizontal projection profile: the straighter the text lines, the sharper the peaks
+    and troughs of black pixel counts per row. Instead of rotating the image, ink pixel coordinates are taken once
+    and projected onto the rotated vertical axis for each angle; angles are evaluated on a pool of :workers: threads.
+    :returns: an array of scores aligned with :angles:"""
+    height, width = ink.shape
+    ys, xs = np.nonzero(ink)
+    ys = ys - height / 2
+    xs = xs - width / 2
+    reach = int(np.ceil(np.hypot(height, width) / 2)) + 1  # profile length fixed for all angles to compare fairly
+
+    def score(angle):
+        radians = np.deg2rad(angle)
+        rows = np.rint(ys * np.cos(radians) - xs * np.sin(radians)).astype(np.int64) + reach
+        return np.var(np.bincount(rows, minlength=2 * reach + 1))
+
+    if not len(ys):
+        return np.zeros(len(angles))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return np.fromiter(executor.map(score, angles), dtype=np.float64, count=len(angles))
+
+
+def estimate_skew_array(ink, span=5, coarse_step=1, fine_step=.1, workers=None):
+    """Estimates the skew of text lines in a boolean 2d :ink: mask with a coarse-to-fine sweep of projection profile
+    variances: ±:span: degrees in :coarse_step:, then ±:coarse_step: around the best coarse angle in :fine_step:.
+    :returns: a 2-tuple of the angle to rotate by (degrees, counterclockwise) and the confidence score in [0, 1] -
+    how far the best variance stands out from the median one of the coarse sweep (near 0 for blank or picture-only
+    pages where no angle is really better than another)"""
+    coarse = np.arange(-span, span + coarse_step / 2, coarse_step)
+    coarse_scores = projection_variances(ink, coarse, workers)
+    best = coarse[np.isclose(coarse_scores, coarse_scores.max())].mean()  # middle of a plateau, if any
+    fine = best + np.arange(-coarse_step, coarse_step + fine_step / 2, fine_step)
+    fine_scores = projection_variances(ink, fine, workers)
+    peak = fine_scores.max()
+    if not peak:
+        return 0.0, 0.0
+    angle = round(float(fine[np.isclose(fine_scores, peak)].mean()), 2) + 0.0  # + 0.0 turns -0.0 into 0.0
+    confidence = float((peak - np.median(coarse_scores)) / peak)
+    return angle, confidence
+
+
+def merged_runs(mask, min_gap=1):
+    """Finds runs of True values in a 1d boolean :mask:, merging runs separated by fewer than :min_gap: False values.
+    :returns: a 2-tuple of arrays of run starts and (exclusive) ends"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) > 1:
+        split = (starts[1:] - ends[:-1]) >= min_gap
+        starts = starts[np.concatenate(([True], split))]
+        ends = ends[np.concatenate((split, [True]))]
+    return starts, ends
+
+
+def column_spans(ink, threshold=.0009, gutter=.02):
+    """Splits a page represented by a boolean 2d :ink: mask into columns of text by its vertical projection:
+    columns with a proportion of ink above :threshold: are 'dark', and runs of light ones at least :gutter:
+    of the page width wide separate text columns.
+    :returns: a list of (left, right) column spans, right exclusive"""
+    dark_columns = ink.mean(axis=0) > threshold
+    starts, ends = merged_runs(dark_columns, max(int(ink.shape[1] * gutter), 1))
+    return list(zip(starts.tolist(), ends.tolist())) or [(0, ink.shape[1])]
+
+
+def segment_array(ink, threshold=.0009, gap=1, line_height_cap=.2, max_ink_density=.5, columns=False, gutter=.02):
+    """Finds text lines in a page represented by a boolean 2d :ink: mask. Rows with a proportion of ink above
+    :threshold: are 'dark', and bands of dark rows separated by fewer than :gap: light rows are lines of text,
+    padded by twice the :gap: at top and bottom. Bands taller than :line_height_cap: of the page height or denser
+    in ink than :max_ink_density: are taken for pictures and skipped. With :columns: the page is first split into
+    columns with `column_spans` and lines are searched for in each column separately.
+    :returns: an array of boxes, one per row as left, top, right, bottom"""
+    height, width = ink.shape
+    pad = gap * 2
+    spans = column_spans(ink, threshold, gutter) if columns else [(0, width)]
+    boxes = []
+    for left, right in spans:
+        row_ink = np.count_nonzero(ink[:, left:right], axis=1)
+        tops, ends = merged_runs(row_ink / (right - left) > threshold, gap)
+        cumulative = np.concatenate(([0], np.cumsum(row_ink)))
+        density = (cumulative[ends] - cumulative[tops]) / ((ends - tops) * (right - left))
+        tops = tops - pad
+        bottoms = ends - 1 + pad
+        keep = ((bottoms - tops) < height * line_height_cap) & (density <= max_ink_density)
+        for top, bottom in zip(tops[keep], bottoms[keep]):
+            boxes.append((left, max(top, 0), right, min(bottom, height)))
+    return np.array(boxes, dtype=np.int64).reshape(-1, 4)
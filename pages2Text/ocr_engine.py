@@ -0,0 +1,262 @@
+"""
+Recognition engine shared by the recognition call sites of the project (screen2text, page2text, img2text and
+preprocessing). Module-level `image_to_string`, `image_to_data` and `image_to_osd` mirror the pytesseract functions
+of the same names, so a call site switches over by just calling them from here instead.
+
+Two backends are available:
+- 'pool' keeps a pool of long-lived in-process Tesseract instances per (lang, oem) with models loaded once and
+  takes images in memory, for all three functions. It needs the tesserocr binding (https://github.com/sirfz/tesserocr);
+- 'subprocess' is the plain pytesseract path: a tesseract process per call with the image passed via a temporary file.
+The backend is picked with the OCR_ENGINE environment variable or `configure` ('auto' by default - the pool if
+tesserocr is installed, subprocess otherwise).
+Import it as `pages2Text.ocr_engine` everywhere, so there is one engine (and one pool) per process.
+"""
+
+import io
+import logging
+import os
+import shlex
+import threading
+from contextlib import contextmanager
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+ENGINE = os.environ.get('OCR_ENGINE', 'auto')  # 'auto', 'pool' or 'subprocess'
+TSV_HEADER = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n'
+POOL_SIZE = int(os.environ.get('OCR_POOL_SIZE', 0)) or os.cpu_count() or 2  # Tesseract instances per (lang, oem)
+
+
+def parse_config(config):
+    """
+    Splits a pytesseract-style config string into page segmentation mode and OCR engine mode.
+    :param config: config string as passed to pytesseract, e.g. '--psm 7 --oem 1'.
+    :return: a 3-tuple of psm (3 by default), oem (3 by default) and a list of any other options.
+    """
+    psm, oem, other = 3, 3, []
+    tokens = iter(shlex.split(config or ''))
+    for token in tokens:
+        if token == '--psm':
+            psm = int(next(tokens))
+        elif token == '--oem':
+            oem = int(next(tokens))
+        else:
+            other.append(token)
+    return psm, oem, other
+
+
+class SubprocessEngine:
+    """Runs a tesseract process for every call through pytesseract."""
+    name = 'subprocess'
+
+    def image_to_string(self, im, lang=None, config=''):
+        return pytesseract.image_to_string(im, lang=lang, config=config)
+
+    def image_to_data(self, im, lang=None, config='', output_type=pytesseract.Output.STRING):
+        return pytesseract.image_to_data(im, lang=lang, config=config, output_type=output_type)
+
+    def image_to_osd(self, im, lang='osd', config=''):
+        return pytesseract.image_to_osd(im, lang=lang, config=config)
+
+    def close(self):
+        pass
+
+
+class ApiPool:
+    """A bounded pool of long-lived Tesseract instances for one (lang, oem), created lazily up to :size:.
+    Once closed it hands out no instances, and those checked out are ended as they come back."""
+
+    def __init__(self, lang, oem, size, path=None):
+        self.lang = lang
+        self.oem = oem
+        self.size = size
+        self.path = path
+        self.idle = []  # instances released, the last one released handed out first
+        self.created = 0
+        self.checked_out = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # an instance released or the pool closed
+
+    def create(self):
+        kwargs = {'path': self.path} if self.path else {}
+        api = tesserocr.PyTessBaseAPI(lang=self.lang, oem=tesserocr.OEM(self.oem), **kwargs)
+        logger.info(f'tesseract instance #{self.created} loaded for {self.lang} (oem {self.oem})')
+        return api
+
+    def acquire(self):
+        with self.changed:
+            while True:
+                if self.closed:
+                    raise RuntimeError(f'tesseract pool for {self.lang} (oem {self.oem}) is closed')
+                if self.idle:
+                    api = self.idle.pop()
+                    break
+                if self.created < self.size:
+                    self.created += 1
+                    try:
+                        api = self.create()
+                    except Exception:
+                        self.created -= 1
+                        raise
+                    break
+                self.changed.wait()  # all instances busy, waiting for one to be released
+            self.checked_out += 1
+            return api
+
+    def release(self, api):
+        with self.changed:
+            self.checked_out -= 1
+            if self.closed:
+                api.End()
+            else:
+                self.idle.append(api)
+            self.changed.notify_all()
+
+    def close(self):
+        """Ends all instances of the pool, waiting for those checked out to be released"""
+        with self.changed:
+            self.closed = True
+            for api in self.idle:
+                api.End()
+            self.idle.clear()
+            self.changed.notify_all()
+            while self.checked_out:
+                self.changed.wait()
+
+
+class PoolEngine(SubprocessEngine):
+    """
+    Recognizes text with in-process Tesseract instances kept loaded in a pool per (lang, oem), giving results in
+    pytesseract's formats. Calls the pool can't serve as is (config options other than psm/oem, output types other
+    than string, bytes, dict and data frame) go the subprocess way.
+    """
+    name = 'pool'
+
+    def __init__(self, size=POOL_SIZE, path=os.environ.get('TESSDATA_PREFIX')):
+        if tesserocr is None:
+            raise ImportError('the pool engine needs tesserocr installed')
+        self.size = size
+        self.path = path
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self, lang, oem):
+        with self.lock:
+            if (lang, oem) not in self.pools:
+                self.pools[lang, oem] = ApiPool(lang, oem, self.size, self.path)
+            return self.pools[lang, oem]
+
+    @contextmanager
+    def api(self, lang, oem):
+        pool = self.get_pool(lang, oem)
+        api = pool.acquire()
+        try:
+            yield api
+        finally:
+            pool.release(api)
+
+    def image_to_string(self, im, lang=None, config=''):
+        psm, oem, other = parse_config(config)
+        if other:
+            return super().image_to_string(im, lang=lang, config=config)
+        with self.api(lang or 'eng', oem) as api:
+            api.SetPageSegMode(tesserocr.PSM(psm))
+            api.SetImage(im)
+            return api.GetUTF8Text()
+
+    def image_to_data(self, im, lang=None, config='', output_type=pytesseract.Output.STRING):
+        psm, oem, other = parse_config(config)
+        if other or output_type not in (pytesseract.Output.STRING, pytesseract.Output.BYTES, pytesseract.Output.DICT,
+                                        pytesseract.Output.DATAFRAME):
+            return super().image_to_data(im, lang=lang, config=config, output_type=output_type)
+        with self.api(lang or 'eng', oem) as api:
+            api.SetPageSegMode(tesserocr.PSM(psm))
+            api.SetImage(im)
+            tsv = TSV_HEADER + api.GetTSVText(0)
+        if output_type == pytesseract.Output.DICT:
+            return pytesseract.pytesseract.file_to_dict(tsv, '\t', -1)
+        if output_type == pytesseract.Output.DATAFRAME:
+            import pandas as pd
+            return pd.read_csv(io.StringIO(tsv), quoting=3, sep='\t')  # as pytesseract does, 3 for QUOTE_NONE
+        return tsv.encode('utf-8') if output_type == pytesseract.Output.BYTES else tsv
+
+    def image_to_osd(self, im, lang='osd', config=''):
+        _, _, other = parse_config(config)
+        if other:
+            return super().image_to_osd(im, lang=lang, config=config)
+        with self.api(lang, 0) as api:  # orientation detection is in the legacy engine only
+            api.SetPageSegMode(tesserocr.PSM.OSD_ONLY)
+            api.SetImage(im)
+            osd = api.DetectOrientationScript()
+        if not osd:  # too little text to tell, letting tesseract report it as it does
+            return super().image_to_osd(im, lang=lang, config=config)
+        # as tesseract prints it
+        return (f'Page number: 0\nOrientation in degrees: {osd["orient_deg"]}\n'
+                f'Rotate: {(360 - osd["orient_deg"]) % 360}\nOrientation confidence: {osd["orient_conf"]:.2f}\n'
+                f'Script: {osd["script_name"]}\nScript confidence: {osd["script_conf"]:.2f}\n')
+
+    def close(self):
+        """Ends all Tesseract instances, waiting for those in use to be done"""
+        with self.lock:
+            pools, self.pools = list(self.pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def create_engine(engine='auto', **kwargs):
+    """
+    Creates a recognition engine by name.
+    :param engine: 'pool', 'subprocess' or 'auto' for the pool if tesserocr is installed and subprocess otherwise.
+    :param kwargs: keyword arguments for the pool engine (pool size and tessdata path).
+    :return: the engine instance.
+    """
+    if engine == 'auto':
+        engine = 'pool' if tesserocr is not None else 'subprocess'
+    if engine == 'pool':
+        return PoolEngine(**kwargs)
+    if engine == 'subprocess':
+        return SubprocessEngine()
+    raise ValueError(f'unknown recognition engine: {engine}')
+
+
+def configure(engine='auto', **kwargs):
+    """Replaces the engine used by the module-level functions, closing the previous one."""
+    global _engine
+    with _engine_lock:
+        if _engine:
+            _engine.close()
+        _engine = create_engine(engine, **kwargs)
+        logger.info(f'recognition engine set to {_engine.name}')
+    return _engine
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(ENGINE)
+            logger.info(f'recognition engine set to {_engine.name}')
+        return _engine
+
+
+def image_to_string(im, lang=None, config=''):
+    return get_engine().image_to_string(im, lang=lang, config=config)
+
+
+def image_to_data(im, lang=None, config='', output_type=pytesseract.Output.STRING):
+    return get_engine().image_to_data(im, lang=lang, config=config, output_type=output_type)
+
+
+def image_to_osd(im, lang='osd', config=''):
+    return get_engine().image_to_osd(im, lang=lang, config=config)
@@ -1,6 +1,10 @@
+import numpy as np
 from PIL import Image, ImageDraw
 import pytesseract
 
+from pages2Text import ocr_engine as ocr
+from pages2Text.kernels import segment_array
+from pages2Text.page_source import PageSource
 from pages2Text.preprocessing import binarize_as_array, preprocess
 
 # tess_path = 'C:/Program Files/Tesseract-OCR/tesseract.exe'
@@ -15,53 +19,27 @@ TESSDATA_PREFIX = 'C:/Users/User/AppData/Local/Tesseract-OCR/tessdata'
 def segment(im,
             threshold=.0009,  # minimal proportion of black pixels in a row for it to qualify as a dark one
             gap=1,  # minimal gap between lines of text in pixels
-            line_height_cap=0.2  # max height of text line relative to image height (to skip large objects)
+            line_height_cap=0.2,  # max height of text line relative to image height (to skip large objects)
+            max_ink_density=.5,  # max proportion of black pixels in a text line (to skip pictures)
+            columns=False  # look for text lines in each column of a multi-column page separately
             ):
-    """returns a list of text line boxes, each as a four-tuple defining x, y for left upper and right bottom corners,
-    and the original image with the boxes superimposed on it as a 2-tuple (image, boxes)
-    needed dependencies:
-    - PIL.Image[,
-    - PIL.ImageDraw - only to display image with text boxes on it]"""
-
-    # Finding rows with proportion of black pixels above the threshold value ('dark rows')
-    dark_rows = []
-    left = 0
-    right = im.width
-    for y in range(im.height):
-        black = 0
-        for x in range(left, right):
-            if im.getpixel((x, y)) == 0:
-                black += 1
-        if black / (right - left) > threshold:
-            dark_rows.append(y)
-    # Identifying lines of text as bands where dark rows are closer to each other than the gap value
-    # and adding the pad value at top and bottom of each line
-    text_lines = []
-    pad = gap * 2
-    top = dark_rows[0]
-    for i in range(1, len(dark_rows)):
-        if dark_rows[i] - dark_rows[i - 1] > gap:
-            bottom = dark_rows[i - 1]
-            text_lines.append((top - pad, bottom + pad))
-            top = dark_rows[i]
-    if dark_rows[-1] - top > pad:
-        text_lines.append((top - pad, dark_rows[-1] + pad))
-    # preparing crop boxes for each detected text line:
-    boxes = []
-    # visualizing text lines as crop boxes on the image
-    # and storing crop boxes to the list
-    draw = ImageDraw.Draw(im)
-    for line in text_lines:
-        box = (left, line[0], right, line[1])
-        if line[1] - line[0] < im.height * line_height_cap:  # large pictures won't pass
-            draw.rectangle(box, fill=None, width=2, outline=0)
-            boxes.append(box)
-
-    return im, boxes
-
-
-# TODO: Rewrite the **segment** function using numpy array (and some other improvements)
-# TODO: Teach it to avoid pictures but keep the sideways text lines
+    """returns text line boxes as a NumPy array, each row defining x, y for left upper and right bottom corners.
+    Black pixel counts are taken from the image array in one go, lines of text are found as runs of dark rows
+    and pictures are skipped by their height and ink density (see `pages2Text.kernels.segment_array`).
+    The image is left as is; use `draw_boxes` to see the boxes on it."""
+    return segment_array(np.asarray(im) == 0, threshold, gap, line_height_cap, max_ink_density, columns)
+
+
+def draw_boxes(im, boxes, width=2, outline=0):
+    """Returns a copy of the image with text line :boxes: drawn on it"""
+    boxed = im.copy()
+    draw = ImageDraw.Draw(boxed)
+    for box in boxes:
+        draw.rectangle(tuple(box), fill=None, width=width, outline=outline)
+    return boxed
+
+
+# TODO: Teach it to keep the sideways text lines
 
 
 class Image2Text:
@@ -88,29 +66,43 @@ class Image2Text:
             print('Loading image with no preprocessing')
             self.im = image
 
+    @classmethod
+    def from_pages(cls, source, pre=False, binarize=False, prefetch=8):
+        """Yields a tuple of a Page and its Image2Text for each page of a zip archive or directory :source:,
+        pages being read and decoded ahead on background threads, :prefetch: at most (see `PageSource`).
+        Pages that could not be read are yielded with None for Image2Text.
+        :pre: and :binarize: are passed on to Image2Text"""
+        with PageSource(source, prefetch=prefetch, decode=not pre) as pages:
+            for page in pages:
+                if page.error:
+                    yield page, None
+                else:
+                    yield page, cls(page.file() if pre else page.im, pre=pre, binarize=binarize)
+
     def binarize(self, threshold=None, t_factor=1):
         self.bim = binarize_as_array(self.im.convert('L'), threshold, t_factor)
 
     def recognize_as_is(self, lang=None):
         if not lang:
             lang = input('Recognition language(s): ')
-        self.text = pytesseract.image_to_string(self.im, lang=lang)
+        self.text = ocr.image_to_string(self.im, lang=lang)
         print('Recognition with no segmentation completed.')
 
     def recognize_by_lines(self):
         """
-        Gets bounding boxes for each line of text superimposing them on the image to keep separately as `self.boxed_im`,
+        Gets bounding boxes for each line of text superimposing them on a copy of the image kept as `self.boxed_im`,
         crops each box from the image appending it to `self.crops`, and recognizes
         as a single line appending the obtained string to `self.lines`
         """
-        self.boxed_im, self.boxes = segment(self.bim)
+        self.boxes = segment(self.bim)
+        self.boxed_im = draw_boxes(self.bim, self.boxes)
         lang = input('Recognition language(s): ')
         if not lang:
             lang = 'tha'
         for box in self.boxes:
-            crop = self.bim.crop(box)
+            crop = self.bim.crop(tuple(box))
             self.crops.append(crop)
-            line = pytesseract.image_to_string(crop, config='--psm 7', lang=lang)
+            line = ocr.image_to_string(crop, config='--psm 7', lang=lang)
             self.lines.append(line)
         self.text = ''.join(self.lines)
         print('Recognition with segmentation completed.')
@@ -121,3 +113,8 @@ class Image2Text:
         with open(save_path, 'w', encoding='utf-8') as file:
             file.write(self.text)
         print(f'saved to {save_path}', end='\n\n')
+
+    def save_to_archive(self, sink, index, name):
+        """Queues recognition results of page number :index: to be written to `sink` (an ArchiveSink streaming
+        into a single archive) as `name` + txt extension"""
+        sink.put(index, {name + '.txt': self.text}, name=name)
@@ -0,0 +1,220 @@
+"""Output sink writing the results of processing pages - images, texts, JSON - into a single zip or tar archive
+as pages complete, instead of a loose file per result. Everything goes through one writer thread, so workers
+never contend on the filesystem, and pages are written in their original order whatever order they are put in.
+Already compressed images (png, jpeg...) are stored as they are, not compressed again. The archive ends with
+a manifest.json listing every page with its files and whatever was recorded about it.
+
+    with ArchiveSink('scans_out.zip') as sink:
+        for index, name, im in pages:
+            sink.put(index, {f'{name}.png': sink.encode(im)}, name=name)
+"""
+
+import io
+import json
+import os
+import queue
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.tif', '.tiff', '.zip', '.gz')
+MANIFEST_NAME = 'manifest.json'
+_DONE = object()
+
+
+class ArchiveSink:
+
+    def __init__(self, path, max_pending=64):
+        """
+        :param path: archive to write, a tar archive if it ends with .tar, .tar.gz or .tgz, a zip archive otherwise.
+        :param max_pending: most pages waiting to be written; `put` blocks beyond that.
+        """
+        self.path = path
+        self.tar = path.endswith(('.tar', '.tar.gz', '.tgz'))
+        self.queue = queue.Queue(max_pending)
+        self.waiting = {}  # pages put ahead of the ones before them
+        self.next_index = 0
+        self.manifest = []
+        self.error = None
+        self.closed = False
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if self.tar:
+            self.archive = tarfile.open(path, 'w:gz' if path.endswith(('.gz', '.tgz')) else 'w')
+        else:
+            self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        self.thread = threading.Thread(target=self.write_all, name='archive-writer', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def encode(im, format='png'):
+        """Returns a PIL image encoded as :format:"""
+        buffer = io.BytesIO()
+        im.save(buffer, format)
+        return buffer.getvalue()
+
+    def put(self, index, files, **record):
+        """
+        Queues the files of page number :index: (counting from 0, every index to be put once) for writing.
+        :param files: dict of archive names to contents (bytes, or str written as utf-8), may be empty.
+        :param record: anything to keep in the manifest about the page (name, seconds, error...).
+        """
+        if self.error:
+            raise RuntimeError(f'writing {self.path} failed') from self.error
+        files = {name: content.encode('utf-8') if isinstance(content, str) else content
+                 for name, content in files.items()}
+        self.queue.put((index, files, record))
+
+    def write_all(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                break
+            if self.error:
+                continue
+            index, files, record = item
+            self.waiting[index] = files, record
+            try:
+                while self.next_index in self.waiting:  # pages go in in their original order
+                    files, record = self.waiting.pop(self.next_index)
+                    for name, content in files.items():
+                        self.write(name, content)
+                    self.manifest.append(dict(index=self.next_index, files=list(files), **record))
+                    self.next_index += 1
+                self.flush()
+            except Exception as e:
+                self.error = e
+
+    def write(self, name, content):
+        if self.tar:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = time.time()
+            self.archive.addfile(info, io.BytesIO(content))
+        else:
+            stored = name.lower().endswith(STORED_EXTENSIONS)
+            self.archive.writestr(name, content, zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+
+    def flush(self):
+        """Hands what is written over to the OS, for pages done to be recoverable from the archive even if the
+        process is killed before closing it (see `ArchiveReader`)"""
+        fileobj = self.archive.fileobj if self.tar else self.archive.fp
+        if fileobj:
+            fileobj.flush()
+
+    def close(self, files=None, **summary):
+        """Writes what is left (pages missing before them included, out of order), then :files: (dict of archive
+        names to contents) not belonging to any page and the manifest with :summary: added, and closes the archive"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_DONE)
+        self.thread.join()
+        try:
+            if not self.error:
+                for index in sorted(self.waiting):
+                    page_files, record = self.waiting.pop(index)
+                    for name, content in page_files.items():
+                        self.write(name, content)
+                    self.manifest.append(dict(index=index, files=list(page_files), **record))
+                for name, content in (files or {}).items():
+                    self.write(name, content.encode('utf-8') if isinstance(content, str) else content)
+                manifest = dict(summary, pages=self.manifest)
+                self.write(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+        finally:
+            self.archive.close()
+        if self.error:
+            raise RuntimeError(f'writing {self.path} failed') from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader:
+    """Reads members back from an archive written by ArchiveSink, as much of it as is readable if it was cut short:
+    the members before the tear of a tar archive, the members found by their local headers in a zip archive
+    that lacks its central directory"""
+
+    def __init__(self, path, tar=None):
+        """:param tar: reads :path: as a tar archive if True, as a zip if False, as its extension says if None"""
+        self.path = path
+        self.archive = None
+        self.members = {}
+        try:
+            if path.endswith(('.tar', '.tar.gz', '.tgz')) if tar is None else tar:
+                self.archive = tarfile.open(path)
+                try:
+                    for member in self.archive:
+                        self.members[member.name] = member
+                except (tarfile.TarError, EOFError, OSError, zlib.error):
+                    pass  # torn: the members before the tear are still good
+            else:
+                try:
+                    self.archive = zipfile.ZipFile(path)
+                    self.members = {info.filename: info for info in self.archive.infolist()}
+                except zipfile.BadZipFile:  # cut short before the central directory was written
+                    self.archive = open(path, 'rb')
+                    self.members = self.scan_local_headers(self.archive)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, zlib.error):
+            self.archive = None
+
+    @staticmethod
+    def scan_local_headers(file):
+        """Returns {name: (data offset, compressed size, compression, crc)} of the complete members of a zip archive
+        going by their local file headers from the start of :file:, up to the first incomplete one"""
+        members = {}
+        size = os.fstat(file.fileno()).st_size
+        offset = 0
+        while offset + zipfile.sizeFileHeader <= size:
+            file.seek(offset)
+            (signature, _, _, flags, compression, _, _, crc, compressed_size, _, name_length,
+             extra_length) = struct.unpack(zipfile.structFileHeader, file.read(zipfile.sizeFileHeader))
+            if signature != zipfile.stringFileHeader:
+                break  # the central directory (or garbage) from here
+            if flags & 0x08:
+                break  # sizes in a data descriptor after the data, not written by ArchiveSink
+            name = file.read(name_length).decode('utf-8')
+            data_offset = offset + zipfile.sizeFileHeader + name_length + extra_length
+            if data_offset + compressed_size > size:
+                break  # torn
+            members[name] = data_offset, compressed_size, compression, crc
+            offset = data_offset + compressed_size
+        return members
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def read(self, name):
+        """Returns the content of member :name:, None if it is missing or unreadable"""
+        member = self.members.get(name)
+        if member is None:
+            return None
+        try:
+            if isinstance(self.archive, zipfile.ZipFile):
+                return self.archive.read(member)
+            if isinstance(self.archive, tarfile.TarFile):
+                return self.archive.extractfile(member).read()
+            data_offset, compressed_size, compression, crc = member
+            self.archive.seek(data_offset)
+            content = self.archive.read(compressed_size)
+            if compression == zipfile.ZIP_DEFLATED:
+                content = zlib.decompress(content, -15)
+            elif compression != zipfile.ZIP_STORED:
+                return None
+            return content if zlib.crc32(content) == crc else None
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, zlib.error):
+            return None
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
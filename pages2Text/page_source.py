@@ -0,0 +1,129 @@
+"""Streaming source of pages from a zip archive or a directory of page images: members are read, decompressed and
+(optionally) decoded ahead of the consumer on background threads, so I/O and decoding overlap with the processing
+of earlier pages. At most :prefetch: pages are in flight (being read or waiting to be taken) at any time, which
+caps memory use however large the archive is. Pages come out in archive (or sorted directory) order.
+
+    with PageSource('scans.zip', prefetch=8) as pages:
+        for page in pages:
+            process(page.im)
+    print(pages.stats)
+"""
+
+import io
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.gif', '.webp')
+
+
+def list_pages(source):
+    """Returns names of the page images in a zip archive or directory :source:, in the order they are stored
+    (archive) or sorted (directory)"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    else:
+        names = sorted(name for name in os.listdir(source) if os.path.isfile(os.path.join(source, name)))
+    return [name for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+@dataclass
+class Page:
+    index: int  # position of the page in the source
+    name: str
+    data: bytes = None  # file content as stored
+    im: Image.Image = None  # decoded image, if decoding
+    error: str = None  # why the page could not be read or decoded
+
+    def file(self):
+        """Returns the page content as a file, for functions taking image files"""
+        return io.BytesIO(self.data)
+
+
+class PageSource:
+
+    def __init__(self, source, names=None, prefetch=8, threads=2, decode=True, mode='L'):
+        """
+        :param source: zip archive or directory of page images.
+        :param names: names of the pages to read, all pages of the source by default.
+        :param prefetch: most pages read ahead of the consumer, in memory at once.
+        :param threads: background threads reading and decoding pages.
+        :param decode: decodes pages into PIL images (in :mode:) if True, leaves them as bytes otherwise.
+        """
+        self.source = source
+        self.names = list_pages(source) if names is None else list(names)
+        self.prefetch = max(1, prefetch)
+        self.threads = threads
+        self.decode = decode
+        self.mode = mode
+        self.archive = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+        self.executor = None
+        self.lock = threading.Lock()
+        # waits: pages the consumer had to wait for, wait_seconds: time it spent waiting (starved)
+        self.stats = dict(pages=0, failed=0, waits=0, wait_seconds=0., read_seconds=0., decode_seconds=0.)
+
+    def __len__(self):
+        return len(self.names)
+
+    def read(self, index, name):
+        """Reads (and decodes) a page, on a background thread"""
+        page = Page(index, name)
+        start = perf_counter()
+        try:
+            if self.archive:
+                page.data = self.archive.read(name)
+            else:
+                with open(os.path.join(self.source, name), 'rb') as file:
+                    page.data = file.read()
+            read = perf_counter()
+            if self.decode:
+                page.im = Image.open(io.BytesIO(page.data)).convert(self.mode)
+            with self.lock:
+                self.stats['read_seconds'] += read - start
+                self.stats['decode_seconds'] += perf_counter() - read
+        except Exception as e:
+            page.error = f'{type(e).__name__}: {e}'
+        return page
+
+    def __iter__(self):
+        self.executor = self.executor or ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='pages')
+        names = enumerate(self.names)
+        in_flight = deque()
+        for index, name in names:  # fill the window
+            in_flight.append(self.executor.submit(self.read, index, name))
+            if len(in_flight) == self.prefetch:
+                break
+        while in_flight:
+            future = in_flight.popleft()
+            if not future.done():
+                start = perf_counter()
+                future.result()
+                self.stats['waits'] += 1
+                self.stats['wait_seconds'] += perf_counter() - start
+            page = future.result()
+            for index, name in names:  # the page taken frees a place in the window for the next one
+                in_flight.append(self.executor.submit(self.read, index, name))
+                break
+            self.stats['pages'] += 1
+            self.stats['failed'] += page.error is not None
+            yield page
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        if self.archive:
+            self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
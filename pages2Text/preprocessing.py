@@ -1,8 +1,12 @@
+from functools import partial
+
 import numpy as np
-import pytesseract
 from PIL import Image
 from skimage.filters import threshold_minimum, threshold_otsu
 
+from pages2Text import ocr_engine as ocr
+from pages2Text.kernels import clean_margins_array, estimate_skew_array, smart_binarize_rows
+
 # NOTATION NOTE -  as applied to variable/parameter names in the code below:
 # 'image' refers to a general image file
 # 'im' refers to a PIL image object
@@ -65,13 +69,14 @@ def clean_edges_as_array(array, threshold):
     return array
 
 
-def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False):
+def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False, last_pixel_quirk=True):
     """Takes a PIL image in 'L' mode and changes each pixel value to O (black) or 255 (white) over the dynamically
     adjusted row-specific threshold
     :image: PIL image object
     :threshold: a value over which to binarize. If not specified, set automatically to the midpoint
     between minimum and maximum luminosity values in the entire image, then dynamically adjusted for rows
     potentially containing pale text according to row-specific extremes
+    :last_pixel_quirk: leave the last pixel of each text row as is (compatibility with the former per-pixel loop)
     :returns a PIL image object in binary mode ('1')
     """
     array = np.asarray(im).copy()
@@ -95,26 +100,9 @@ def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False):
         array = array.T
         print(' - transposed')
         transposed = True
-    for row in array:
-        bottom = int(row.min())
-        top = int(row.max())
-        if bottom > threshold * 1.5:  # entire row well above the threshold - no text, turn to white
-            row[:] = 255
-        elif bottom > (floor + (ceiling - floor) * .02):
-            # might have some pale text - cautiously binarize over row-specific threshold
-            row_threshold = (bottom + top) // t_factor
-            # print(row_threshold, end=', ')
-            for i in range(len(row) - 1):
-                if row[i] > row_threshold:
-                    row[i] = 255
-                else:
-                    row[i] = 0
-        else:  # such rows are most likely to have normal black text - binarize over the base threshold
-            for i in range(len(row) - 1):
-                if row[i] > threshold:
-                    row[i] = 255
-                else:
-                    row[i] = 0
+    # rows well above the threshold turn white, rows that might have some pale text are cautiously binarized
+    # over row-specific thresholds, the rest (most likely normal black text) over the base threshold
+    smart_binarize_rows(array, threshold, floor, ceiling, t_factor, last_pixel_quirk)
     if transposed:
         print(' - transposing back...')
         array = array.T
@@ -122,7 +110,7 @@ def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False):
 
 
 def count_white_rows(im):
-    """Utility function used by deskew.
+    """Utility function used by orientation.
     Takes a binarized image, returns the number of pixel rows with zero black pixels"""
     array = np.asarray(im)
     count = 0
@@ -163,93 +151,40 @@ def clean_edges(im):
     return Image.fromarray(array)
 
 
-def clean_margins(im):
+def clean_margins(im, ray_fraction=.02, trigger=.995):
     """Takes a binarized PIL image object (mode '1'), identifies left and right content boundaries and clears all
-    black pixels towards the edges. A scanning 'ray' of set width will start some reasonable distance into the image
-    and scan towards each edge. As soon as it can shoot through from top to bottom detecting no or very few non-white
-    pixels - this is considered content boundary. Any black pixels from this line towards the edge will be cleared.
+    black pixels towards the edges. A scanning 'ray' of :ray_fraction: of the image width will start some reasonable
+    distance into the image and scan towards each edge. As soon as it can shoot through from top to bottom detecting
+    no or very few non-white pixels (white fraction over :trigger:) - this is considered content boundary. Any black
+    pixels from this line towards the edge will be cleared.
     Upper and lower halves of vertical images are processed separately to deal with possible distortions.
     Returns image with clean margins """
     array = np.asarray(im).copy()  # converting the image to Numpy array
-    ray_width = int(im.width * .02)  # setting scanning ray width to a fraction of the image width
-    trigger = .995
-    if ray_width < 3:
-        ray_width = 3  # but no less than 3 pixels
-    start = im.width // 4
-    if im.width < im.height:  # vertical image processing in two halves
-        slash = im.height // 2
-        # Processing the upper half
-        # Wiping the right margin clean
-        for i in range(im.width - start, im.width - ray_width):
-            if np.mean(array[:slash, i: (i + ray_width)]) > trigger:
-                array[:slash, (i + ray_width):] = True
-                break
-        # Wiping the left margin clean
-        for i in range(start):
-            i = start - i
-            if np.mean(array[:slash, i: (i + ray_width)]) > trigger:
-                array[:slash, :i] = True
-                break
-        # Processing the lower half
-        # Wiping the right margin clean
-        for i in range(im.width - start, im.width - ray_width):
-            if np.mean(array[slash:, i: (i + ray_width)]) > trigger:
-                array[slash:, (i + ray_width):] = True
-                break
-        # Wiping the left margin clean
-        for i in range(start):
-            i = start - i
-            if np.mean(array[slash:, i: (i + ray_width)]) > trigger:
-                array[slash:, : i] = True
-                break
-    else:  # horizontal image, processing entire image in one go
-        # Wiping the right margin clean
-        for i in range(im.width - start, im.width - ray_width):
-            if np.mean(array[:, i: (i + ray_width)]) > trigger:
-                array[:, (i + ray_width):] = True
-                break
-        # Wiping the left margin clean
-        for i in range(start):
-            i = start - i
-            if np.mean(array[:, i: (i + ray_width)]) > trigger:
-                array[:, :i] = True
-                break
-    return Image.fromarray(array)
+    return Image.fromarray(clean_margins_array(array, ray_fraction, trigger))
 
 
-def deskew(im, echo=False):
-    """Takes a (slightly) skewed image with text as PIL object in mode '1' and returns its straigthened copy"""
-    angle = 0
+def estimate_skew(im, span=5, proxy_size=800):
+    """Takes a binarized PIL image object with text (mode '1') and estimates its skew from horizontal projection
+    profiles of a reduced central crop, sweeping ±:span: degrees coarse-to-fine down to a tenth of a degree.
+    :returns: a 2-tuple of the angle to rotate the image by (degrees, counterclockwise) and the confidence score
+    in [0, 1]"""
     trial = im.crop((int(im.width * 0.1), int(im.height * 0.1),
                      int(im.width * 0.9), int(im.height * 0.9)))
-    if max(trial.size) > 800:
-        trial = small(trial, factor=(max(im.size) // 800)).convert('1', dither=0)
+    if max(trial.size) > proxy_size:
+        trial = small(trial, factor=(max(trial.size) // proxy_size + 1)).convert('1', dither=0)
     print(f' - reduced to {trial.size}')
-    # Trying positive tilt
-    if count_white_rows(clean_edges(trial.rotate(1))) > count_white_rows(trial):
-        trial = clean_edges(trial.rotate(1))
-        angle += 1
-        if echo:
-            print(f' {angle}', end=' ')
-        # and incrementing if helps
-        while count_white_rows(clean_edges(trial.rotate(1))) > count_white_rows(trial):
-            trial = clean_edges(trial.rotate(1))
-            angle += 1
-            if echo:
-                print(f' {angle}', end=' ')
-    # Trying negative tilt
-    elif count_white_rows(clean_edges(trial.rotate(-1))) > count_white_rows(trial):
-        trial = clean_edges(trial.rotate(-1))
-        angle -= 1
-        if echo:
-            print(f' {angle}', end=' ')
-        # and incrementing if helps
-        while count_white_rows(clean_edges(trial.rotate(-1))) > count_white_rows(trial):
-            trial = clean_edges(trial.rotate(-1))
-            angle -= 1
-            if echo:
-                print(f' {angle}', end=' ')
-    else:  # returning unchanged image
+    ink = ~np.asarray(trial.convert('1', dither=0))
+    return estimate_skew_array(ink, span=span)
+
+
+def deskew(im, echo=False, min_confidence=.2):
+    """Takes a (slightly) skewed image with text as PIL object in mode '1' and returns its straigthened copy,
+    rotated once by the angle found with `estimate_skew`. The image is returned unchanged if it is already straight
+    or the estimate is less confident than :min_confidence: (no clear text lines to go by)"""
+    angle, confidence = estimate_skew(im)
+    if echo:
+        print(f' - skew estimate {angle} degrees, confidence {confidence:.2f}')
+    if not angle or confidence < min_confidence:
         if echo:
             print(' - no adjustment needed')
         return im
@@ -259,7 +194,7 @@ def deskew(im, echo=False):
 
 def tesseract_osd(im):
     """Checks image orientation with tesseract and rotates it if necessary"""
-    osd = pytesseract.image_to_osd(im).split('\n')
+    osd = ocr.image_to_osd(im).split('\n')
     print(f'Tesseract: {osd}', sep='\n')
     angle = int(osd[1].split(': ')[1])
     if angle != 0:
@@ -268,18 +203,26 @@ def tesseract_osd(im):
     return im
 
 
-def preprocess(image, threshold=None):
+def preprocess_stages(threshold=None):
+    """Returns the chain of stages of `preprocess` as (name, function, parameters) tuples"""
+    return (
+        ('Showing to Tesseract', tesseract_osd, {}),
+        ('Binarizing', binarize_as_array, dict(threshold=threshold)),
+        ('Cleaning edges', clean_edges, {}),
+        ('Deskewing', partial(deskew, echo=True), {}),
+        ('Cleaning margins', clean_margins, {}),
+    )
+
+
+def preprocess(image, threshold=None, cache=None):
     """Takes an image with text, returns binarized straightened image with cleaned margins;
-    uses a chain of functions defined above"""
+    uses a chain of functions defined above. With a StageCache :cache: the chain resumes after the deepest stage
+    done before for the same image and parameters"""
     im = load_image(image)
-    print('Loaded. Showing to Tesseract...')
-    im = tesseract_osd(im)
-    print('Binarizing...')
-    im = binarize_as_array(im, threshold=threshold)
-    print('Cleaning edges...')
-    im = clean_edges(im)
-    print('Deskewing...')
-    im = deskew(im, echo=True)
-    print('Cleaning margins...')
-    im = clean_margins(im)
+    print('Loaded.')
+    if cache is not None:
+        return cache.run(im, preprocess_stages(threshold))
+    for name, func, params in preprocess_stages(threshold):
+        print(f'{name}...')
+        im = func(im, **params)
     return im
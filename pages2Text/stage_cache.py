@@ -0,0 +1,166 @@
+"""Content-addressed on-disk cache of the outputs of image processing stages (such as those of `preprocess`), so that
+rerunning a chain of stages on the same image resumes from the deepest stage already done with the same parameters,
+and changing a parameter costs only the stages downstream of it.
+The key of a stage output is a hash of the key of its input (the image pixels for the first stage), the stage name,
+its parameters and the version of its code (a hash of the source of the module defining the stage function and
+of the modules it computes with, DEPENDENCIES, plus CODE_VERSION to bump for changes elsewhere).
+Outputs are stored png encoded (bilevel images, the bulk of them, take a few kB) in an SQLite database, evicting
+the least recently used ones beyond :max_bytes:."""
+
+import functools
+import hashlib
+import importlib
+import inspect
+import io
+import json
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+CODE_VERSION = 1
+
+
+DEPENDENCIES = ('pages2Text.kernels',)  # modules the stages compute with, besides their own
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash(module_name):
+    try:
+        source = inspect.getsource(importlib.import_module(module_name))
+    except (OSError, TypeError, ImportError):
+        source = module_name
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def function_version(func):
+    modules = (func.__module__, *DEPENDENCIES)
+    spec = f'{CODE_VERSION}\n{func.__qualname__}\n' + '\n'.join(source_hash(module) for module in modules)
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()[:16]
+
+
+def code_version(func):
+    """Version of the code of :func: (of the function wrapped by a partial): a hash of the sources of its module
+    and DEPENDENCIES, and CODE_VERSION. Cached by function, partials made afresh for every page included"""
+    while hasattr(func, 'func'):
+        func = func.func
+    return function_version(func)
+
+
+def image_hash(im):
+    digest = hashlib.sha256(f'{im.mode}{im.size}'.encode())
+    digest.update(im.tobytes())
+    return digest.hexdigest()
+
+
+def stage_key(input_key, name, func, params):
+    spec = json.dumps(dict(input=input_key, stage=name, params=params, code=code_version(func)),
+                      sort_keys=True, default=str)
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()
+
+
+class StageCache:
+
+    def __init__(self, path='stage_cache.sqlite3', max_bytes=512 * 2 ** 20):
+        """
+        :param path: SQLite database file, ':memory:' for a cache lasting as long as the object.
+        :param max_bytes: total size of the stored outputs beyond which the least recently used are evicted.
+        """
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)  # shared by worker processes
+        self.db.execute('CREATE TABLE IF NOT EXISTS stages '
+                        '(key TEXT PRIMARY KEY, used_at REAL NOT NULL, size INTEGER NOT NULL, value BLOB NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS stages_used_at ON stages (used_at)')
+        self.db.commit()
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM stages').fetchone()[0]
+
+    def get(self, key, count=True):
+        """Returns the image stored under :key: or None, counted as a hit or a miss unless :count: is False"""
+        with self.lock:
+            row = self.db.execute('SELECT value FROM stages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += count
+                return None
+            self.db.execute('UPDATE stages SET used_at = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+            self.hits += count
+        im = Image.open(io.BytesIO(row[0]))
+        im.load()
+        return im
+
+    def put(self, key, im):
+        buffer = io.BytesIO()
+        im.save(buffer, 'png', optimize=im.mode == '1')
+        value = buffer.getvalue()
+        with self.lock:
+            replaced = self.db.execute('SELECT size FROM stages WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO stages (key, used_at, size, value) VALUES (?, ?, ?, ?)',
+                            (key, time.time(), len(value), value))
+            self.size += len(value) - (replaced[0] if replaced else 0)
+            if self.size > self.max_bytes:
+                self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """
+        Deletes the least recently used outputs until the total size is within max_bytes (lock held). The size kept
+        along by `put` counts only the writes of this process: the total is summed afresh here, as other processes
+        may be writing to the same database.
+        """
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM stages').fetchone()[0]
+        while self.size > self.max_bytes:
+            rows = self.db.execute('SELECT key, size FROM stages ORDER BY used_at LIMIT 64').fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for key, size in rows:
+                self.db.execute('DELETE FROM stages WHERE key = ?', (key,))
+                self.size -= size
+                if self.size <= self.max_bytes:
+                    break
+
+    def run(self, im, stages, echo=True):
+        """
+        Runs :im: through :stages: - (name, function, parameters) tuples, each function taking an image and the
+        parameters as keywords and returning an image - starting after the deepest stage found in the cache and
+        storing the outputs of the stages run. Counted as one hit if any stage output was found, one miss otherwise.
+        :return: output of the last stage.
+        """
+        keys = []
+        key = image_hash(im)
+        for name, func, params in stages:
+            key = stage_key(key, name, func, params)
+            keys.append(key)
+        start = 0
+        for i in range(len(stages) - 1, -1, -1):  # deepest first
+            cached = self.get(keys[i], count=False)
+            if cached is not None:
+                im = cached
+                start = i + 1
+                if echo:
+                    print(f' - resuming after cached stage {stages[i][0]}')
+                break
+        with self.lock:
+            if start:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for (name, func, params), key in zip(stages[start:], keys[start:]):
+            if echo:
+                print(f'{name}...')
+            im = func(im, **params)
+            self.put(key, im)
+        return im
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute('SELECT COUNT(*) FROM stages').fetchone()[0]
+        return dict(entries=entries, bytes=self.size, hits=self.hits, misses=self.misses)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,142 @@
+"""Batch runs over a small synthetic archive of pages, binarized only (no tesseract needed)."""
+import io
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import zipfile
+
+import pytest
+from PIL import Image, ImageDraw
+
+from pages2Text.batch import STEPS, iter_batch, run_batch
+from pages2Text.page_sink import ArchiveReader
+from pages2Text.page_source import PageSource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PAGES = 12
+
+
+def page_image(i):
+    im = Image.new('L', (300, 400), 230)
+    draw = ImageDraw.Draw(im)
+    for y in range(30, 370, 25):
+        draw.text((20, y), f'page {i} line {y}' * 3, fill=20)
+    buffer = io.BytesIO()
+    im.save(buffer, 'png')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def scans(tmp_path):
+    path = tmp_path / 'scans.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        for i in range(PAGES):
+            archive.writestr(f'p{i:02}.png', page_image(i))
+    return str(path)
+
+
+def run_killed(scans, output, after):
+    """Runs the batch in another process killed with SIGKILL once :after: pages are done"""
+    script = textwrap.dedent(f'''
+        import os, signal, time
+        from pages2Text.batch import run_batch
+
+        def progress(result, done, total):
+            if done == {after}:
+                time.sleep(.5)  # for the archive writer to catch up
+                os.kill(os.getpid(), signal.SIGKILL)
+
+        run_batch({scans!r}, 'binarize', {output!r}, workers=2, progress=progress)
+    ''')
+    process = subprocess.Popen([sys.executable, '-c', script], cwd=ROOT, start_new_session=True,
+                               env=dict(os.environ, PYTHONPATH=ROOT))
+    assert process.wait(timeout=120) == -signal.SIGKILL
+    try:
+        os.killpg(process.pid, signal.SIGKILL)  # the orphaned workers
+    except ProcessLookupError:
+        pass
+
+
+def test_resumes_zip_output_after_kill(scans, tmp_path):
+    output = str(tmp_path / 'out.zip')
+    run_killed(scans, output, after=5)
+    with pytest.raises(zipfile.BadZipFile):
+        zipfile.ZipFile(output)  # no central directory
+    recovered = ArchiveReader(output)
+    assert len(recovered) >= 5
+    assert all(recovered.read(name) for name in recovered.members)
+    recovered.close()
+
+    results = run_batch(scans, 'binarize', output, workers=2, progress=None)
+    assert [result.name for result in results] == [f'p{i:02}.png' for i in range(PAGES)]
+    assert sum(result.resumed for result in results) >= 5
+    assert not any(result.error for result in results)
+    with zipfile.ZipFile(output) as archive:
+        assert archive.namelist() == [f'p{i:02}.png' for i in range(PAGES)] + ['manifest.json']
+        assert archive.testzip() is None
+    assert not [name for name in os.listdir(tmp_path) if '.previous' in name]
+
+
+def test_rerun_resumes_all(scans, tmp_path):
+    output = str(tmp_path / 'out')
+    run_batch(scans, 'binarize', output, workers=2, progress=None)
+    results = run_batch(scans, 'binarize', output, workers=2, progress=None)
+    assert all(result.resumed for result in results)
+    results = run_batch(scans, 'binarize', output, workers=2, progress=None, threshold=100)
+    assert not any(result.resumed for result in results)
+
+
+def test_unsafe_member_names_fail(tmp_path):
+    scans = str(tmp_path / 'scans.zip')
+    with zipfile.ZipFile(scans, 'w') as archive:
+        for name in ('p00.png', '../../x.png', '/abs.png', 'sub/../../y.png', 'sub/p01.png'):
+            archive.writestr(name, page_image(0))
+    output = tmp_path / 'out' / 'dir'
+    results = run_batch(scans, 'binarize', str(output), workers=2, progress=None)
+    assert [bool(result.error) for result in results] == [False, True, True, True, False]
+    assert all('unsafe page name' in result.error for result in results if result.error)
+    assert sorted(os.listdir(tmp_path)) == ['out', 'scans.zip']
+    assert sorted(os.listdir(tmp_path / 'out')) == ['dir']
+    assert (output / 'sub' / 'p01.png').exists()
+
+
+def test_broken_pool_fails_pages_in_flight(scans, monkeypatch):
+    crash = page_image(3)
+
+    def binarize_or_die(image, options):
+        if image.getvalue() == crash:
+            os._exit(1)  # as a worker killed by the OOM killer
+        return STEPS['binarize'](image, options)
+
+    monkeypatch.setitem(STEPS, 'die-on-3', binarize_or_die)  # the workers are forked with it
+    results = [result for result, _ in iter_batch(scans, ['die-on-3'], None, workers=2, prefetch=4)]
+    assert [result.name for result in results] == [f'p{i:02}.png' for i in range(PAGES)]
+    failed = [result.index for result in results if result.error]
+    assert 3 in failed and len(failed) <= 4
+    assert all('BrokenProcessPool' in results[index].error for index in failed)
+    assert all(result.data for result in results[failed[-1] + 1:])  # the later pages done in a new pool
+
+
+def test_prefetch_bounds_pages_in_memory(scans, monkeypatch):
+    started = []
+    read = PageSource.read
+
+    def counted_read(self, index, name):
+        started.append(index)
+        return read(self, index, name)
+
+    monkeypatch.setattr(PageSource, 'read', counted_read)
+    for result, done in iter_batch(scans, ['binarize'], None, workers=2, prefetch=4):
+        assert len(started) - (done - 1) <= 4  # pages read, not handed over yet (this one included)
+    assert len(started) == PAGES
+
+
+def test_resumes_whatever_the_prefetch_and_unread_options(scans, tmp_path):
+    output = str(tmp_path / 'out.zip')
+    run_batch(scans, 'binarize', output, workers=2, progress=None, prefetch=4)
+    results = run_batch(scans, 'binarize', output, workers=2, progress=None)
+    assert all(result.resumed for result in results)
+    results = run_batch(scans, 'binarize', output, workers=2, progress=None, prefetch=6, lang='eng', psm=7)
+    assert all(result.resumed for result in results)  # binarizing reads neither of them
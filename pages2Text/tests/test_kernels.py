@@ -0,0 +1,154 @@
+"""The NumPy kernels against the per-pixel loops they replaced, on synthetic pages"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pages2Text.benchmarks.deskew import reference_skew
+from pages2Text.benchmarks.smart_binarize import reference_smart_binarize
+from pages2Text.kernels import clean_margins_array, estimate_skew_array, segment_array, smart_binarize_rows
+from pages2Text.preprocessing import smart_binarize_as_array
+
+
+def grayscale_page(width, height, seed):
+    """A grayscale page with dark and pale 'text' bands, blank gaps and noise"""
+    rng = np.random.default_rng(seed)
+    array = rng.integers(200, 250, size=(height, width), dtype=np.uint8)
+    for y in range(20, height - 20, 24):
+        ink = 10 if (y // 24) % 3 else 120  # every third band is pale
+        band = array[y:y + 12, 20:width - 20]
+        band[rng.random(band.shape) < .3] = ink
+    array[height // 2: height // 2 + 6] = 255  # blank rows
+    return array
+
+
+def binary_page(width, height, seed, margin_noise=True):
+    """A binarized page (True for white) of text lines, with specks and black bars in the margins"""
+    rng = np.random.default_rng(seed)
+    array = np.ones((height, width), dtype=bool)
+    for y in range(30, height - 30, 22):
+        band = array[y:y + 11, width // 8: width - width // 8]
+        band[rng.random(band.shape) < .25] = False
+    if margin_noise:
+        array[:, :4] = False  # scanner shadow
+        array[rng.integers(0, height, 40), rng.integers(width - width // 10, width, 40)] = False
+    return array
+
+
+def reference_binarize_rows(array, threshold, floor, ceiling, t_factor=2.2):
+    """The former per-pixel loop of smart_binarize_as_array"""
+    for row in array:
+        bottom = int(row.min())
+        top = int(row.max())
+        if bottom > threshold * 1.5:
+            row[:] = 255
+        elif bottom > (floor + (ceiling - floor) * .02):
+            row_threshold = (bottom + top) // t_factor
+            for i in range(len(row) - 1):
+                row[i] = 255 if row[i] > row_threshold else 0
+        else:
+            for i in range(len(row) - 1):
+                row[i] = 255 if row[i] > threshold else 0
+    return array
+
+
+def reference_clean_margins(array, ray_fraction=.02, trigger=.995):
+    """The former clean_margins, shooting a ray window by window with a mean over each"""
+    height, width = array.shape
+    ray_width = max(int(width * ray_fraction), 3)
+    start = width // 4
+    halves = (slice(None, height // 2), slice(height // 2, None)) if width < height else (slice(None),)
+    for half in halves:
+        for i in range(width - start, width - ray_width):
+            if np.mean(array[half, i: (i + ray_width)]) > trigger:
+                array[half, (i + ray_width):] = True
+                break
+        for i in range(start):
+            i = start - i
+            if np.mean(array[half, i: (i + ray_width)]) > trigger:
+                array[half, :i] = True
+                break
+    return array
+
+
+def reference_segment(im, threshold=.0009, gap=1, line_height_cap=.2):
+    """The former segment, counting black pixels with getpixel"""
+    dark_rows = []
+    for y in range(im.height):
+        black = sum(1 for x in range(im.width) if im.getpixel((x, y)) == 0)
+        if black / im.width > threshold:
+            dark_rows.append(y)
+    text_lines = []
+    pad = gap * 2
+    top = dark_rows[0]
+    for i in range(1, len(dark_rows)):
+        if dark_rows[i] - dark_rows[i - 1] > gap:
+            text_lines.append((top - pad, dark_rows[i - 1] + pad))
+            top = dark_rows[i]
+    if dark_rows[-1] - top > pad:
+        text_lines.append((top - pad, dark_rows[-1] + pad))
+    return [(0, top, im.width, bottom) for top, bottom in text_lines if bottom - top < im.height * line_height_cap]
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('t_factor', [2.2, 1.7])
+def test_smart_binarize_rows_like_the_loop(seed, t_factor):
+    array = grayscale_page(240, 180, seed)
+    floor, ceiling = int(array.min()), int(array.max())
+    threshold = int((floor + ceiling) / t_factor)
+    expected = reference_binarize_rows(array.copy(), threshold, floor, ceiling, t_factor)
+    assert np.array_equal(smart_binarize_rows(array, threshold, floor, ceiling, t_factor), expected)
+
+
+@pytest.mark.parametrize('size', [(300, 200), (200, 300)])  # horizontal and transposed vertical pages
+def test_smart_binarize_as_array_like_the_loop(size):
+    im = Image.fromarray(grayscale_page(*size, seed=1))
+    assert np.array_equal(np.asarray(smart_binarize_as_array(im)), np.asarray(reference_smart_binarize(im)))
+
+
+@pytest.mark.parametrize('size', [(400, 300), (300, 400), (40, 30), (400, 60)])
+@pytest.mark.parametrize('seed', range(2))
+def test_clean_margins_array_like_the_loop(size, seed):
+    array = binary_page(*size, seed)
+    expected = reference_clean_margins(array.copy())
+    assert np.array_equal(clean_margins_array(array), expected)
+
+
+def test_clean_margins_array_leaves_pages_with_no_clear_ray():
+    array = np.zeros((50, 80), dtype=bool)
+    assert np.array_equal(clean_margins_array(array.copy()), reference_clean_margins(array.copy()))
+    assert not clean_margins_array(array).any()
+
+
+def tilted_page(tilt):
+    return Image.fromarray(binary_page(700, 900, seed=0, margin_noise=False)).rotate(tilt, fillcolor=1)
+
+
+@pytest.mark.parametrize('tilt', [0, .6, -1.4, 2.3, -3.8])
+def test_estimate_skew_array_straightens(tilt):
+    angle, confidence = estimate_skew_array(~np.asarray(tilted_page(tilt)))
+    assert abs(angle + tilt) <= .2
+    assert confidence > .5
+
+
+@pytest.mark.parametrize('tilt', [0, .6, -.8, -1.4])
+def test_estimate_skew_array_like_the_whole_degree_search(tilt):
+    """Within the degree the former search went by, for tilts it got right: it climbed greedily one degree at
+    a time and could stop short on larger ones"""
+    page = tilted_page(tilt)
+    angle, _ = estimate_skew_array(~np.asarray(page))
+    assert abs(angle - reference_skew(page)) <= 1
+
+
+def test_estimate_skew_array_not_confident_on_blank_pages():
+    assert estimate_skew_array(np.zeros((100, 80), dtype=bool)) == (0.0, 0.0)
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_segment_array_like_the_loop(seed):
+    page = binary_page(160, 220, seed, margin_noise=False)
+    page[180:200, 30:130] = False  # a picture, taller than the lines but under the height cap
+    expected = reference_segment(Image.fromarray(page))
+    boxes = segment_array(~page, max_ink_density=1)
+    assert np.array_equal(boxes, np.array(expected))
+    assert len(segment_array(~page)) == len(expected) - 1  # the dense picture skipped by default
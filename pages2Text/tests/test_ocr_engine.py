@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from pages2Text.ocr_engine import ApiPool
+
+
+class Api:
+    """Stands for a Tesseract instance, only recording it was ended"""
+    def __init__(self):
+        self.ended = False
+
+    def End(self):
+        self.ended = True
+
+
+class Pool(ApiPool):
+    """ApiPool of stand-in instances"""
+    def create(self):
+        return Api()
+
+
+def test_close_waits_for_checked_out_instances():
+    pool = Pool('tha', 3, size=2)
+    idle, busy = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    closing = threading.Thread(target=pool.close)
+    closing.start()
+    closing.join(.2)
+    assert closing.is_alive() and idle.ended and not busy.ended
+    pool.release(busy)  # returned late, ended instead of going back to the pool
+    closing.join(5)
+    assert not closing.is_alive() and busy.ended
+    assert pool.idle == []
+
+
+def test_no_checkouts_once_closed():
+    pool = Pool('tha', 3, size=1)
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    assert pool.created == 0
+
+
+def test_waiting_checkout_refused_on_close():
+    pool = Pool('tha', 3, size=1)
+    busy = pool.acquire()
+    errors = []
+
+    def acquire():
+        try:
+            pool.acquire()
+        except RuntimeError as e:
+            errors.append(e)
+
+    waiting = threading.Thread(target=acquire)
+    waiting.start()
+    closing = threading.Thread(target=pool.close)
+    closing.start()
+    waiting.join(5)
+    assert errors  # woken up by the close, not handed an instance
+    pool.release(busy)
+    closing.join(5)
+    assert busy.ended and not closing.is_alive()
@@ -0,0 +1,87 @@
+from PIL import Image, ImageDraw
+
+from pages2Text import stage_cache
+from pages2Text.preprocessing import preprocess_stages
+from pages2Text.stage_cache import StageCache, code_version, function_version
+
+
+def page():
+    im = Image.new('L', (400, 500), 230)
+    draw = ImageDraw.Draw(im)
+    for y in range(40, 460, 30):
+        draw.text((30, y), 'some text on the line ' * 2, fill=20)
+    return im
+
+
+def counted(stages, calls):
+    """The :stages: with their functions counting their calls in :calls:"""
+    def wrap(name, func):
+        def stage(im, **params):
+            calls.append(name)
+            return func(im, **params)
+        stage.func = func  # versioned as the function it wraps
+        return stage
+    return [(name, wrap(name, func), params) for name, func, params in stages]
+
+
+def test_resumes_from_deepest_cached_stage():
+    cache = StageCache(':memory:')
+    stages = preprocess_stages()[1:]  # all but tesseract's orientation check
+    calls = []
+    cache.run(page(), counted(stages, calls), echo=False)
+    assert len(calls) == len(stages)
+    calls.clear()
+    cache.run(page(), counted(stages, calls), echo=False)
+    assert calls == []
+    cache.run(page(), counted(preprocess_stages(threshold=150)[1:], calls), echo=False)
+    assert calls == [name for name, _, _ in stages]  # binarization is the first of them
+
+
+def test_code_version_covers_dependencies(monkeypatch):
+    deskew = preprocess_stages()[3][1]
+    before = code_version(deskew)
+    function_version.cache_clear()
+    real = stage_cache.source_hash
+    monkeypatch.setattr(stage_cache, 'source_hash',
+                        lambda module: 'changed' if module == 'pages2Text.kernels' else real(module))
+    assert code_version(deskew) != before
+    function_version.cache_clear()
+
+
+def test_code_versions_cached_per_function():
+    function_version.cache_clear()
+    for _ in range(100):
+        for _, func, _ in preprocess_stages():
+            code_version(func)
+    assert function_version.cache_info().currsize == len(preprocess_stages())
+
+
+def test_counts_one_hit_or_miss_per_run():
+    cache = StageCache(':memory:')
+    stages = preprocess_stages()[1:]
+    cache.run(page(), stages, echo=False)
+    assert (cache.hits, cache.misses) == (0, 1)
+    cache.run(page(), stages, echo=False)
+    cache.run(page(), preprocess_stages(threshold=150)[1:], echo=False)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_size_tracked_along_and_evicted(tmp_path):
+    path = str(tmp_path / 'stages.sqlite3')
+    cache = StageCache(path, max_bytes=10 ** 9)
+    small, large = Image.new('L', (20, 20), 0), page()
+    for i in range(5):
+        cache.put(f'key {i}', small)
+    cache.put('key 0', large)  # replaced
+    total = cache.db.execute('SELECT SUM(size) FROM stages').fetchone()[0]
+    assert cache.stats()['bytes'] == total and cache.stats()['entries'] == 5
+    other = StageCache(path)  # another process writing to the same database
+    other.put('key 5', large)
+    cache.max_bytes = total
+    cache.put('key 6', small)  # over by its own count, evicting down from the actual total, other's writes in
+    assert cache.size <= cache.max_bytes
+    assert cache.size == cache.db.execute('SELECT SUM(size) FROM stages').fetchone()[0]
+    assert cache.get('key 1', count=False) is None  # least recently used first
+    assert cache.get('key 6', count=False) is not None
+    other.close()
+    cache.close()
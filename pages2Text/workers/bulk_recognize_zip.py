@@ -3,6 +3,7 @@ import zipfile
 from time import time
 from imgzip2text import preprocess, get_paths, load_image
 import pytesseract
+from pages2Text import ocr_engine as ocr
 pytesseract.pytesseract.tesseract_cmd = r'C:\Users\Maksim Mislavskii\AppData\Local\Tesseract-OCR\tesseract.exe'
 
 # import sqlite3
@@ -19,10 +20,10 @@ with zipfile.ZipFile(path) as imgzip:
                 im = preprocess(cur)
             else:
                 im = load_image(cur)
-            text = pytesseract.image_to_string(im,
-                                               lang='tha',
-                                               config='--psm 4'
-                                               )
+            text = ocr.image_to_string(im,
+                                       lang='tha',
+                                       config='--psm 4'
+                                       )
             print(text, end='\n' * 2)
 
 print(f'Done in {round(time() - start, 1)} seconds.')
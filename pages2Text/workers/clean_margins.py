@@ -1,50 +1,38 @@
 from PIL import Image
 import numpy as np
 
+from pages2Text.kernels import clear_ray_positions
 
-def clean_margins(im):
+
+def clean_margins(im, ray_fraction=.005, trigger=.99):
     """Takes a binarized PIL image object (mode '1'), identifies left and right content boundaries
     and clears all black pixels towards the edges by finding the vertical content boundaries and
-    wiping any black artifacts off the margins. A scanning 'ray' of set width will start in the center
-    and scan towards each edge. As soon as it can shoot through from top to bottom detecting no non-white
-    pixels - this is considered content boundary. Any black pixels from this line towards the edge will be cleared.
+    wiping any black artifacts off the margins. A scanning 'ray' of :ray_fraction: of the image width will start
+    a third of the width in and scan towards each edge. As soon as it can shoot through from top to bottom detecting
+    no non-white pixels (white fraction over :trigger:) - this is considered content boundary. Any black pixels from
+    this line towards the edge will be cleared.
     Upper and lower halves of the image are processed separately to deal with possibly slanted perspective.
     Returns cleaner image"""
     array = np.asarray(im).copy()  # converting the image to Numpy array
-    ray_width = int(im.width * .005)  # setting scanning ray width to a fraction of the image width
+    ray_width = int(im.width * ray_fraction)  # setting scanning ray width to a fraction of the image width
     if ray_width < 3:
         ray_width = 3  # but no less than 3 pixels
     start = im.width // 3
     slash = im.height // 2
-    # Processing the upper half
-    # Wiping the right margin clean
-    for i in range(im.width - start, im.width - ray_width):
-        if np.mean(array[:slash, i: (i + ray_width)]) > .99:
-            array[:slash, (i + ray_width):] = True
-            break
-    # Wiping the left margin clean
-    for i in range(ray_width, start):
-        i = start - i
-        if np.mean(array[:slash, i: (i + ray_width)]) > .99:
-            array[:slash, : (i - ray_width)] = True
-            break
-    # Processing the lower half
-    # Wiping the right margin clean
-    for i in range(im.width - start, im.width - ray_width):
-        if np.mean(array[slash:, i: (i + ray_width)]) > .99:
-            array[slash:, (i + ray_width):] = True
-            break
-    # Wiping the left margin clean
-    for i in range(ray_width, start):
-        i = start - i
-        if np.mean(array[slash:, i: (i + ray_width)]) > .99:
-            array[slash:, : (i - ray_width)] = True
-            break
+    for half in (slice(None, slash), slice(slash, None)):
+        left, right = clear_ray_positions(array[half], ray_width, start, trigger, left_start=start - ray_width)
+        # Wiping the right margin clean
+        if right is not None:
+            array[half, (right + ray_width):] = True
+        # Wiping the left margin clean
+        if left is not None:
+            array[half, : (left - ray_width)] = True
     return Image.fromarray(array)
 
 
-im = Image.open('../resources/IMG_5265.jpg').convert('1', dither=0)
+if __name__ == '__main__':
+    im = Image.open('../resources/IMG_5265.jpg').convert('1', dither=0)
 
-im = clean_margins(im)
+    im = clean_margins(im)
 
-im.show()
+    im.show()
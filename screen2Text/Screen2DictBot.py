@@ -1,8 +1,14 @@
+import argparse
+import os
+import secrets
+import signal
+import threading
+
 from telegram import Update
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler
 
-from bot_config import token
 from bot_utils import *
+from webhook import UpdateReceiver
 
 
 # TODO: Testing
@@ -28,45 +34,26 @@ def start(update: Update, context: CallbackContext) -> None:
 def service(update: Update, context: CallbackContext) -> None:
     """
     This function is added to the dispatcher as a general handler for messages coming from the Bot API.
-    If message has text and a word to look up can be obtained from it, dictionary lookup is performed;
-    If message has image, compressed or uncompressed, that image is being processed;
+    If message has text and a word to look up can be obtained from it, dictionary lookup job is queued;
+    If message has image, compressed or uncompressed, a job processing that image is queued;
     If none of the above, baffled message is issued to the original sender.
+    Queued jobs reply to the user when done, so the handler returns right away.
     """
     message = update.message
     if message.text:
         logger.info(f'incoming text message from {message.from_user.full_name}')
-        word = obtain_word(message)
-        if word:
-            do_lookup(message, context, word)
+        query = obtain_query(message)
+        if query:
+            submit_job('lookup', message, context, do_lookup, query)
         else:
             send_hint(message, context)
     elif message.photo or message.document:
-        file = None
-        if message.photo:
-            logger.info(f'incoming photo from {message.from_user.full_name} detected by service handler.')
-            file = context.bot.get_file(message.photo[0].file_id)
-            send_compressed_confirmation(message, context)
-        elif message.document:
-            logger.info(f'incoming file from {message.from_user.full_name} detected by service handler.')
-            file = context.bot.get_file(message.document.file_id)
-            if file.file_path.endswith('.png') or file.file_path.endswith('.jpg'):
-                send_uncompressed_confirmation(message, context)
-            else:
-                send_rejection_note(message, context)
-                return
-        logger.info(f'loading {file.file_path}')
-        r = dlp.retry_or_none(rq.get, 3, 1, file.file_path, timeout=30)
-        if not r:
-            send_failure_note(message, context)
-            return
-        results_dict[message.from_user.id] = do_recognize(r, message, context)  # TODO: catch exception, notify user
-        suggestions = results_dict[message.from_user.id]
-        choices = generate_choices(suggestions)
-        send_choices(message, context, choices)
-        return
+        logger.info(f'incoming {"photo" if message.photo else "file"} from {message.from_user.full_name} '
+                    f'detected by service handler.')
+        submit_job('ocr', message, context, do_image)
     else:
         send_baffled(message, context)
-        return
+    return
 
 
 def menu(update: Update, context: CallbackContext) -> None:  # Not yet implemented
@@ -118,13 +105,83 @@ def error_handler(update: Update, context: CallbackContext):
     tb_logger.error(context.error, exc_info=True)
 
 
-def main() -> None:
-    updater = Updater(token, request_kwargs={'read_timeout': 10})
-
-    # Get the dispatcher to register handlers
-    # Then, we register each handler and the conditions the update must meet to trigger it
+def register_gauges():
+    """Exposes cache, prefetch and job queue state along with the request metrics"""
+    lookup_cache = dlp.get_cache()
+    recognition_cache = dlp.get_recognition_cache()
+    prefetcher = dlp.get_prefetcher()
+    metrics.registry.register_gauges('bot_lookup_cache', lambda: dict(lookup_cache.hits, misses=lookup_cache.misses))
+    metrics.registry.register_gauges(
+        'bot_recognition_cache', lambda: dict(recognition_cache.hits, misses=recognition_cache.misses))
+    metrics.registry.register_gauges('bot_prefetch', lambda: dict(prefetcher.stats, hit_rate=prefetcher.hit_rate))
+    metrics.registry.register_gauges('bot_jobs', lambda: dict(pending=jobs.pending, users=len(jobs.in_flight)))
+
+
+def parse_args(args=None):
+    """Serving options, each defaulting to an environment variable"""
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description='Runs the Screen2Dict Telegram bot.')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default=env('BOT_MODE', 'polling'),
+                        help='get updates by long polling or receive them on a webhook (BOT_MODE)')
+    parser.add_argument('--listen', default=env('WEBHOOK_LISTEN', '127.0.0.1'),
+                        help='address the webhook receiver listens on (WEBHOOK_LISTEN)')
+    parser.add_argument('--port', type=int, default=int(env('WEBHOOK_PORT', 8443)),
+                        help='port the webhook receiver listens on (WEBHOOK_PORT)')
+    parser.add_argument('--path', default=env('WEBHOOK_PATH', '/telegram'),
+                        help='URL path updates are posted to, best kept secret (WEBHOOK_PATH)')
+    parser.add_argument('--webhook-url', default=env('WEBHOOK_URL'),
+                        help='public URL to register with Telegram, e.g. of a TLS-terminating proxy forwarding to '
+                             'the receiver; left unset, the webhook is not registered (WEBHOOK_URL)')
+    parser.add_argument('--secret-token', default=env('WEBHOOK_SECRET_TOKEN'),
+                        help='token Telegram sends with every update for the receiver to check, a random one '
+                             'by default when the webhook is registered (WEBHOOK_SECRET_TOKEN)')
+    parser.add_argument('--record', default=env('WEBHOOK_RECORD'),
+                        help='file to append received update payloads to for replaying (WEBHOOK_RECORD)')
+    parser.add_argument('--api-url', default=env('TELEGRAM_API_URL'),
+                        help='Bot API base URL to use instead of Telegram\'s, e.g. of a local stand-in '
+                             '(TELEGRAM_API_URL)')
+    parser.add_argument('--file-url', default=env('TELEGRAM_FILE_URL'),
+                        help='Bot API file download base URL to go with --api-url (TELEGRAM_FILE_URL)')
+    parser.add_argument('--poll-interval', type=float, default=float(env('POLL_INTERVAL', 2)),
+                        help='seconds between long polling requests (POLL_INTERVAL)')
+    return parser.parse_args(args)
+
+
+def run_webhook(updater: Updater, args) -> None:
+    """
+    Serves updates posted to the webhook receiver until interrupted (Ctrl-C, SIGINT or SIGTERM), registering the
+    webhook with Telegram first if its public URL is given.
+    """
     dispatcher = updater.dispatcher
-
+    secret_token = args.secret_token or (secrets.token_urlsafe(32) if args.webhook_url else None)
+    receiver = UpdateReceiver(dispatcher, args.listen, args.port, args.path, args.record, secret_token)
+
+    def stop(signum, frame):
+        logger.info(f'{signal.Signals(signum).name} received, stopping...')
+        # shutdown waits for serve_forever to return, which it can't while this handler runs on its thread
+        threading.Thread(target=receiver.shutdown, name='stopping').start()
+
+    previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+    dispatcher_thread = threading.Thread(target=dispatcher.start, name='dispatcher')
+    dispatcher_thread.start()
+    if args.webhook_url:
+        updater.bot.set_webhook(url=args.webhook_url, secret_token=secret_token)
+        logger.info(f'webhook registered at {args.webhook_url}')
+    logger.info(f'receiving updates on {receiver.url}')
+    try:
+        receiver.serve_forever()
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        receiver.server_close()
+        dispatcher.stop()
+        dispatcher_thread.join()
+
+
+def register_handlers(dispatcher) -> None:
+    """
+    Registers the bot's handlers on the dispatcher, each with the conditions the update must meet to trigger it.
+    """
     # Register commands
     dispatcher.add_handler(CommandHandler("start", start))
     dispatcher.add_handler(CommandHandler("menu", menu))
@@ -138,11 +195,31 @@ def main() -> None:
 
     dispatcher.add_error_handler(error_handler)
 
-    # Start the Bot
-    updater.start_polling(poll_interval=2, timeout=10, bootstrap_retries=2)
 
-    # Run the bot until you press Ctrl-C
-    updater.idle()
+def main() -> None:
+    from bot_config import token  # kept out of module imports for handlers to be usable without it (benchmarks)
+
+    args = parse_args()
+    updater = Updater(token, base_url=args.api_url, base_file_url=args.file_url, request_kwargs={'read_timeout': 10})
+    results_store.purge()  # drop results expired while the bot was down
+    if metrics.configure():  # with METRICS_PORT set
+        register_gauges()
+
+    register_handlers(updater.dispatcher)
+
+    if args.mode == 'webhook':
+        # Serve updates Telegram posts until you press Ctrl-C or the process is sent SIGTERM
+        run_webhook(updater, args)
+    else:
+        # Start the Bot (polling deletes any webhook set before)
+        updater.start_polling(poll_interval=args.poll_interval, timeout=10, bootstrap_retries=2)
+
+        # Run the bot until you press Ctrl-C
+        updater.idle()
+
+    # Let the jobs already accepted finish and reply
+    jobs.shutdown()
+    results_store.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,212 @@
+"""
+Load test of the bot: runs its handlers (as registered by `Screen2DictBot.register_handlers`, with the job runner
+behind them) against local stand-ins for the Telegram Bot API and Longdo from `stub_servers`, with simulated users
+each sending a mix of photo, document and lookup messages one after another, waiting for the bot's final reply to
+each. Reports throughput, latency percentiles and outcome rates, and writes them as JSON (with the commit tested)
+for comparing between commits.
+Run from this directory: python bench_bot_load.py --users 20 --messages 10 --mix photo=1,document=1,lookup=3
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from time import perf_counter
+
+from PIL import Image
+from telegram import Update
+from telegram.ext import Updater
+
+import bot_utils
+import Screen2DictBot as bot
+from lookup_cache import LookupCache
+from replay_updates import sample_update, SAMPLE_WORDS
+from stub_servers import LongdoStub, TelegramStub
+
+OUTCOMES = (  # final replies by their beginnings
+    ('ok', ('Lookup results', 'Choose suggestion')),
+    ('no_results', ('No meaningful',)),
+    ('busy', (bot_utils.BUSY_MESSAGE, bot_utils.USER_LIMIT_MESSAGE)),
+    ('error', ('Something went wrong', 'File could not be accepted')),
+)
+
+
+def outcome(text):
+    for name, beginnings in OUTCOMES:
+        if text.startswith(beginnings):
+            return name
+    return None
+
+
+def image_variants(path, n):
+    """Returns :n: png encodings of the image at :path:, each with a pixel changed for the recognition cache to miss"""
+    im = Image.open(path).convert('RGB')
+    variants = []
+    for i in range(n):
+        variant = im.copy()
+        variant.putpixel((i % im.width, i // im.width % im.height), (i % 256, 0, 0))
+        buffer = io.BytesIO()
+        variant.save(buffer, 'png')
+        variants.append(buffer.getvalue())
+    return variants
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, weight = part.split('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def percentile(values, q):
+    """Nearest-rank :q: percentile of sorted :values:"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + .5) - 1))]
+
+
+class LoadTest:
+
+    def __init__(self, users, messages, mix, image_path='test_image.png', unique_images=True, timeout=120,
+                 telegram_delay=0.0, longdo_delay=0.0, seed=0):
+        self.users = users
+        self.messages = messages
+        self.mix = mix
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.telegram = TelegramStub(telegram_delay)
+        self.longdo = LongdoStub(longdo_delay)
+        n_images = users * messages if unique_images else 1
+        self.images = image_variants(image_path, n_images)
+        self.update_ids = iter(range(1, 10 ** 9))
+        self.id_lock = threading.Lock()
+        self.results = []  # (kind, outcome, seconds)
+        self.results_lock = threading.Lock()
+
+    def next_id(self):
+        with self.id_lock:
+            return next(self.update_ids)
+
+    def make_update(self, kind, user_id):
+        update_id = self.next_id()
+        if kind == 'lookup':
+            return sample_update(update_id, f'lookup {self.random.choice(SAMPLE_WORDS)}', user_id)
+        update = sample_update(update_id, None, user_id)
+        del update['message']['text']
+        content = self.images[update_id % len(self.images)]
+        file_id = f'f{update_id}'
+        self.telegram.add_file(file_id, content, 'image.png', unique_id=f'u{update_id % len(self.images)}')
+        attachment = {'file_id': file_id, 'file_unique_id': f'u{update_id % len(self.images)}',
+                      'file_size': len(content)}
+        if kind == 'photo':
+            update['message']['photo'] = [dict(attachment, width=100, height=40)]
+        else:
+            update['message']['document'] = dict(attachment, file_name='image.png', mime_type='image/png')
+        return update
+
+    def simulate_user(self, dispatcher, user_id, kinds):
+        for kind in kinds:
+            since = len(self.telegram.sent)
+            update = Update.de_json(self.make_update(kind, user_id), dispatcher.bot)
+            start = perf_counter()
+            dispatcher.update_queue.put(update)
+            reply = self.telegram.wait_sent(user_id, lambda text: outcome(text) is not None, since, self.timeout)
+            seconds = perf_counter() - start
+            with self.results_lock:
+                self.results.append((kind, outcome(reply[2]) if reply else 'timeout', seconds))
+            while user_id in bot_utils.jobs.in_flight:  # the job may still be wrapping up after its reply
+                time.sleep(.001)
+
+    def run(self):
+        with self.telegram, self.longdo:
+            bot_utils.dlp.dic_url = self.longdo.search_url
+            updater = Updater('123:stub', base_url=self.telegram.api_url, base_file_url=self.telegram.file_url)
+            bot.register_handlers(updater.dispatcher)
+            dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='dispatcher')
+            dispatcher_thread.start()
+            kinds, weights = zip(*self.mix.items())
+            plans = [self.random.choices(kinds, weights, k=self.messages) for _ in range(self.users)]
+            threads = [threading.Thread(target=self.simulate_user, args=(updater.dispatcher, 1000 + i, plan))
+                       for i, plan in enumerate(plans)]
+            start = perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = perf_counter() - start
+            updater.dispatcher.stop()
+            dispatcher_thread.join()
+            return self.report(elapsed)
+
+    def report(self, elapsed):
+        def summary(results):
+            latencies = sorted(seconds for _, _, seconds in results)
+            outcomes = {}
+            for _, result, _ in results:
+                outcomes[result] = outcomes.get(result, 0) + 1
+            return dict(count=len(results), outcomes=outcomes,
+                        error_rate=round(sum(n for name, n in outcomes.items() if name != 'ok') / len(results), 4)
+                        if results else None,
+                        p50=percentile(latencies, 50), p95=percentile(latencies, 95),
+                        p99=percentile(latencies, 99), max=latencies[-1] if latencies else None)
+
+        report = dict(overall=summary(self.results),
+                      throughput=round(len(self.results) / elapsed, 3), seconds=round(elapsed, 3),
+                      by_kind={kind: summary([result for result in self.results if result[0] == kind])
+                               for kind in self.mix})
+        return report
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-tests the bot against local Telegram and Longdo stand-ins.')
+    parser.add_argument('--users', type=int, default=10, help='simulated users sending messages concurrently')
+    parser.add_argument('--messages', type=int, default=5, help='messages each user sends, one after another')
+    parser.add_argument('--mix', default='photo=1,document=1,lookup=3', help='relative weights of message kinds')
+    parser.add_argument('--image', default='test_image.png', help='image sent in photo and document messages')
+    parser.add_argument('--same-image', action='store_true',
+                        help='send the very same image every time, letting the recognition cache answer repeats')
+    parser.add_argument('--telegram-delay', type=float, default=0.0, help='seconds the Bot API stand-in takes')
+    parser.add_argument('--longdo-delay', type=float, default=0.0, help='seconds the Longdo stand-in takes')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for a final reply')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='load_test.json', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    # fresh in-memory caches and results for every run
+    bot_utils.dlp.cache_path = None
+    bot_utils.dlp.recognition_cache_path = None
+    bot_utils.results_store = LookupCache(None, bot_utils.RESULTS_CAPACITY, bot_utils.RESULTS_TTL, normalize=str)
+
+    test = LoadTest(args.users, args.messages, parse_mix(args.mix), args.image, not args.same_image, args.timeout,
+                    args.telegram_delay, args.longdo_delay, args.seed)
+    report = test.run()
+    bot_utils.jobs.shutdown()
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    result = dict(commit=commit(), time=time.strftime('%Y-%m-%dT%H:%M:%S'), config=config, **report)
+    with open(args.output, 'w', encoding='utf-8') as out:
+        json.dump(result, out, indent=2)
+    overall = report['overall']
+    print(f'{overall["count"]} messages in {report["seconds"]} s: {report["throughput"]} messages/s, '
+          f'p50 {overall["p50"]:.3f} s, p95 {overall["p95"]:.3f} s, p99 {overall["p99"]:.3f} s, '
+          f'outcomes {overall["outcomes"]}')
+    for kind, summary in report['by_kind'].items():
+        if summary['count']:
+            print(f'{kind:>10}: {summary["count"]} messages, p50 {summary["p50"]:.3f} s, p95 {summary["p95"]:.3f} s, '
+                  f'error rate {summary["error_rate"]:.1%}')
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Compares parsing dictionary result pages with `DictLookup.parse_results` against building a full BeautifulSoup tree
+and searching it as lookups used to, in time and peak memory per page (Python allocations as traced by
+tracemalloc, which does not see the C heap of lxml's own tree).
+Run from this directory: python bench_longdo_parse.py [directory_with_saved_pages]
+(saved Longdo result pages, *.html; pages built by `stub_servers.longdo_page` are used if none given)
+"""
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+
+from bs4 import BeautifulSoup as bs
+
+from screen2text import DictLookup
+from stub_servers import longdo_page
+
+
+def soup_extract(page):
+    soup = bs(page.decode('utf-8'), features="lxml")
+    headers = soup.find_all('td', attrs={'class': 'search-table-header'})
+    tables = soup.find_all('table', attrs={'class': 'search-result-table'})
+    return [[header.text, [[cell.text for cell in row.find_all('td')] for row in table.find_all('tr')]]
+            for header, table in zip(headers, tables)]
+
+
+def measure(func, pages, repeat=5):
+    start = perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            func(page)
+    seconds = (perf_counter() - start) / repeat / len(pages)
+    peaks = []
+    for page in pages:
+        tracemalloc.start()
+        func(page)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return seconds, max(peaks)
+
+
+def main():
+    if len(sys.argv) > 1:
+        folder = sys.argv[1]
+        pages = [open(os.path.join(folder, name), 'rb').read()
+                 for name in sorted(os.listdir(folder)) if name.endswith('.html')]
+    else:
+        pages = [longdo_page(word, rows=12, filler_size=120000).encode('utf-8')
+                 for word in ('แมว', 'หมา', 'cat')]
+    print(f'{len(pages)} pages, {sum(map(len, pages)) // len(pages) // 1024} KB on average')
+    for page in pages:
+        assert [section[:2] for section in DictLookup.parse_results(page)] == soup_extract(page)
+    for name, func in (('BeautifulSoup tree', soup_extract), ('parse_results', DictLookup.parse_results)):
+        seconds, peak = measure(func, pages)
+        print(f'{name:>20}: {seconds * 1000:.2f} ms per page, peak memory {peak / 1024:.0f} KB')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,24 @@
 # https://github.com/python-telegram-bot/python-telegram-bot/discussions/2876#discussion-3831621
+import json
 import logging
 from io import BytesIO
 import requests as rq
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
 
+import metrics
+from jobs import JobRunner, BUSY
+from lookup_cache import LookupCache
+from recognition_worker import OCR_LANG, OCR_KIND, recognize_image
 from screen2text import DictLookup as dlp, tb_logger
 
-results_dict = {}  # store bot recognition results
+RESULTS_PATH = 'bot_results.sqlite3'  # recognition results are kept here across restarts, None for memory only
+RESULTS_CAPACITY = 10000  # users whose results are kept in memory
+RESULTS_TTL = 24 * 3600  # seconds a user can still pick a suggestion by number
+
+# bot recognition results (lists of suggestions) by user id
+results_store = LookupCache(RESULTS_PATH, RESULTS_CAPACITY, RESULTS_TTL, dumps=json.dumps, loads=json.loads,
+                            normalize=str)
+jobs = JobRunner()  # runs recognitions and lookups off the dispatcher thread
 
 # https://www.youtube.com/watch?v=9L77QExPmI0
 # TODO: Make it roll
@@ -33,12 +45,14 @@ START_MESSAGE = 'Hello! To start using the service, please send a tightly croppe
                 'https://www.nectec.or.th/innovation/innovation-software/lexitron.html) and [PyThaiNLP](' \
                 'https://pythainlp.github.io/) for spelling verification, [Pillow](' \
                 'https://github.com/python-pillow/Pillow/) for image processing, [requests](' \
-                'https://requests.readthedocs.io) and [BeautifulSoup](https://www.crummy.com/software/BeautifulSoup/) ' \
+                'https://requests.readthedocs.io) and [lxml](https://lxml.de/) ' \
                 'for web content processing, and others. Many thanks to creators and maintainers of all these ' \
                 'resources!\nFeel free to [contact the developer](https://t.me/jornjat) with any inquiries.\n\n'
 HINT_MESSAGE = 'Please submit a tightly cropped image of a word in Thai script, enter suggestion number if known, ' \
                'or enter a word preceded by \"lookup\" and a whitespace (ex.: lookup เกล้า) to look it up in the dictionary.' \
                '\n\n [contact the sentient being behind this bot](https://t.me/jornjat)'
+BUSY_MESSAGE = 'Too many requests are being processed right now, please try again in a minute.'
+USER_LIMIT_MESSAGE = 'Your previous request is still being processed, please send this one again once it is done.'
 MAX_LENGTH = 4096
 LOOKUP_TAIL = '...\nclick the link below for more'
 FAILURE = 'something went wrong.'
@@ -146,33 +160,124 @@ def send_failure_note(message, context):
     return sent
 
 
-def do_recognize(r: rq.Response, message, context) -> list[tuple[str, float]]:
+def do_recognize(r: rq.Response, message, context, file_key: str = None) -> list[tuple[str, float]]:
     """
-    Pulls response content into PIL Image object, runs recognition and generates suggestions with
-    provisional confidence rating as a list of tuples.
+    Pulls response content into PIL Image object and takes suggestions for it from the recognition cache if the same
+    pixels have been recognized before, otherwise runs recognition in a job worker process, generating suggestions
+    with provisional confidence rating as a list of tuples, and caches them under the pixel hash and :file_key:.
     :param r: response object obtained from call to the telegram API using requests library.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
+    :param file_key: recognition cache key of the file the response content was downloaded from.
     :return: a list of rated suggestions as tuples or empty list in case of failure.
     """
     x = dlp()
     try:
         x.load_image(BytesIO(r.content))
+        keys = [x.image_key(OCR_LANG, OCR_KIND)]
     except Exception as e:
         logger.error(f"Couldn't open the image file: {e}")
         tb_logger.exception(e)
         return []
-    logger.info('initiating recognition...')
-    send_processing_note(message, context)
-    try:
-        x.threads_recognize(lang='tha', kind='line')
-    except Exception as e:
-        logger.error(f"recognition error: {e}")
-        tb_logger.exception(e)
-        return []
-    x.generate_word_suggestions()
-    logger.info(f'image recognition produced {len(x.suggestions)} suggestion(s)')
-    return x.suggestions
+    if file_key:
+        keys.insert(0, file_key)
+    entry = dlp.recall_recognition(keys)
+    metrics.inc('bot_recognition_cache_total', result='miss' if entry is None else 'hit')
+    if entry is None:
+        logger.info('initiating recognition...')
+        send_processing_note(message, context)
+        try:
+            with metrics.stage('recognition_job'):
+                entry = jobs.in_process(recognize_image, r.content)
+        except Exception as e:
+            logger.error(f"recognition error: {e}")
+            tb_logger.exception(e)
+            return []
+        metrics.record_stages(entry['report'].get('timings', {}), entry['report'].get('calls', 0))
+        dlp.remember_recognition(keys, entry)
+    logger.info(f'recognition report: {entry["report"]}')
+    suggestions = [tuple(suggestion) for suggestion in entry['suggestions']]
+    logger.info(f'image recognition produced {len(suggestions)} suggestion(s)')
+    return suggestions
+
+
+def choose_photo_size(sizes, min_height: int = None):
+    """
+    Picks the photo size to recognize out of those Telegram offers for a photo (thumbnails to full size), by their
+    metadata: the smallest one at least :min_height: px tall (the upper end of `dlp.text_height_range` by default,
+    so that a tight crop has text tall enough without being scaled up) or the largest one if none is that tall.
+    :param sizes: list of telegram.PhotoSize (message.photo).
+    :param min_height: least image height wanted.
+    :return: the chosen telegram.PhotoSize.
+    """
+    min_height = min_height or dlp.text_height_range[1]
+    by_size = sorted(sizes, key=lambda size: (size.height, size.width, size.file_size or 0))
+    chosen = next((size for size in by_size if size.height >= min_height), by_size[-1])
+    logger.info(f'chose photo size {chosen.width}x{chosen.height} of '
+                f'{", ".join(f"{size.width}x{size.height}" for size in by_size)}')
+    return chosen
+
+
+def do_image(message, context):
+    """
+    Loads the image (compressed photo in the size best fit for recognition or uncompressed png or jpg file) from the
+    message, recognizes it and sends user numbered suggestions to choose from, then starts prefetching lookups for
+    the top ones. A file recognized before (by Telegram's file_unique_id) is answered from the recognition cache
+    without downloading it.
+    Runs as a job on the 'ocr' lane.
+    :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
+    :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
+    :returns: sent message with choices in case of success, None otherwise.
+    """
+    attachment = choose_photo_size(message.photo) if message.photo else message.document
+    file_key = dlp.file_key(attachment.file_unique_id, OCR_LANG, OCR_KIND)
+    entry = dlp.recall_recognition([file_key])
+    if entry is not None:
+        metrics.inc('bot_recognition_cache_total', result='file_hit')
+        suggestions = [tuple(suggestion) for suggestion in entry['suggestions']]
+    else:
+        file = dlp.retry_or_none(context.bot.get_file, 2, 1, attachment.file_id)
+        if message.photo:
+            send_compressed_confirmation(message, context)
+        else:
+            if file and not (file.file_path.endswith('.png') or file.file_path.endswith('.jpg')):
+                send_rejection_note(message, context)
+                return None
+            send_uncompressed_confirmation(message, context)
+        if not file:
+            send_failure_note(message, context)
+            return None
+        logger.info(f'loading {file.file_path}')
+        with metrics.stage('download'):
+            r = dlp.retry_or_none(rq.get, 3, 1, file.file_path, timeout=30)
+        if not r:
+            send_failure_note(message, context)
+            return None
+        suggestions = do_recognize(r, message, context, file_key)
+    results_store.put(message.from_user.id, suggestions)
+    dlp.get_prefetcher().prefetch(message.from_user.id, [suggestion[0] for suggestion in suggestions])
+    choices = generate_choices(suggestions)
+    return send_choices(message, context, choices)
+
+
+def submit_job(lane: str, message, context, func, *args):
+    """
+    Hands :func: over to the job runner to be called with the message, context and :args: on the given lane,
+    replying to the user right away if the job cannot be accepted.
+    :param lane: 'ocr' for recognition jobs or 'lookup' for I/O-bound ones.
+    :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
+    :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
+    :param func: job function taking message and context as the first two arguments.
+    :return: True if the job was accepted.
+    """
+    reason = jobs.submit(lane, message.from_user.id, func, message, context, *args)
+    if reason:
+        sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
+                                 message.from_user.id,
+                                 BUSY_MESSAGE if reason == BUSY else USER_LIMIT_MESSAGE
+                                 )
+        logger.info(f'{reason} note sent to {message.from_user.full_name}' if sent else FAILURE)
+    return not reason
 
 
 def generate_choices(suggestions: list[tuple[str, float]]) -> str:
@@ -220,8 +325,8 @@ def obtain_query(message) -> str:
     query = ''
     text = message.text
     if text.isdigit():
-        if message.from_user.id in results_dict.keys():
-            their_results = results_dict[message.from_user.id]
+        their_results = results_store.get(message.from_user.id)
+        if their_results:
             result_index = int(message.text)
             if result_index < len(their_results):
                 query = their_results[result_index][0]
@@ -233,21 +338,26 @@ def obtain_query(message) -> str:
 def do_lookup(message, context, query: str):
     """
     Performs lookup for the query in online dictionary, prepares resulting output and sends it to user as
-    formatted markdown or plain text as a fallback option.
+    formatted markdown or plain text as a fallback option. If the query was prefetched while the user was choosing
+    (or is in the lookup cache for any other reason), results are sent right away with no "looking up" notification.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
     :param query: a text to look up.
     :return: sent message if anything managed to get through (albeit failure note) or None in case of ultimate failure.
     """
     logger.info(f'got a text to look up, initiating lookup for {query}')
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             f'looking up {query} ...'
-                             )
-    logger.info(f'notification sent successfully to {message.from_user.full_name}' if sent else FAILURE)
+    with metrics.stage('prefetch_wait'):
+        dlp.get_prefetcher().claim(message.from_user.id, query)
     x = dlp()
-    if not x.lookup(query):
-        return send_failure_note(message, context)
+    if not x.lookup_cached(query):
+        sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
+                                 message.from_user.id,
+                                 f'looking up {query} ...'
+                                 )
+        logger.info(f'notification sent successfully to {message.from_user.full_name}' if sent else FAILURE)
+        x.record = dlp.fetch(query)
+        if x.record is None:
+            return send_failure_note(message, context)
     output = trim_output(x.output_markdown())
     logger.info(
         f'markdown output generated ({output[:128] if len(output) > 128 else output} ...)'
@@ -0,0 +1,123 @@
+"""
+Job subsystem of the bot: handlers hand work over to it and return at once, so that one user's recognition does not
+hold up everyone else's messages. Jobs run on two separate lanes:
+- 'ocr': image download and recognition, with the recognition itself done in a pool of worker processes
+  (`in_process`) since it is CPU-bound;
+- 'lookup': dictionary lookups and other I/O-bound work, on threads.
+Each job replies to its user itself when it completes. Admission is limited per user (jobs in flight) and globally
+(jobs queued or running in both lanes); `submit` tells the caller why a job was turned down so that the user can get
+a reply right away. `shutdown` stops admitting jobs and lets the ones already accepted finish.
+A worker process that dies (out of memory, a crash in tesseract) fails only the recognitions it takes down with it:
+the pool is replaced for the ones after them.
+"""
+import logging
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BUSY = 'busy'  # global queue depth cap reached or shutting down
+USER_LIMIT = 'user_limit'  # the user has too many jobs in flight
+
+
+def call_in_worker(func, *args):
+    """
+    Calls :func: in a worker process, turning an exception that could not be sent back to the parent process
+    (some library exceptions fail unpickling, which breaks the whole pool) into a RuntimeError with the same message.
+    """
+    try:
+        return func(*args)
+    except Exception as e:
+        try:
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            raise RuntimeError(f'{type(e).__name__}: {e}') from None
+        raise
+
+
+class JobRunner:
+
+    def __init__(self, ocr_workers=2, lookup_workers=8, per_user=2, max_pending=32, ocr_processes=True):
+        """
+        :param ocr_workers: number of recognition jobs run at once (and of worker processes for them).
+        :param lookup_workers: number of lookup jobs run at once.
+        :param per_user: max number of jobs a user can have queued or running.
+        :param max_pending: max number of jobs queued or running in all lanes together.
+        :param ocr_processes: whether `in_process` uses worker processes, False to run in the calling thread.
+        """
+        self.per_user = per_user
+        self.max_pending = max_pending
+        self.lanes = {
+            'ocr': ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix='ocr_job'),
+            'lookup': ThreadPoolExecutor(max_workers=lookup_workers, thread_name_prefix='lookup_job'),
+        }
+        self.ocr_workers = ocr_workers
+        self.processes = ProcessPoolExecutor(max_workers=ocr_workers) if ocr_processes else None
+        self.in_flight = {}  # user -> number of jobs queued or running
+        self.pending = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def submit(self, lane, user, func, *args, **kwargs):
+        """
+        Queues :func: to be called with :args: and :kwargs: on :lane: ('ocr' or 'lookup') on behalf of :user:.
+        :return: None if the job was accepted, otherwise the reason it was not: `BUSY` or `USER_LIMIT`.
+        """
+        with self.lock:
+            if self.closed or self.pending >= self.max_pending:
+                logger.warning(f'{lane} job of {user} rejected: {self.pending} job(s) pending')
+                return BUSY
+            if self.in_flight.get(user, 0) >= self.per_user:
+                logger.info(f'{lane} job of {user} rejected: {self.in_flight[user]} job(s) of theirs in flight')
+                return USER_LIMIT
+            self.in_flight[user] = self.in_flight.get(user, 0) + 1
+            self.pending += 1
+            self.lanes[lane].submit(self.run, user, func, *args, **kwargs)
+        return None
+
+    def run(self, user, func, *args, **kwargs):
+        try:
+            with metrics.request(func.__name__, user):
+                func(*args, **kwargs)
+        except Exception as e:
+            logger.exception(f'job {func.__name__} of {user} failed: {e}')
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.in_flight[user] -= 1
+                if not self.in_flight[user]:
+                    del self.in_flight[user]
+
+    def in_process(self, func, *args):
+        """Calls :func: (a module-level function, arguments picklable) in a worker process, returning its result"""
+        processes = self.processes
+        if processes is None:
+            return func(*args)
+        try:
+            return processes.submit(call_in_worker, func, *args).result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.processes is processes and not self.closed:  # not replaced by another job already
+                    logger.error('a recognition worker process died, starting a new pool')
+                    metrics.inc('bot_worker_pool_restarts_total')
+                    processes.shutdown(wait=False)
+                    self.processes = ProcessPoolExecutor(max_workers=self.ocr_workers)
+            raise
+
+    def shutdown(self):
+        """Stops accepting jobs and waits for the accepted ones to finish"""
+        with self.lock:
+            self.closed = True
+            pending = self.pending
+        logger.info(f'shutting down, draining {pending} job(s)...')
+        for lane in self.lanes.values():
+            lane.shutdown(wait=True)
+        with self.lock:
+            processes = self.processes
+        if processes:
+            processes.shutdown(wait=True)
+        logger.info('all jobs finished')
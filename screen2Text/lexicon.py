@@ -0,0 +1,332 @@
+"""
+In-memory word list with exact and substring lookups, loaded once per process and shared by all
+`ClipImg2Text` instances (and threads) through `load_lexicon`.
+Substring queries are answered from n-gram postings: only the entries containing every trigram (bigram for
+two-character queries) of the query are checked for actual containment instead of scanning the whole list.
+
+Word lists can also be compiled into a binary file that is memory-mapped and used as is, with no parsing:
+a new process opens it in microseconds and worker processes share its pages through the OS page cache.
+The compiled file records a fingerprint of its source files and gets rebuilt when they change.
+Build it in advance with: python lexicon.py lexitron_thai.txt [custom_words.txt ...] -o lexitron_thai.lexc
+"""
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+class Lexicon:
+    gram_lengths = (2, 3)  # n-gram lengths of the postings index
+
+    def __init__(self, entries):
+        """
+        :param entries: iterable of word list entries (lines of the corpus file, with or without newlines).
+        """
+        self.entries = [entry.rstrip('\n') for entry in entries]
+        self.words = frozenset(entry.strip() for entry in self.entries)
+        self.postings = {}
+        for i, entry in enumerate(self.entries):
+            for n in self.gram_lengths:
+                for gram in self.grams(entry, n):
+                    self.postings.setdefault(gram, []).append(i)  # entry ids come in ascending order
+
+    @classmethod
+    def from_file(cls, path, *extra_paths):
+        """Builds the lexicon from the lines of the word list files :path: and :extra_paths:, in that order"""
+        lines = []
+        for source in (path, *extra_paths):
+            with open(source, encoding='utf-8') as corpus:
+                lines.extend(corpus.readlines())
+        return cls(lines)
+
+    @staticmethod
+    def grams(text, n):
+        """Returns the set of distinct :n:-grams of :text:"""
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def __contains__(self, word):
+        """Exact lookup"""
+        return word in self.words
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, i):
+        return self.entries[i]
+
+    def posting(self, gram):
+        """Returns ids of entries containing :gram:, in ascending order"""
+        return self.postings.get(gram, ())
+
+    def candidates(self, text):
+        """
+        Returns ids of entries that contain every n-gram of :text: (of the longest indexed length that fits),
+        smallest posting lists intersected first; all ids for texts shorter than any indexed n-gram
+        """
+        lengths = [n for n in self.gram_lengths if n <= len(text)]
+        if not lengths:
+            return range(len(self))
+        postings = sorted((self.posting(gram) for gram in self.grams(text, lengths[-1])), key=len)
+        ids = set(postings[0])
+        for posting in postings[1:]:
+            if not ids:
+                break
+            ids.intersection_update(posting)
+        return sorted(ids)
+
+    def search(self, text):
+        """
+        Yields ids of entries containing :text: exactly as `text in line` would for the corpus lines, trailing
+        newlines included
+        """
+        newline = text.endswith('\n')  # can only be found at the end of a line
+        body = text[:-1] if newline else text
+        if '\n' in body:
+            return
+        for i in self.candidates(body):
+            entry = self.entry(i)
+            if entry.endswith(body) if newline else body in entry:
+                yield i
+
+    def entries_containing(self, text):
+        """Returns all entries containing :text: as a substring"""
+        return [self.entry(i) for i in self.search(text)]
+
+    def contains_substring(self, text):
+        """Checks if :text: is found in any entry"""
+        return next(self.search(text), None) is not None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Compiled lexicon layout: a header followed by eight sections, numbers unsigned 32-bit in native (little-endian
+# on all the platforms the bot runs on) byte order:
+# - entry offsets (n_entries + 1) into the entry blob, entries being the lines of the word lists as they are
+#   (trailing newline aside), in file order, for substring searches to find exactly what a scan of the lines would;
+# - word offsets (n_words + 1) into the word blob, words being the distinct entries stripped of surrounding
+#   whitespace, sorted, for exact lookups;
+# - gram offsets (n_grams + 1) into the gram blob, grams sorted by their UTF-8 bytes;
+# - posting offsets (n_grams + 1) into the postings;
+# - postings: entry ids for each gram, ascending;
+# - entry blob, word blob and gram blob: UTF-8 strings back to back.
+MAGIC = b'LEXC'
+FORMAT_VERSION = 2
+# magic, version, source fingerprint, entries, words, grams, postings, entry, word and gram blob sizes
+HEADER = struct.Struct('<4sI32sIIIIIII')
+HEADER_SIZE = 72  # header padded for the sections to start aligned
+
+
+def fingerprint(sources):
+    """
+    Returns a digest identifying the word list :sources: by path, size and modification time (not content,
+    so that checking it costs a few stat calls) together with the format version.
+    """
+    digest = hashlib.sha256(MAGIC + struct.pack('<I', FORMAT_VERSION))
+    for source in sources:
+        stat = os.stat(source)
+        digest.update(f'{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.digest()
+
+
+def compile_lexicon(sources, path):
+    """
+    Compiles the word list files :sources: into a memory-mappable lexicon file at :path:, written to a temporary
+    file first and moved into place, so that readers never see it half-written. A lexicon of this process mapping
+    the file must be closed first: a mapped file cannot be replaced on Windows.
+    """
+    entries = []
+    for source in sources:
+        with open(source, encoding='utf-8') as lines:
+            entries.extend(line.rstrip('\n') for line in lines)
+    words = sorted(set(entry.strip() for entry in entries))
+    postings = {}
+    for i, entry in enumerate(entries):
+        for n in Lexicon.gram_lengths:
+            for gram in Lexicon.grams(entry, n):
+                postings.setdefault(gram.encode('utf-8'), []).append(i)
+    grams = sorted(postings)
+    encoded = [entry.encode('utf-8') for entry in entries]
+    encoded_words = [word.encode('utf-8') for word in words]
+    entry_offsets, word_offsets, gram_offsets = array('I', [0]), array('I', [0]), array('I', [0])
+    posting_offsets, ids = array('I', [0]), array('I')
+    for entry in encoded:
+        entry_offsets.append(entry_offsets[-1] + len(entry))
+    for word in encoded_words:
+        word_offsets.append(word_offsets[-1] + len(word))
+    for gram in grams:
+        gram_offsets.append(gram_offsets[-1] + len(gram))
+        ids.extend(postings[gram])
+        posting_offsets.append(len(ids))
+    entry_blob = b''.join(encoded)
+    word_blob = b''.join(encoded_words)
+    gram_blob = b''.join(grams)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, fingerprint(sources), len(entries), len(words), len(grams), len(ids),
+                         len(entry_blob), len(word_blob), len(gram_blob))
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as out:
+        out.write(header.ljust(HEADER_SIZE, b'\0'))
+        for section in (entry_offsets, word_offsets, gram_offsets, posting_offsets, ids):
+            out.write(section.tobytes())
+        out.write(entry_blob)
+        out.write(word_blob)
+        out.write(gram_blob)
+    os.replace(temporary, path)
+    logger.info(f'lexicon compiled to {path}: {len(entries)} entries, {len(grams)} n-grams')
+
+
+class CompiledLexicon(Lexicon):
+    """A lexicon read straight from a memory-mapped compiled file, with the same lookups as `Lexicon`.
+    Close it (or use it as a context manager) to unmap the file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.version, self.fingerprint, n_entries, n_words, n_grams, n_postings, entry_blob_size,
+         word_blob_size, gram_blob_size) = HEADER.unpack_from(self.map)
+        if magic != MAGIC or self.version != FORMAT_VERSION:
+            self.map.close()
+            raise ValueError(f'{path} is not a compiled lexicon of format version {FORMAT_VERSION}')
+        self.views = [memoryview(self.map)]  # to be released before the map is closed, never handed out
+        position = HEADER_SIZE
+        sections = []
+        for count in (n_entries + 1, n_words + 1, n_grams + 1, n_grams + 1, n_postings):
+            sections.append(self.view(position, count * 4).cast('I'))
+            position += count * 4
+        self.entry_offsets, self.word_offsets, self.gram_offsets, self.posting_offsets, self.ids = sections
+        self.views.extend(sections)
+        self.entry_blob = self.view(position, entry_blob_size)
+        self.word_blob = self.view(position + entry_blob_size, word_blob_size)
+        self.gram_blob = self.view(position + entry_blob_size + word_blob_size, gram_blob_size)
+        self.size = n_entries
+        self.n_words = n_words
+        self.n_grams = n_grams
+
+    def view(self, position, size):
+        view = self.views[0][position:position + size]
+        self.views.append(view)
+        return view
+
+    def close(self):
+        """
+        Unmaps the file, after which the lexicon can no longer be used. Lookups only hand out copies, but a slice
+        of the sections taken elsewhere and still alive keeps the map from closing: it is then left to be unmapped
+        when the last such slice goes away.
+        """
+        if self.map.closed:
+            return
+        for view in reversed(self.views):
+            view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            logger.warning('compiled lexicon still referenced, unmapped once released')
+
+    def __len__(self):
+        return self.size
+
+    def entry(self, i):
+        return str(self.entry_blob[self.entry_offsets[i]:self.entry_offsets[i + 1]], 'utf-8')
+
+    def word(self, i):
+        return str(self.word_blob[self.word_offsets[i]:self.word_offsets[i + 1]], 'utf-8')
+
+    def gram(self, i):
+        return bytes(self.gram_blob[self.gram_offsets[i]:self.gram_offsets[i + 1]])
+
+    def __contains__(self, word):
+        """Exact lookup by binary search in the sorted words"""
+        lo, hi = 0, self.n_words
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.word(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.n_words and self.word(lo) == word
+
+    def posting(self, gram):
+        """Returns ids of entries containing :gram:, found by binary search in the sorted n-grams"""
+        key = gram.encode('utf-8')
+        lo, hi = 0, self.n_grams
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.gram(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_grams and self.gram(lo) == key:
+            ids = array('I')  # a copy, not a view of the map that would keep it from being closed meanwhile
+            ids.frombytes(self.ids[self.posting_offsets[lo]:self.posting_offsets[lo + 1]].cast('B'))
+            return ids
+        return ()
+
+
+def open_compiled(sources, path):
+    """
+    Opens the compiled lexicon at :path:, first (re)building it from :sources: if it is missing,
+    of another format version or compiled from different source files.
+    """
+    if os.path.exists(path):
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+        if len(header) == HEADER.size:
+            magic, version, recorded, *_ = HEADER.unpack(header)
+            if magic == MAGIC and version == FORMAT_VERSION and recorded == fingerprint(sources):
+                return CompiledLexicon(path)
+        logger.info(f'compiled lexicon {path} is stale, rebuilding')
+    compile_lexicon(sources, path)
+    return CompiledLexicon(path)
+
+
+_lexicons = {}
+_lock = threading.Lock()
+
+
+def load_lexicon(path, *extra_paths, compiled=None):
+    """
+    Returns the lexicon for the word list file at :path: together with :extra_paths: of custom word lists,
+    building it on first call and again only if any of the files has changed since.
+    With :compiled: given, the lexicon is memory-mapped from that file, compiled from the word lists if needed.
+    """
+    sources = [os.path.abspath(source) for source in (path, *extra_paths)]
+    key = tuple(sources), compiled
+    with _lock:
+        stamp = fingerprint(sources)
+        cached = _lexicons.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        if cached:
+            cached[1].close()  # unmapped for the compiled file to be replaced
+        if compiled:
+            lexicon = open_compiled(sources, compiled)
+        else:
+            lexicon = Lexicon.from_file(*sources)
+        _lexicons[key] = stamp, lexicon
+        logger.info(f'lexicon loaded from {compiled or path}: {len(lexicon)} entries')
+        return lexicon
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compiles word lists into a memory-mappable lexicon file.')
+    parser.add_argument('sources', nargs='+', help='word list files, one word per line')
+    parser.add_argument('-o', '--output', default='lexitron_thai.lexc', help='compiled lexicon file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    compile_lexicon(args.sources, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Two-tier cache for dictionary lookups: an in-memory LRU in front of an on-disk SQLite store, both keyed by
+normalized query and expiring entries after a configurable TTL. With another key function it serves as a store of
+any other per-key values, e.g. the bot's per-user recognition results. Memory holds values as they are used
+(no decoding on a hit), disk holds them serialized with the :dumps:/:loads: pair given to the cache.
+"""
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """Returns the cache key for :query: - NFC-normalized, trimmed and lowercased (for latin script queries)"""
+    return unicodedata.normalize('NFC', query).strip().lower()
+
+
+class LookupCache:
+
+    def __init__(self, path=None, capacity=512, ttl=7 * 24 * 3600, dumps=str, loads=str, normalize=normalize_query,
+                 purge_every=1000):
+        """
+        :param path: SQLite database file for the disk tier, None for memory only.
+        :param capacity: max number of entries kept in memory.
+        :param ttl: seconds an entry stays valid in either tier.
+        :param dumps: function serializing a value to text for the disk tier.
+        :param loads: function restoring a value from text.
+        :param normalize: function turning a query into the key it is stored under.
+        :param purge_every: number of puts after which expired entries are deleted from the disk tier, so that it
+        does not grow for as long as the process runs; None to purge only on `purge` calls.
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+        self.normalize = normalize
+        self.memory = OrderedDict()  # key -> (stored_at, value)
+        self.lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.purge_every = purge_every
+        self.puts = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS lookups '
+                            '(query TEXT PRIMARY KEY, stored_at REAL NOT NULL, value TEXT NOT NULL)')
+            self.db.commit()
+
+    def get(self, query):
+        """Returns the cached value for :query: or None if there is none or it has expired"""
+        key = self.normalize(query)
+        now = time.time()
+        with self.lock:
+            if key in self.memory:
+                stored_at, value = self.memory[key]
+                if now - stored_at < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.hits['memory'] += 1
+                    return value
+                del self.memory[key]
+            row = None
+            if self.db:
+                row = self.db.execute('SELECT stored_at, value FROM lookups WHERE query = ?', (key,)).fetchone()
+            if not row or now - row[0] >= self.ttl:
+                self.misses += 1
+                return None
+        try:
+            value = self.loads(row[1])
+        except Exception as e:  # stored by an older version in another format
+            logger.warning(f'discarding unreadable cache entry for {key}: {e}')
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits['disk'] += 1
+        self.remember(key, row[0], value)
+        return value
+
+    def __contains__(self, query):
+        """Checks for an unexpired entry for :query: without loading it or counting a hit or miss"""
+        key = self.normalize(query)
+        now = time.time()
+        with self.lock:
+            if key in self.memory and now - self.memory[key][0] < self.ttl:
+                return True
+            if self.db:
+                row = self.db.execute('SELECT stored_at FROM lookups WHERE query = ?', (key,)).fetchone()
+                return bool(row) and now - row[0] < self.ttl
+        return False
+
+    def put(self, query, value):
+        """Stores :value: for :query: in both tiers"""
+        key = self.normalize(query)
+        now = time.time()
+        self.remember(key, now, value)
+        if self.db:
+            serialized = self.dumps(value)
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO lookups VALUES (?, ?, ?)', (key, now, serialized))
+                self.puts += 1
+                if self.purge_every and self.puts % self.purge_every == 0:
+                    self.db.execute('DELETE FROM lookups WHERE stored_at < ?', (now - self.ttl,))
+                self.db.commit()
+
+    def remember(self, key, stored_at, value):
+        with self.lock:
+            self.memory[key] = stored_at, value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.capacity:
+                self.memory.popitem(last=False)
+
+    def purge(self):
+        """Deletes expired entries from the disk tier"""
+        if self.db:
+            with self.lock:
+                self.db.execute('DELETE FROM lookups WHERE stored_at < ?', (time.time() - self.ttl,))
+                self.db.commit()
+
+    def close(self):
+        if self.db:
+            with self.lock:
+                self.db.close()
+                self.db = None
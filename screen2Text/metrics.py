@@ -0,0 +1,275 @@
+"""
+Per-stage latency instrumentation of the bot. Each handled request (a job) is traced with `request`: stages timed
+with `stage` inside it, as well as calls made through `DictLookup.retry_or_none`, are added both to the trace and
+to histograms shared by all requests. When the request ends, its trace is written as a line of JSON to a rotating
+file. Histograms and counters are served in Prometheus text format on a local port (`serve`).
+
+Instrumentation is off unless the METRICS_PORT environment variable is set (or `configure` is called): `stage` and
+`request` then hand out a shared no-op context and cost next to nothing.
+Stages run in worker processes (recognition) are timed with `timed` into a plain dict sent back with the results
+and added to the parent's trace with `record_stages`.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+PORT = int(os.environ.get('METRICS_PORT', 0))  # 0 to disable instrumentation
+LOG_PATH = os.environ.get('METRICS_LOG', 'logs/metrics.jsonl')  # request traces, one JSON object per line
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+CALLS_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+
+enabled = False
+_local = threading.local()
+_null = nullcontext()
+_trace_log = logging.getLogger(f'{__name__}.requests')
+_trace_log.propagate = False
+
+
+@contextmanager
+def timed(timings, name):
+    """Adds the time spent in the block to :timings:[:name:] (seconds), always - for results to carry along"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + perf_counter() - start
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms and counters by (name, labels), plus gauges read from callbacks at exposition time"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}  # name -> function returning {label value: number}
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, n=1, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def register_gauges(self, name, func):
+        """Exposes what :func: returns ({label value: number}) as gauge :name: labelled by 'key'"""
+        self.gauges[name] = func
+
+    @staticmethod
+    def escape(value):
+        """Returns :value: as a label value of the text format: backslashes, double quotes and newlines escaped"""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @classmethod
+    def labels(cls, pairs, extra=()):
+        pairs = [*pairs, *extra]
+        return '{' + ','.join(f'{key}="{cls.escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+    def exposition(self):
+        """Returns all metrics in Prometheus text format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            snapshots = [(key, histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                         for key, histogram in histograms]
+        typed = set()
+        for (name, pairs), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{self.labels(pairs)} {value}')
+        for (name, pairs), buckets, counts, total, count in snapshots:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{self.labels(pairs, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{self.labels(pairs, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{self.labels(pairs)} {total}')
+            lines.append(f'{name}_count{self.labels(pairs)} {count}')
+        for name, func in sorted(self.gauges.items()):
+            try:
+                values = func()
+            except Exception as e:
+                logger.warning(f'gauge {name} failed: {e}')
+                continue
+            lines.append(f'# TYPE {name} gauge')
+            for key, value in values.items():
+                lines.append(f'{name}{self.labels([("key", key)])} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Trace:
+    """Stage timings of one request"""
+
+    def __init__(self, kind, user):
+        self.kind = kind
+        self.user = user
+        self.stages = {}
+        self.tesseract_calls = 0
+        self.started = time.time()
+        self.start = perf_counter()
+
+    def add(self, name, seconds):
+        self.stages[name] = round(self.stages.get(name, 0) + seconds, 6)
+
+
+class TracedRequest:
+
+    def __init__(self, kind, user):
+        self.trace = Trace(kind, user)
+
+    def __enter__(self):
+        self.outer = getattr(_local, 'trace', None)
+        _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self.outer
+        trace = self.trace
+        total = perf_counter() - trace.start
+        status = 'error' if exc_type else 'ok'
+        registry.observe('bot_request_seconds', total, kind=trace.kind)
+        registry.inc('bot_requests_total', kind=trace.kind, status=status)
+        if trace.tesseract_calls:
+            registry.observe('bot_tesseract_calls', trace.tesseract_calls, buckets=CALLS_BUCKETS)
+        _trace_log.info(json.dumps(dict(time=round(trace.started, 3), kind=trace.kind, user=trace.user, status=status,
+                                        total=round(total, 6), stages=trace.stages,
+                                        tesseract_calls=trace.tesseract_calls), ensure_ascii=False))
+        return False
+
+
+class TimedStage:
+
+    def __init__(self, name, metric, label):
+        self.name = name
+        self.metric = metric
+        self.label = label
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = perf_counter() - self.start
+        registry.observe(self.metric, seconds, **{self.label: self.name})
+        trace = getattr(_local, 'trace', None)
+        if trace:
+            trace.add(self.name, seconds)
+        return False
+
+
+def request(kind, user=None):
+    """Traces a request of :kind: ('image', 'lookup'...) on behalf of :user: in the current thread"""
+    return TracedRequest(kind, user) if enabled else _null
+
+
+def stage(name):
+    """Times a stage of the current request"""
+    return TimedStage(name, 'bot_stage_seconds', 'stage') if enabled else _null
+
+
+def call(name):
+    """Times an outgoing call (with its retries) of the current request"""
+    return TimedStage(name, 'bot_call_seconds', 'call') if enabled else _null
+
+
+def inc(name, n=1, **labels):
+    if enabled:
+        registry.inc(name, n, **labels)
+
+
+def record_stages(timings, tesseract_calls=0):
+    """Adds stages timed elsewhere (with `timed` in a worker process) to the histograms and the current trace"""
+    if not enabled:
+        return
+    trace = getattr(_local, 'trace', None)
+    for name, seconds in timings.items():
+        registry.observe('bot_stage_seconds', seconds, stage=name)
+        if trace:
+            trace.add(name, seconds)
+    if trace:
+        trace.tesseract_calls += tesseract_calls
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Serves /metrics on :host: and :port: from a daemon thread, returning the server"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f'serving metrics on http://{host}:{server.server_address[1]}/metrics')
+    return server
+
+
+def configure(port=PORT, log_path=LOG_PATH, max_bytes=10 * 2 ** 20, backups=3):
+    """
+    Turns instrumentation on if :port: is given, serving metrics there and writing request traces to :log_path:
+    (rotated at :max_bytes:, keeping :backups: old files).
+    :return: the metrics server or None if instrumentation stays off.
+    """
+    global enabled
+    if not port:
+        return None
+    if log_path:
+        os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+        handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _trace_log.handlers.clear()
+        _trace_log.addHandler(handler)
+        _trace_log.setLevel(logging.INFO)
+    enabled = True
+    return serve(port)
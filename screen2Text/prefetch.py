@@ -0,0 +1,161 @@
+"""
+Speculative dictionary lookups: as soon as recognition produces suggestions, the top few are looked up in the
+background so that the one the user picks is most likely already in the lookup cache when they reply.
+Fetches run on a bounded thread pool. Each user has at most one batch in flight, and a new batch (or `cancel`)
+drops whatever is left of the previous one. Counters in `stats` show how often the chosen word had been prefetched
+and how many fetches went unused; a word found to have no results is counted apart from fetches that failed.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class Batch:
+    """
+    Prefetches started for one user's suggestions (word -> future), suggestions that needed none being cached
+    already, and the words the user has chosen since
+    """
+
+    def __init__(self):
+        self.futures = OrderedDict()
+        self.cached = set()
+        self.claimed = set()
+
+
+class Prefetcher:
+
+    def __init__(self, fetch, is_cached, top=3, workers=4, max_users=1000):
+        """
+        :param fetch: function looking up a word and storing the results in the lookup cache, returning them
+        (empty if the word has none) or None if the lookup failed.
+        :param is_cached: function telling whether results for a word are already cached.
+        :param top: number of top suggestions to prefetch, 0 to disable prefetching.
+        :param workers: max number of prefetches running at once.
+        :param max_users: max number of users whose batches are kept, the least recent dropped beyond it.
+        """
+        self.fetch = fetch
+        self.is_cached = is_cached
+        self.top = top
+        self.max_users = max_users
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') if top else None
+        self.batches = OrderedDict()  # user -> Batch
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(
+            ('scheduled', 'already_cached', 'completed', 'no_results', 'failed', 'cancelled',
+             'hits', 'late_hits', 'misses', 'wasted'), 0)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def prefetch(self, user, words):
+        """
+        Starts background lookups for the first `top` of :words: not cached yet, replacing any batch
+        still held for :user:.
+        """
+        if not self.top:
+            return
+        self.cancel(user)
+        batch = Batch()
+        for word in list(dict.fromkeys(words))[:self.top]:
+            if self.is_cached(word):
+                self.count('already_cached')
+                batch.cached.add(word)
+                continue
+            future = self.executor.submit(self.fetch, word)
+            future.add_done_callback(self.finished)
+            batch.futures[word] = future
+            self.count('scheduled')
+        with self.lock:
+            self.batches[user] = batch
+            self.batches.move_to_end(user)
+            dropped = []
+            while len(self.batches) > self.max_users:
+                dropped.append(self.batches.popitem(last=False)[1])
+        for old in dropped:
+            self.discard(old)
+        if batch.futures:
+            logger.info(f'prefetching {len(batch.futures)} lookup(s): {", ".join(batch.futures)}')
+
+    def finished(self, future):
+        if future.cancelled():
+            return
+        if future.exception() or future.result() is None:
+            self.count('failed')
+        else:
+            self.count('completed' if future.result() else 'no_results')
+
+    def claim(self, user, word, timeout=15):
+        """
+        Records that :user: has chosen :word: and, if it is being prefetched, waits up to :timeout: seconds for
+        the prefetch to finish so that the lookup finds it in the cache instead of fetching it a second time.
+        :return: True if :word: was prefetched for :user:.
+        """
+        with self.lock:
+            batch = self.batches.get(user)
+            future = batch.futures.get(word) if batch else None
+            if batch is None:
+                return False  # nothing prefetched for this user, not counted either way
+            if future is None:
+                if word in batch.cached:
+                    return False
+                self.stats['misses'] += 1
+                return False
+            first = word not in batch.claimed
+            batch.claimed.add(word)
+        if not first:
+            return True
+        if future.done():
+            self.count('hits')
+        else:
+            self.count('late_hits')
+            wait([future], timeout=timeout)
+        logger.info(f'prefetch {"hit" if future.done() else "still running"} for {word}; {self.report()}')
+        return True
+
+    def cancel(self, user):
+        """Drops the batch held for :user:, cancelling its prefetches that have not started yet"""
+        with self.lock:
+            batch = self.batches.pop(user, None)
+        if batch:
+            self.discard(batch)
+
+    def discard(self, batch):
+        for word, future in batch.futures.items():
+            if word in batch.claimed:
+                continue
+            if future.cancel():
+                self.count('cancelled')
+            else:
+                future.add_done_callback(self.wasted)  # runs right away if already done
+
+    def wasted(self, future):
+        try:
+            if future.result() is not None:
+                self.count('wasted')
+        except Exception:
+            pass
+
+    @property
+    def hit_rate(self):
+        """Share of choices among prefetched suggestions that had been prefetched (including still running)"""
+        with self.lock:
+            hits = self.stats['hits'] + self.stats['late_hits']
+            total = hits + self.stats['misses']
+        return hits / total if total else 0.
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        return f'prefetch hit rate {self.hit_rate:.0%}, ' + ', '.join(f'{key} {value}' for key, value in stats.items())
+
+    def close(self):
+        with self.lock:
+            users = list(self.batches)
+        for user in users:
+            self.cancel(user)
+        if self.executor:
+            self.executor.shutdown(wait=False)
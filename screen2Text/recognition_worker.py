@@ -0,0 +1,25 @@
+"""
+Entry point of the bot's recognition worker processes (see `jobs.JobRunner.in_process`). Kept apart from bot_utils,
+whose import sets the bot up (job runner, results store, log files), so that a worker started by spawning imports only
+what recognition needs.
+"""
+from io import BytesIO
+
+from screen2text import DictLookup
+
+OCR_LANG = 'tha'  # recognition parameters of the bot
+OCR_KIND = 'line'
+
+
+def recognize_image(content: bytes) -> dict:
+    """
+    Runs recognition on an image and generates suggestions with provisional confidence rating. Runs in a job worker
+    process, so it takes and returns plain picklable data only.
+    :param content: the image file content.
+    :return: recognition cache entry with the list of rated suggestions and the recognition report.
+    """
+    x = DictLookup()
+    x.load_image(BytesIO(content))
+    x.adaptive_recognize(lang=OCR_LANG, kind=OCR_KIND)
+    x.generate_word_suggestions()
+    return x.recognition_entry()
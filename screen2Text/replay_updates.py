@@ -0,0 +1,80 @@
+"""
+Posts update payloads to the bot's webhook receiver the way Telegram does, to check and load-test the webhook path
+without Telegram. Payloads come from a file recorded by the receiver (--record), one JSON object per line, or are
+made up as text messages asking to look words up.
+Run from this directory with the bot serving in webhook mode:
+python replay_updates.py http://127.0.0.1:8443/telegram [recorded.jsonl] [--repeat 10] [--concurrency 8]
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from time import perf_counter
+
+import requests as rq
+
+SAMPLE_WORDS = ('แมว', 'หมา', 'เกล้า', 'ภาษา', 'หนังสือ')
+
+
+def sample_update(update_id, text, user_id=1000):
+    """Returns the payload of a private text message update from user :user_id:"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'Tester {user_id}'}
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'from': user,
+                    'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']}, 'text': text},
+    }
+
+
+def sample_updates(n, users=10):
+    return [sample_update(i, f'lookup {SAMPLE_WORDS[i % len(SAMPLE_WORDS)]}', 1000 + i % users) for i in range(n)]
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as recorded:
+        return [json.loads(line) for line in recorded if line.strip()]
+
+
+def replay(url, updates, concurrency=8):
+    """
+    Posts :updates: to :url: from :concurrency: threads.
+    :return: a tuple of the list of (status code or exception name, seconds) per post and total seconds.
+    """
+    session = rq.Session()
+
+    def post(update):
+        start = perf_counter()
+        try:
+            status = session.post(url, json=update, timeout=30).status_code
+        except rq.RequestException as e:
+            status = type(e).__name__
+        return status, perf_counter() - start
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, updates))
+    return results, perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Posts update payloads to a webhook receiver.')
+    parser.add_argument('url', help='webhook receiver URL, path included')
+    parser.add_argument('updates', nargs='?', help='recorded payloads, one JSON object per line')
+    parser.add_argument('--count', type=int, default=50, help='number of made up updates without a recording')
+    parser.add_argument('--repeat', type=int, default=1, help='times to post every update')
+    parser.add_argument('--concurrency', type=int, default=8, help='posting threads')
+    args = parser.parse_args()
+    updates = load_updates(args.updates) if args.updates else sample_updates(args.count)
+    results, total = replay(args.url, updates * args.repeat, args.concurrency)
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(seconds for _, seconds in results)
+    print(f'{len(results)} updates posted in {total:.2f} s ({len(results) / total:.1f}/s), statuses: {statuses}')
+    print(f'latency median {median(latencies) * 1000:.1f} ms, '
+          f'p95 {latencies[int(len(latencies) * .95) - 1] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
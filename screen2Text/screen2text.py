@@ -1,15 +1,33 @@
+import hashlib
+import json
 import logging
 import os
+import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime as dt
+from html import escape
+import lxml.html
+import numpy as np
 import pytesseract
 import requests as rq
 from IPython.display import HTML
 from IPython.display import display
 from PIL import ImageGrab, Image
-from bs4 import BeautifulSoup as bs
 from pythainlp import correct
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+import metrics
+try:
+    from pages2Text import ocr_engine as ocr
+except ImportError:  # run from this directory, the recognition engine shared with pages2Text being next to it
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from pages2Text import ocr_engine as ocr
+from lexicon import fingerprint, load_lexicon
+from lookup_cache import LookupCache
+from prefetch import Prefetcher
 
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
@@ -47,6 +65,30 @@ class ClipImg2Text:
     corpus_path = 'lexitron_thai.txt'
     # any file with Thai dictionary words one per line will do
     # (the bigger - the better, this one is 42K+ from NECTEC's Lexitron)
+    word_lists = []  # custom word lists to validate against along with the corpus
+    compiled_corpus_path = 'lexitron_thai.lexc'  # memory-mapped compiled lexicon, rebuilt when word lists change
+    fan_skews = range(60, 155, 5)  # threshold skews in percent for fan binarization
+    debug = False  # write fan binarization results to bims/ for inspection
+    consensus_margin = 5  # validated votes the leading word needs over the runner-up to stop recognizing early
+    consensus_min_calls = 12  # tesseract calls to make before consensus is checked
+    text_height = 48  # px the ink of a word or line image is rescaled to when out of `text_height_range`
+    text_height_range = (32, 96)  # None to recognize images at the size they come in
+    max_upscale = 4
+    recognition_cache_path = 'recognition_cache.sqlite3'  # disk tier of the recognition cache, None for memory only
+    recognition_cache_capacity = 256  # recognition results kept in memory
+    recognition_cache_ttl = 30 * 24 * 3600  # seconds
+    cache_out_texts = False  # keep all raw recognition results in the recognition cache, not just suggestions
+    recognition_version = 1  # part of recognition cache keys, to bump when changes to recognition change results
+    _recognition_cache = None
+    _recognition_lock = threading.Lock()
+
+    @staticmethod
+    def fan_thresholds(extrema, skews):
+        """
+        takes image luminosity :extrema: and a collection of threshold :skews: in percent, returns an array of
+        thresholds set to the midpoint between the extremes adjusted by each skew
+        """
+        return np.array([sum(extrema) / 2 * (skew / 100) for skew in skews])
 
     @staticmethod
     def get_freqs(strings):
@@ -62,15 +104,76 @@ class ClipImg2Text:
             freqs[key] = round(val / total, 2)
         return sorted(freqs.items(), key=lambda item: item[1], reverse=True)
 
+    @classmethod
+    def get_recognition_cache(cls):
+        """Returns the recognition cache shared by all instances, holding entries made by `recognition_entry`"""
+        with cls._recognition_lock:
+            if cls._recognition_cache is None:
+                cls._recognition_cache = LookupCache(cls.recognition_cache_path, cls.recognition_cache_capacity,
+                                                     cls.recognition_cache_ttl, dumps=json.dumps, loads=json.loads,
+                                                     normalize=str)
+            return cls._recognition_cache
+
+    @classmethod
+    def recognition_stamp(cls):
+        """Returns a digest of what recognition results depend on besides the image and parameters, for recognition
+        cache keys: `recognition_version` and the recognition settings of the class, the engine and tesseract
+        version and the word lists suggestions are validated against (by path, size and modification time)"""
+        try:
+            tesseract = pytesseract.get_tesseract_version(cached=True)
+        except Exception:  # not installed, the pool engine may not need it
+            tesseract = None
+        try:
+            words = fingerprint([cls.corpus_path, *cls.word_lists]).hex()
+        except OSError:
+            words = None
+        settings = (cls.recognition_version, list(cls.fan_skews), cls.consensus_margin, cls.consensus_min_calls,
+                    cls.text_height, cls.text_height_range, cls.max_upscale, ocr.get_engine().name, str(tesseract),
+                    words)
+        return hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+
+    @classmethod
+    def file_key(cls, file_id, lang, kind=None, method='adaptive'):
+        """Returns the recognition cache key for a file known by a stable :file_id: (like Telegram's file_unique_id)
+        recognized with given parameters"""
+        return f'file:{file_id}:{lang}:{kind}:{method}:{cls.recognition_stamp()}'
+
+    @classmethod
+    def recall_recognition(cls, keys):
+        """Returns the recognition cache entry under the first of :keys: found (also storing it under the others)
+        or None"""
+        cache = cls.get_recognition_cache()
+        for key in keys:
+            entry = cache.get(key)
+            if entry is not None:
+                logger.info(f'recognition results found in cache by {key[:48]}')
+                cls.remember_recognition([other for other in keys if other != key], entry)
+                return entry
+        return None
+
+    @classmethod
+    def remember_recognition(cls, keys, entry):
+        """Stores a recognition cache :entry: under :keys:, unless it has no suggestions: recognition may well do
+        better next time (a retry, another engine or word list) and is not to be kept from it for the whole TTL"""
+        if not entry['suggestions']:
+            logger.info('no suggestions, recognition results not cached')
+            return
+        cache = cls.get_recognition_cache()
+        for key in keys:
+            cache.put(key, entry)
+
     def __init__(self):
         self.suggestions = []
         self.im = None
         self.bim = None
         self.out_texts = {}
         self.bims = {}
+        self.fan_groups = {}
+        self.ocr_calls_saved = 0
+        self.recognition_report = {}
         self.validated_words = {}
-        if not os.path.exists('bims'):
-            os.mkdir('bims')
+        self.timings = {}  # seconds spent in recognition stages, see `metrics.timed`
+        self.input_scale = 1.0
 
     def grab(self):
         self.bim = None
@@ -85,28 +188,75 @@ class ClipImg2Text:
         self.im = Image.open(path)
 
     def binarize(self, skew=1.0):
-        im = self.im.copy().convert("L")
-        lightness = len(im.getdata()) / sum(im.getdata())  # this may result in ZeroDivisionError
+        im = self.im.convert("L")
         threshold = sum(im.getextrema()) / 2 * skew
-        xs, ys = im.size
-        for x in range(xs):
-            for y in range(ys):
-                if im.getpixel((x, y)) > threshold:
-                    px = 255  # if lightness > 0.25 else 0
-                else:
-                    px = 0  # if lightness > 0.25 else 255
-                im.putpixel((x, y), px)
-        return im
+        return Image.fromarray(np.where(np.asarray(im) > threshold, 255, 0).astype(np.uint8))
 
     def fan_binarize(self):
+        """Binarizes the image over the whole range of `fan_skews` at once, comparing its array to a broadcast stack
+        of thresholds, and keeps the results in self.bims (also writing them to bims/ in debug mode).
+        Thresholds landing in the same gap between luminosity values present in the image produce the same binary
+        image, so only one is made for each such group: self.fan_groups maps the first skew of each group
+        to all of its skews, and self.bims refers all of them to the same image"""
+        im = self.im.convert("L")
+        array = np.asarray(im)
+        skews = list(self.fan_skews)
+        thresholds = self.fan_thresholds(im.getextrema(), skews)
+        # the number of luminosity values at or below the threshold tells which pixels turn white
+        levels = np.searchsorted(np.unique(array), thresholds, side='right')
+        self.fan_groups = {}
+        first_skews = {}
+        for skew, level in zip(skews, levels):
+            first = first_skews.setdefault(level, skew)
+            self.fan_groups.setdefault(first, []).append(skew)
+        distinct = np.array([thresholds[skews.index(skew)] for skew in self.fan_groups])
+        stack = np.where(array > distinct[:, np.newaxis, np.newaxis], 255, 0).astype(np.uint8)
         self.bims = {}
-        for skew in range(60, 155, 5):
-            bim = self.binarize(skew / 100)
-            bim.save(f'bims/{skew}.png')
-            self.bims[skew] = bim
+        for group, binarized in zip(self.fan_groups.values(), stack):
+            bim = Image.fromarray(binarized)
+            for skew in group:
+                self.bims[skew] = bim
+        if self.debug:
+            os.makedirs('bims', exist_ok=True)
+            for skew, bim in self.bims.items():
+                bim.save(f'bims/{skew}.png')
+
+    def ink_height(self):
+        """
+        Returns the height in px of the band of rows holding the text of the image: rows where at least 1% of the
+        pixels are on the minority (text) side of the luminosity midpoint, light text on dark background included
+        """
+        im = self.im.convert("L")
+        ink = np.asarray(im) < sum(im.getextrema()) / 2
+        if ink.mean() > .5:
+            ink = ~ink
+        rows = np.flatnonzero(ink.mean(axis=1) > .01)
+        return int(rows[-1] - rows[0] + 1) if rows.size else self.im.height
+
+    def normalize_resolution(self, kind=None):
+        """
+        Rescales a word or line image (:kind: 'word' or 'line') for its text to be `text_height` px tall
+        if it is out of `text_height_range`: oversized images cost recognition time in every variant of the fan
+        without helping it, undersized ones (thumbnails) give poor results. Other images are left as they are:
+        the ink band of a block, or of an image of unknown kind that may hold several lines, spans all of its lines.
+        The scale applied is kept in self.input_scale.
+        """
+        self.input_scale = 1.0
+        if not self.text_height_range or kind not in ('word', 'line'):
+            return
+        height = self.ink_height()
+        low, high = self.text_height_range
+        if low <= height <= high:
+            return
+        scale = min(self.text_height / height, self.max_upscale)
+        size = max(1, round(self.im.width * scale)), max(1, round(self.im.height * scale))
+        resample = Image.LANCZOS if scale < 1 else Image.BICUBIC
+        logger.info(f'text {height} px tall, rescaling image {self.im.size} -> {size}')
+        self.im = self.im.resize(size, resample)
+        self.input_scale = round(scale, 3)
 
     def recognize_original(self, lang='tha', config='--psm 7'):
-        return pytesseract.image_to_string(self.im, config=config, lang=lang).strip()
+        return ocr.image_to_string(self.im, config=config, lang=lang).strip()
 
     def fan_recognize_original(self, lang='tha'):
         for code in list(self.config_dict.keys())[3:]:
@@ -117,7 +267,7 @@ class ClipImg2Text:
                 continue
 
     def recognize_bin(self, skew=1.0, lang='tha', config='--psm 7'):
-        return pytesseract.image_to_string(self.binarize(skew), config=config, lang=lang).strip()
+        return ocr.image_to_string(self.binarize(skew), config=config, lang=lang).strip()
 
     def fan_recognize_bin(self, lang='tha'):
         for code in list(self.config_dict.keys())[3:]:
@@ -130,53 +280,190 @@ class ClipImg2Text:
         from self.bims, which will have to be already prepared to avoid repeated binarization
         in concurrent recognizing"""
         self.out_texts[psm] = self.recognize_original(lang=lang, config=f'--psm {psm}')
-        for skew, image in self.bims.items():
-            key = psm * 1000 + skew
-            self.out_texts[key] = pytesseract.image_to_string(image, lang=lang, config=f'--psm {psm}').strip()
+        groups = self.fan_groups or {skew: [skew] for skew in self.bims}
+        for first, skews in groups.items():
+            # recognizing each distinct binary image once, copying the result to all skews producing it
+            text = ocr.image_to_string(self.bims[first], lang=lang, config=f'--psm {psm}').strip()
+            for skew in skews:
+                self.out_texts[psm * 1000 + skew] = text
         # print(len(self.out_texts))
 
+    def select_psms(self, kind=None):
+        """Returns psm values to recognize the image in as per :kind: ('block', 'line', 'word' or None for all)"""
+        psms = list(self.config_dict.keys())[3:]
+        psms.insert(0, 1)
+        if kind == 'block':
+            psms = (1, 3, 4, 6, 11, 12, 13)
+        if kind == 'line':
+            psms = (1, 3, 7, 11, 12, 13)
+        if kind == 'word':
+            psms = (1, 3, 7, 8, 11, 12, 13)
+        return psms
+
     def threads_recognize(self, lang, kind=None):
         """Recognizing the image, both original and binarized, in a range of psm values as per :kind:,
         applying a range of threshold skews as defined in `fan_recognize` run in a separate thread
         for each psm value 
         """
         self.kind = kind
+        self.normalize_resolution(kind)
         self.fan_binarize()
         lang = lang
         self.out_texts.clear()
-        psms = list(self.config_dict.keys())[3:]
-        psms.insert(0, 1)
-        if kind == 'block':
-            psms = (1, 3, 4, 6, 11, 12, 13)
-        if kind == 'line':
-            psms = (1, 3, 7, 11, 12, 13)
-        if kind == 'word':
-            psms = (1, 3, 7, 8, 11, 12, 13)
+        psms = self.select_psms(kind)
+        self.ocr_calls_saved = len(psms) * (len(self.bims) - len(self.fan_groups))
+        logger.info(f'{len(self.fan_groups)} distinct of {len(self.bims)} binarized images, '
+                    f'{self.ocr_calls_saved} tesseract calls saved')
         threads = [threading.Thread(target=self.fan_recognize, args=(lang, psm), name=f't_{psm}') for psm in psms]
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
-
-    def validate_words(self):
+        with metrics.timed(self.timings, 'recognize'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def recognize_variant(self, lang, psm, skew=None):
+        """Recognizes the original image (:skew: None) or the binarized one for :skew: in given :psm:"""
+        image = self.im if skew is None else self.bims[skew]
+        return ocr.image_to_string(image, lang=lang, config=f'--psm {psm}').strip()
+
+    def prioritized_variants(self, psms):
         """
-        checks recognition results gathered in out_texts against corpus.
+        Returns (psm, skew) pairs in the order they are most likely to produce the right word: the original image
+        first, then distinct binarizations with skews spreading out from 100, each in all :psms: before the next one
         """
-        self.validated_words.clear()
+        skews = sorted(self.fan_groups, key=lambda first: min(abs(skew - 100) for skew in self.fan_groups[first]))
+        return [(psm, skew) for skew in [None, *skews] for psm in psms]
+
+    def adaptive_recognize(self, lang, kind=None, margin=None, min_calls=None, workers=None):
+        """Recognizing the image like `threads_recognize`, but submitting variants in priority order to a thread pool
+        and tallying the results as they arrive. As soon as the most frequent dictionary word leads the runner-up by
+        :margin: votes (after at least :min_calls: calls), the remaining calls are cancelled. A call that fails counts
+        as done with no text, the others going on without it. How many calls were made (and failed) and why recognition
+        stopped ('consensus' or 'exhausted') is kept in self.recognition_report
+        """
+        margin = margin or self.consensus_margin
+        min_calls = min_calls or self.consensus_min_calls
+        self.kind = kind
+        self.normalize_resolution(kind)
+        self.fan_binarize()
+        self.out_texts.clear()
+        psms = self.select_psms(kind)
+        variants = self.prioritized_variants(psms)
+        votes = {}
+        calls = errors = 0
+        reason = 'exhausted'
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=workers or len(psms), thread_name_prefix='recognize')
+        futures = {executor.submit(self.recognize_variant, lang, psm, skew): (psm, skew) for psm, skew in variants}
         try:
-            with open(self.corpus_path, encoding='utf-8') as corpus:
-                lexicon = corpus.readlines()
-                for key, text in self.out_texts.items():
-                    if text and len(text) > 1:
-                        for entry in lexicon:
-                            if text in entry:
-                                self.validated_words[key] = text
+            for future in as_completed(futures):
+                psm, skew = futures[future]
+                try:
+                    text = future.result()
+                except Exception as e:
+                    logger.error(f'recognition in psm {psm} of the {"original" if skew is None else skew} image '
+                                 f'failed: {e}')
+                    tb_logger.exception(e)
+                    errors += 1
+                    text = ''
+                calls += 1
+                if skew is None:
+                    self.out_texts[psm] = text
+                else:
+                    for each in self.fan_groups[skew]:
+                        self.out_texts[psm * 1000 + each] = text
+                if len(text) > 1 and '\n' not in text and self.is_word(text):
+                    votes[text] = votes.get(text, 0) + (1 if skew is None else len(self.fan_groups[skew]))
+                if calls >= min_calls and votes:
+                    leader, runner_up = (sorted(votes.values(), reverse=True) + [0])[:2]
+                    if leader - runner_up >= margin:
+                        reason = 'consensus'
+                        break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.timings['recognize'] = self.timings.get('recognize', 0) + time.perf_counter() - start
+        self.recognition_report = dict(calls=calls, errors=errors, planned=len(variants), stopped=reason,
+                                       scale=self.input_scale,
+                                       saved_by_dedup=len(psms) * (len(self.bims) - len(self.fan_groups)))
+        logger.info(f'recognition stopped on {reason} after {calls} of {len(variants)} tesseract calls'
+                    f'{f", {errors} failed" if errors else ""}')
+
+    def image_key(self, lang, kind=None, method='adaptive'):
+        """Returns the recognition cache key for the image recognized with given parameters: a hash of its decoded
+        pixels, so that the same picture re-encoded or sent as another file is still recognized as seen before"""
+        digest = hashlib.sha256(f'{self.im.mode}:{self.im.size}:{lang}:{kind}:{method}:{self.recognition_stamp()}:'
+                                .encode())
+        digest.update(self.im.tobytes())
+        return f'pixels:{digest.hexdigest()}'
+
+    def recognition_entry(self):
+        """Returns what the recognition cache keeps of the current results: suggestions, the recognition report and,
+        if `cache_out_texts` is set, the raw results"""
+        entry = {'suggestions': self.suggestions, 'report': dict(self.recognition_report, timings=self.timings)}
+        if self.cache_out_texts:
+            entry['out_texts'] = self.out_texts
+        return entry
+
+    def restore_recognition(self, entry):
+        """Takes results from a recognition cache :entry: (as stored, or as read back from its JSON on disk)"""
+        self.suggestions = [tuple(suggestion) for suggestion in entry['suggestions']]
+        self.out_texts = {int(key): text for key, text in entry.get('out_texts', {}).items()}
+        self.recognition_report = dict(entry['report'], cached=True)
+
+    def recognize_cached(self, lang, kind=None, file_id=None, adaptive=True):
+        """
+        Recognizes the image and generates word suggestions with `adaptive_recognize` (or `threads_recognize` if not
+        :adaptive:), unless the same pixels or the file with the same :file_id: have already been recognized with the
+        same parameters, in which case the results are taken from the recognition cache without calling tesseract.
+        :return: True if the results came from the cache.
+        """
+        method = 'adaptive' if adaptive else 'threads'
+        keys = [self.image_key(lang, kind, method)]
+        if file_id:
+            keys.insert(0, self.file_key(file_id, lang, kind, method))
+        entry = self.recall_recognition(keys)
+        if entry is not None:
+            self.restore_recognition(entry)
+            return True
+        if adaptive:
+            self.adaptive_recognize(lang, kind)
+        else:
+            self.threads_recognize(lang, kind)
+        self.generate_word_suggestions()
+        self.remember_recognition(keys, self.recognition_entry())
+        cache = self.get_recognition_cache()
+        logger.info(f'recognition cache: {cache.hits} hits, {cache.misses} misses')
+        return False
+
+    def get_lexicon(self):
+        """Returns the corpus lexicon, compiled and memory-mapped once per process (None if it could not be loaded)"""
+        try:
+            return load_lexicon(self.corpus_path, *self.word_lists, compiled=self.compiled_corpus_path)
         except Exception as e:
             logger.error(f"error accessing corpus: {e}")
             tb_logger.exception(e)
+            return None
+
+    def is_word(self, text):
+        """Checks if :text: is found in any corpus entry, the way `validate_words` does"""
+        lexicon = self.get_lexicon()
+        return bool(lexicon) and lexicon.contains_substring(text)
+
+    def validate_words(self):
+        """
+        checks recognition results gathered in out_texts against corpus.
+        """
+        self.validated_words.clear()
+        lexicon = self.get_lexicon()
+        if not lexicon:
+            return
+        for key, text in self.out_texts.items():
+            if text and len(text) > 1 and lexicon.contains_substring(text):
+                self.validated_words[key] = text
 
     def generate_word_suggestions(self):
-        self.validate_words()
+        with metrics.timed(self.timings, 'validate_words'):
+            self.validate_words()
         self.suggestions = self.get_freqs(self.validated_words.values())
         out_text_freqs = self.get_freqs([item for item in self.out_texts.values() if item and '\n' not in item])
         if self.suggestions:
@@ -194,7 +481,8 @@ class ClipImg2Text:
         for candidate in top_texts:
             if candidate[0] not in [item[0] for item in self.suggestions] and candidate[1] > enrichment_floor:
                 self.suggestions.append(candidate)
-                corrected = correct(candidate[0])
+                with metrics.timed(self.timings, 'correct'):
+                    corrected = correct(candidate[0])
                 if corrected not in [item[0] for item in self.suggestions]:
                     self.suggestions.append((corrected, -1))
         self.suggestions.sort(key=lambda item: item[1], reverse=True)
@@ -237,6 +525,49 @@ class ClipImg2Text:
 
 class DictLookup(ClipImg2Text):
     dic_url = 'https://dict.longdo.com/search/'
+    pool_size = 8  # keep-alive connections to the dictionary kept open for concurrent lookups
+    cache_path = 'lookup_cache.sqlite3'  # disk tier of the lookup cache, None for memory only
+    cache_capacity = 512  # lookups kept in memory
+    cache_ttl = 7 * 24 * 3600  # seconds
+    prefetch_top = 3  # top suggestions looked up in the background while the user chooses, 0 to disable
+    prefetch_workers = 4  # max concurrent prefetches
+    _session = None
+    _cache = None
+    _prefetcher = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls):
+        """Returns the HTTP session shared by all lookups, keeping connections alive and retrying failed requests
+        with backoff - the only retrying of lookups, so call it once per request"""
+        with cls._shared_lock:
+            if cls._session is None:
+                retry = Retry(total=2, backoff_factor=.5, status_forcelist=(500, 502, 503, 504))
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=cls.pool_size, max_retries=retry)
+                cls._session = rq.Session()
+                cls._session.mount('https://', adapter)
+                cls._session.mount('http://', adapter)
+            return cls._session
+
+    @classmethod
+    def get_cache(cls):
+        """Returns the lookup cache shared by all lookups, holding result records (see `parse_results`)"""
+        with cls._shared_lock:
+            if cls._cache is None:
+                cls._cache = LookupCache(cls.cache_path, cls.cache_capacity, cls.cache_ttl,
+                                         dumps=lambda record: json.dumps(record, ensure_ascii=False),
+                                         loads=json.loads)
+            return cls._cache
+
+    @classmethod
+    def get_prefetcher(cls):
+        """Returns the prefetcher shared by all lookups, storing what it fetches in the lookup cache"""
+        cache = cls.get_cache()
+        with cls._shared_lock:
+            if cls._prefetcher is None:
+                cls._prefetcher = Prefetcher(cls.fetch, cache.__contains__,
+                                             cls.prefetch_top, cls.prefetch_workers)
+            return cls._prefetcher
 
     @staticmethod
     def retry_or_none(func, attempts: int, seconds: int | float, *args, **kwargs):
@@ -249,44 +580,92 @@ class DictLookup(ClipImg2Text):
         :param kwargs: keyword arguments for the called function
         :return: whatever the called function should return or None in case of ultimate failure
         """
-        for _ in range(attempts):
-            try:
-                return func(*args, **kwargs)
-            except Exception as e:
-                logger.error(e)
-                tb_logger.exception(e)
-                logger.info('retrying...')
-                time.sleep(seconds)
-                continue
+        name = getattr(func, '__name__', 'call')
+        with metrics.call(name):
+            for _ in range(attempts):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    logger.error(e)
+                    tb_logger.exception(e)
+                    metrics.inc('bot_call_failures_total', call=name)
+                    logger.info('retrying...')
+                    time.sleep(seconds)
+                    continue
         return None
 
+    @staticmethod
+    def parse_results(page):
+        """
+        Extracts lookup results from a dictionary result :page: (bytes or text of the html) into a compact record:
+        a list of [dictionary name, rows, table markup] sections in page order, each row a list of its cell texts,
+        the markup the result table as served (links and formatting kept, for `output_html`). Only the
+        search-table-header cells and search-result-table tables are visited, by XPath over lxml's C parser.
+        """
+        if isinstance(page, str):
+            page = page.encode('utf-8')
+        tree = lxml.html.document_fromstring(page, parser=lxml.html.HTMLParser(encoding='utf-8'))
+        headers = tree.xpath('//td[contains(concat(" ", normalize-space(@class), " "), " search-table-header ")]')
+        tables = tree.xpath('//table[contains(concat(" ", normalize-space(@class), " "), " search-result-table ")]')
+        return [
+            [header.text_content(), [[cell.text_content() for cell in row.iter('td')] for row in table.iter('tr')],
+             lxml.html.tostring(table, encoding='unicode', with_tail=False)]
+            for header, table in zip(headers, tables)
+        ]
+
+    @staticmethod
+    def ranked_sections(record):
+        """Returns record sections with Longdo and HOPE dictionaries moved to the end"""
+        return sorted(record, key=lambda x: ('Longdo Dictionary' in x[0]) or ('HOPE Dictionary' in x[0]))
+
     def __init__(self):
         super().__init__()
         self.word = None
-        self.soup = None
+        self.record = None
 
-    def lookup(self, word):
-        self.soup = None
-        self.word = word
+    @classmethod
+    def fetch(cls, word):
+        """
+        Fetches and parses the dictionary page for :word:, storing the result record in the lookup cache.
+        :return: the result record or None if the page could not be fetched.
+        """
         logger.info(f'Looking up {word}... ')
-        response = self.retry_or_none(rq.get, 3, 1, self.dic_url + word, timeout=15)
+        with metrics.stage('longdo_fetch'):  # failed requests are retried by the session, not again here
+            response = cls.retry_or_none(cls.get_session().get, 1, 0, cls.dic_url + word, timeout=15)
         if not response or response.status_code != 200:
             logger.warning("Couldn't fetch.")
-            return False
-        response.encoding = 'utf-8'
-        self.soup = bs(response.text, features="lxml")
-        return True
+            return None
+        with metrics.stage('parse'):
+            record = cls.parse_results(response.content)
+        cls.get_cache().put(word, record)
+        return record
+
+    def lookup_cached(self, word):
+        """Takes lookup results for :word: from the lookup cache only, returning True if they were there"""
+        self.word = word
+        self.record = self.get_cache().get(word)
+        if self.record is not None:
+            logger.info(f'{word} found in lookup cache')
+        return self.record is not None
+
+    def lookup(self, word):
+        if self.lookup_cached(word):
+            return True
+        self.record = self.fetch(word)
+        return self.record is not None
 
     def output_html(self):
-        headers = self.soup.find_all('td', attrs={'class': 'search-table-header'})
-        tables = self.soup.find_all('table', attrs={'class': 'search-result-table'})
         style = '''<style>table {width: 60%;} </style>'''
         content = f'<h4>Lookup results for "<strong>{self.word}</strong>"</h4>'
-        for header, table in zip(headers, tables):
-            text = header.text
-            if not ('Subtitles' in text or 'German-Thai:' in text or 'French-Thai:' in text):
-                content += f'<h5>{header.text}</h5>\n'
-                content += str(table).replace("black", "white") + '\n'
+        for name, rows, *markup in self.record:
+            if not ('Subtitles' in name or 'German-Thai:' in name or 'French-Thai:' in name):
+                content += f'<h5>{escape(name)}</h5>\n'
+                if markup:
+                    content += markup[0].replace("black", "white") + '\n'
+                else:  # a record cached before the table markup was kept
+                    content += '<table class="search-result-table">' + ''.join(
+                        '<tr>' + ''.join(f'<td>{escape(cell)}</td>' for cell in row) + '</tr>' for row in rows
+                    ) + '</table>\n'
 
         with open('html/template.html', 'r', encoding='utf-8') as template:
             html = template.read()
@@ -297,43 +676,27 @@ class DictLookup(ClipImg2Text):
         display(HTML(style + content))
 
     def output_markdown(self):
-        if not self.soup:
+        if self.record is None:
             return ''
-        output = []
-        headers = self.soup.find_all('td', attrs={'class': 'search-table-header'})
-        tables = self.soup.find_all('table', attrs={'class': 'search-result-table'})
-        output.append(f'Lookup results for **{self.word}** from [Longdo Dictionary]({self.dic_url + self.word})\n')
-        for header, table in sorted(
-                zip(headers, tables),
-                key=lambda x: ('Longdo Dictionary' in x[0].text) or ('HOPE Dictionary' in x[0].text)
-        ):
-            text = header.text.replace("**", "")
-            if not ('Subtitles' in text):
-                output.append(f'\n**{header.text}**\n\n')
-                rows = table.find_all('tr')
+        output = [f'Lookup results for **{self.word}** from [Longdo Dictionary]({self.dic_url + self.word})\n']
+        for name, rows, *_ in self.ranked_sections(self.record):
+            if not ('Subtitles' in name.replace("**", "")):
+                output.append(f'\n**{name}**\n\n')
                 for row in rows:
                     output.append('- ')
-                    for cell in row.find_all('td'):
-                        output.append(f'{cell.text.replace("<i>", "_").replace("</i>", "_")}\n')
+                    for cell in row:
+                        output.append(f'{cell.replace("<i>", "_").replace("</i>", "_")}\n')
         return ''.join(output)
 
     def output_plain(self):
-        output = []
-        headers = self.soup.find_all('td', attrs={'class': 'search-table-header'})
-        tables = self.soup.find_all('table', attrs={'class': 'search-result-table'})
-        output.append(f'Lookup results for "{self.word}" from Longdo Dictionary \n{self.dic_url + self.word}\n')
-        for header, table in sorted(
-                zip(headers, tables),
-                key=lambda x: ('Longdo Dictionary' in x[0].text) or ('HOPE Dictionary' in x[0].text)
-        ):
-            text = header.text
-            if not ('Subtitles' in text):
-                output.append(f'\n{header.text}\n\n')
-                rows = table.find_all('tr')
+        output = [f'Lookup results for "{self.word}" from Longdo Dictionary \n{self.dic_url + self.word}\n']
+        for name, rows, *_ in self.ranked_sections(self.record):
+            if not ('Subtitles' in name):
+                output.append(f'\n{name}\n\n')
                 for row in rows:
                     output.append('- ')
-                    for cell in row.find_all('td'):
-                        output.append(f'{cell.text.replace("<i>", "").replace("</i>", "")}\n')
+                    for cell in row:
+                        output.append(f'{cell.replace("<i>", "").replace("</i>", "")}\n')
         return ''.join(output)
 
     def recognize_and_lookup(self, lang='tha', kind=None, output='html'):
@@ -342,12 +705,13 @@ class DictLookup(ClipImg2Text):
             return
         display(self.im)
         start = dt.now()
-        self.threads_recognize(lang, kind)
-        print(f'Done in {dt.now() - start}')
-        self.generate_word_suggestions()
+        cached = self.recognize_cached(lang, kind, adaptive=False)
+        print(f'Done in {dt.now() - start}{" (seen before)" if cached else ""}')
         if not self.suggestions:
             print('No meaningful recognition results could be obtained from the image')
             return
+        prefetcher = self.get_prefetcher()
+        prefetcher.prefetch(id(self), [suggestion[0] for suggestion in self.suggestions])
         top = self.suggestions[0]
         best_guess = f'The best guess is "{top[0]}" rated {top[1]}\n'
         others = 'Others:\n'
@@ -359,13 +723,16 @@ class DictLookup(ClipImg2Text):
             Enter to proceed with top-rated suggestion or number for other or any desired word:'''
         )
         if not word:
-            self.lookup(top[0])
+            word = top[0]
         else:
             try:
-                self.lookup(self.suggestions[int(word)][0])
+                word = self.suggestions[int(word)][0]
             except:
-                self.lookup(word)
-        if output == 'html' and self.soup:
+                pass
+        prefetcher.claim(id(self), word)
+        self.lookup(word)
+        prefetcher.cancel(id(self))
+        if output == 'html' and self.record:
             self.output_html()
 
 
@@ -0,0 +1,228 @@
+"""
+Local stand-ins for the outside services the bot talks to, for checking and measuring it without network access.
+LongdoStub serves Longdo-like search result pages; point `DictLookup.dic_url` at its `search_url` to use it.
+TelegramStub answers the Bot API methods the bot uses, keeping the messages sent and serving files added to it;
+run the bot with --api-url and --file-url set to its `api_url` and `file_url`.
+Run from this directory to serve both until interrupted: python stub_servers.py
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit, parse_qs
+
+LONGDO_PAGE = '''<html><head><meta charset="utf-8"><title>Longdo Dict</title></head><body>
+<div id="header">{filler}</div>
+{sections}
+<div id="footer">{filler}</div>
+</body></html>'''
+LONGDO_SECTION = '''<table width="100%"><tr><td class="search-table-header" colspan="2">{dictionary}</td></tr></table>
+<table class="search-result-table">{rows}</table>'''
+LONGDO_ROW = '<tr><td><b>{word}</b></td><td>[N] meaning {n} of {word}, <i>example</i> ({dictionary})</td></tr>'
+DICTIONARIES = ('Longdo Dictionary', 'NECTEC Lexitron Dictionary EN-TH', 'HOPE Dictionary', 'Subtitles')
+
+
+def longdo_page(word, rows=4, filler_size=20000):
+    """Builds a search result page for :word: shaped like Longdo's: result sections of several dictionaries
+    between bulky header and footer markup"""
+    sections = ''.join(
+        LONGDO_SECTION.format(dictionary=dictionary, rows=''.join(
+            LONGDO_ROW.format(word=word, n=n, dictionary=dictionary) for n in range(rows)))
+        for dictionary in DICTIONARIES)
+    return LONGDO_PAGE.format(sections=sections, filler='<span class="nav">menu</span>' * (filler_size // 30))
+
+
+class StubServer(ThreadingHTTPServer):
+    """Serves in a background thread on a free local port, counting requests and the connections they came on"""
+    daemon_threads = True
+
+    def __init__(self, handler, delay=0.0):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.delay = delay
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class LongdoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keeps connections alive, as Longdo does
+
+    def do_GET(self):
+        self.server.count()
+        path = unquote(urlsplit(self.path).path)
+        if not path.startswith('/search/'):
+            self.send_error(404)
+            return
+        time.sleep(self.server.delay)
+        body = longdo_page(path[len('/search/'):]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LongdoStub(StubServer):
+    """Stands in for dict.longdo.com, answering /search/<word> after :delay: seconds"""
+
+    def __init__(self, delay=0.0):
+        super().__init__(LongdoHandler, delay)
+
+    @property
+    def search_url(self):
+        return self.url + '/search/'
+
+
+class TelegramHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        self.server.count()
+        parts = urlsplit(self.path).path.split('/')  # '', 'bot<token>', method
+        if len(parts) != 3 or not parts[1].startswith('bot'):
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        if 'json' in self.headers.get('Content-Type', ''):
+            params = json.loads(body or '{}')
+        else:
+            params = {key: values[0] for key, values in parse_qs(body).items()}
+        time.sleep(self.server.delay)
+        result = self.server.call(parts[2], params)
+        if result is None:
+            self.reply({'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}, 404)
+        else:
+            self.reply({'ok': True, 'result': result})
+
+    def do_GET(self):
+        self.server.count()
+        path = unquote(urlsplit(self.path).path)
+        content = self.server.files_by_path.get(path.split('/', 3)[-1]) if path.startswith('/file/bot') else None
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def reply(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TelegramStub(StubServer):
+    """Stands in for the Telegram Bot API, answering after :delay: seconds"""
+    bot_user = {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+
+    def __init__(self, delay=0.0):
+        super().__init__(TelegramHandler, delay)
+        self.sent = []  # (time, chat id, text) of messages sent by the bot
+        self.sent_condition = threading.Condition(self.lock)
+        self.files = {}  # file id -> (file unique id, path)
+        self.files_by_path = {}  # path -> content
+
+    @property
+    def api_url(self):
+        return self.url + '/bot'
+
+    @property
+    def file_url(self):
+        return self.url + '/file/bot'
+
+    def add_file(self, file_id, content, name='image.png', unique_id=None):
+        """Makes :content: available for getFile :file_id: and download"""
+        path = f'files/{file_id}/{name}'
+        with self.lock:
+            self.files[file_id] = unique_id or f'u_{file_id}', path
+            self.files_by_path[path] = content
+
+    def wait_sent(self, chat_id, predicate, since=0, timeout=60):
+        """
+        Waits for a message to :chat_id: matching :predicate: (a function of its text) among those sent from index
+        :since: of `sent` on, returning its (time, chat id, text) or None on timeout
+        """
+        deadline = time.time() + timeout
+        with self.lock:
+            while True:
+                for message in self.sent[since:]:
+                    if message[1] == chat_id and predicate(message[2]):
+                        return message
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.sent_condition.wait(remaining)
+
+    def call(self, method, params):
+        """Returns the result of Bot API :method: called with :params:, None for methods not stood in for"""
+        if method == 'getMe':
+            return self.bot_user
+        if method in ('setWebhook', 'deleteWebhook'):
+            return True
+        if method == 'getUpdates':
+            time.sleep(min(float(params.get('timeout', 0)), 1))
+            return []
+        if method == 'getFile':
+            with self.lock:
+                unique_id, path = self.files.get(params.get('file_id'), (None, None))
+            if path is None:
+                return None
+            return {'file_id': params['file_id'], 'file_unique_id': unique_id, 'file_path': path,
+                    'file_size': len(self.files_by_path[path])}
+        if method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            with self.lock:
+                self.sent.append((time.time(), chat_id, params.get('text', '')))
+                message_id = len(self.sent)
+                self.sent_condition.notify_all()
+            return {'message_id': message_id, 'date': int(time.time()), 'from': self.bot_user,
+                    'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        return None
+
+
+def main():
+    with LongdoStub() as longdo, TelegramStub() as telegram:
+        print(f'Longdo search URL: {longdo.search_url}\n'
+              f'Telegram API URL: {telegram.api_url}\nTelegram file URL: {telegram.file_url}')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+SCREEN2TEXT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCREEN2TEXT)  # the modules import each other flat, as when run from their directory
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs the test in a fresh directory with the logs folder screen2text writes to"""
+    (tmp_path / 'logs').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
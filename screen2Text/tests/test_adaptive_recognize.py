@@ -0,0 +1,64 @@
+"""`adaptive_recognize` with tesseract calls stood in for by `recognize_variant` stubs."""
+import importlib
+
+import pytest
+from PIL import Image, ImageDraw
+
+
+@pytest.fixture
+def clip(workdir, monkeypatch):
+    """A ClipImg2Text on an image of a line of text, validating words against a word list of its own"""
+    cls = importlib.import_module('screen2text').ClipImg2Text
+    (workdir / 'words.txt').write_text('แมว\nหมา\n', encoding='utf-8')
+    monkeypatch.setattr(cls, 'corpus_path', str(workdir / 'words.txt'))
+    monkeypatch.setattr(cls, 'compiled_corpus_path', str(workdir / 'words.lexc'))
+    monkeypatch.setattr(cls, 'debug', False)
+    clip = cls()
+    clip.im = Image.new('L', (300, 80), 200)
+    ImageDraw.Draw(clip.im).rectangle((20, 20, 280, 60), fill=30)
+    return clip
+
+
+def stub(monkeypatch, clip, recognize):
+    calls = []
+
+    def recognize_variant(lang, psm, skew=None):
+        calls.append((psm, skew))
+        return recognize(psm, skew)
+
+    monkeypatch.setattr(clip, 'recognize_variant', recognize_variant)
+    return calls
+
+
+def test_stops_on_consensus(clip, monkeypatch):
+    calls = stub(monkeypatch, clip, lambda psm, skew: 'แมว')
+    clip.adaptive_recognize('tha', 'line', margin=3, min_calls=3, workers=1)
+    report = clip.recognition_report
+    assert report['stopped'] == 'consensus'
+    assert 3 <= report['calls'] < report['planned']
+    assert report['errors'] == 0
+    assert calls[0] == (1, None)  # the original image first
+
+
+def test_failed_calls_count_as_done_without_text(clip, monkeypatch):
+    def recognize(psm, skew):
+        if psm == 7:
+            raise RuntimeError('tesseract failed')
+        return 'แมว' if skew is None else 'ข'
+
+    stub(monkeypatch, clip, recognize)
+    clip.adaptive_recognize('tha', 'line', margin=100, workers=2)
+    report = clip.recognition_report
+    assert report['stopped'] == 'exhausted'
+    assert report['calls'] == report['planned']
+    assert report['errors'] == report['planned'] // len(clip.select_psms('line'))
+    assert clip.out_texts[7] == '' and clip.out_texts[1] == 'แมว'
+    clip.generate_word_suggestions()
+    assert clip.suggestions[0][0] == 'แมว'
+
+
+def test_report(clip, monkeypatch):
+    stub(monkeypatch, clip, lambda psm, skew: '')
+    clip.adaptive_recognize('tha', 'word', workers=2)
+    assert set(clip.recognition_report) == {'calls', 'errors', 'planned', 'stopped', 'scale', 'saved_by_dedup'}
+    assert clip.recognition_report['planned'] == len(clip.select_psms('word')) * (1 + len(clip.fan_groups))
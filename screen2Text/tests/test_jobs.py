@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from jobs import BUSY, USER_LIMIT, JobRunner
+
+
+def die():
+    os._exit(1)  # as a worker killed by the OOM killer or crashing in tesseract
+
+
+@pytest.fixture
+def runner():
+    runner = JobRunner(ocr_workers=1, lookup_workers=4, per_user=2, max_pending=3, ocr_processes=False)
+    yield runner
+    runner.shutdown()
+
+
+def test_per_user_limit(runner):
+    release = threading.Event()
+    assert runner.submit('lookup', 'a', release.wait) is None
+    assert runner.submit('lookup', 'a', release.wait) is None
+    assert runner.submit('lookup', 'a', release.wait) == USER_LIMIT
+    assert runner.submit('lookup', 'b', release.wait) is None  # others are not held up by them
+    release.set()
+
+
+def test_busy_cap(runner):
+    release = threading.Event()
+    for user in 'abc':
+        assert runner.submit('lookup', user, release.wait) is None
+    assert runner.submit('ocr', 'd', release.wait) == BUSY
+    release.set()
+
+
+def test_shutdown_drains_accepted_jobs(runner):
+    done = []
+
+    def job(n):
+        time.sleep(.2)
+        done.append(n)
+
+    for n, user in enumerate('abc'):
+        assert runner.submit('lookup' if n else 'ocr', user, job, n) is None
+    runner.shutdown()
+    assert sorted(done) == [0, 1, 2]
+    assert runner.pending == 0 and not runner.in_flight
+    assert runner.submit('lookup', 'a', job, 3) == BUSY
+
+
+def test_dead_worker_fails_only_its_job():
+    runner = JobRunner(ocr_workers=1, ocr_processes=True)
+    try:
+        assert runner.in_process(pow, 2, 3) == 8
+        with pytest.raises(BrokenProcessPool):
+            runner.in_process(die)
+        assert runner.in_process(pow, 2, 5) == 32  # in a new pool
+    finally:
+        runner.shutdown()
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from lexicon import CompiledLexicon, Lexicon, compile_lexicon, load_lexicon
+
+LINES = ['แมว\n', 'หมา\n', ' padded \n', 'words \n', 'แมว\n', 'cat s\n', 'and\n', '\n', 'last']
+QUERIES = ['แมว', 'มว', 'ม', ' s', 'd ', 'ds', 's\n', ' padded', 'padded', 'and', 'and\n', 'st', 'st\n', '',
+           'x']
+
+
+def scan(text):
+    """The reference: a plain scan of the word list lines, the last one taken as ending with a newline like all
+    the others (as both lexicons take it)"""
+    return [line.rstrip('\n') for line in LINES if text in line.rstrip('\n') + '\n']
+
+
+@pytest.fixture
+def word_list(tmp_path):
+    path = tmp_path / 'words.txt'
+    path.write_text(''.join(LINES), encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def compiled(word_list, tmp_path):
+    path = str(tmp_path / 'words.lexc')
+    compile_lexicon([word_list], path)
+    with CompiledLexicon(path) as lexicon:
+        yield lexicon
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_compiled_searches_like_a_scan(word_list, compiled, query):
+    assert sorted(compiled.entries_containing(query)) == sorted(scan(query))
+    assert compiled.entries_containing(query) == Lexicon.from_file(word_list).entries_containing(query)
+    assert compiled.contains_substring(query) == bool(scan(query))
+
+
+@pytest.mark.parametrize('word', ['แมว', 'padded', 'words', 'and', 'last', ' padded', 'cat', 'x'])
+def test_compiled_exact_lookup_like_lexicon(word_list, compiled, word):
+    assert (word in compiled) == (word in Lexicon.from_file(word_list))
+
+
+def test_recompiled_after_closing(word_list, tmp_path):
+    path = str(tmp_path / 'words.lexc')
+    first = load_lexicon(word_list, compiled=path)
+    assert 'extra' not in first
+    with open(word_list, 'a', encoding='utf-8') as words:
+        words.write('\nextra\n')
+    os.utime(word_list, ns=(0, os.stat(word_list).st_mtime_ns + 10 ** 9))
+    second = load_lexicon(word_list, compiled=path)
+    assert first.map.closed  # unmapped before its file was replaced
+    assert 'extra' in second
+    second.close()
+
+
+def test_reloaded_when_a_custom_word_list_changes(word_list, tmp_path):
+    custom = tmp_path / 'custom.txt'
+    custom.write_text('ศัพท์\n', encoding='utf-8')
+    first = load_lexicon(word_list, str(custom))
+    assert 'ศัพท์' in first and 'แมว' in first
+    custom.write_text('ศัพท์\nextra\n', encoding='utf-8')
+    os.utime(custom, ns=(0, os.stat(custom).st_mtime_ns + 10 ** 9))
+    second = load_lexicon(word_list, str(custom))
+    assert second is not first
+    assert 'extra' in second and second.entries_containing('xtr') == ['extra']
+
+
+def test_closes_while_lookup_results_are_held(compiled):
+    posting = compiled.posting('แมว')
+    entries = compiled.entries_containing('มว')
+    compiled.close()
+    assert compiled.map.closed
+    assert list(posting) == [0, 4]
+    assert entries == ['แมว', 'แมว']
+
+
+def test_close_leaves_the_map_to_views_held_elsewhere(compiled):
+    view = compiled.entry_blob[:3]
+    compiled.close()  # no BufferError
+    assert not compiled.map.closed
+    assert bytes(view) == 'แมว'.encode('utf-8')[:3]
+    view.release()
+    compiled.close()
+    assert compiled.map.closed
@@ -0,0 +1,54 @@
+"""Parsing of Longdo result pages (tests/longdo_pages: result tables saved from dict.longdo.com) against the
+BeautifulSoup extraction lookups used before `DictLookup.parse_results`."""
+import importlib
+import os
+
+import lxml.html
+import pytest
+from bs4 import BeautifulSoup as bs
+
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'longdo_pages')
+
+
+@pytest.fixture(params=sorted(os.listdir(PAGES)))
+def page(request):
+    with open(os.path.join(PAGES, request.param), 'rb') as file:
+        return file.read()
+
+
+@pytest.fixture
+def dict_lookup(workdir):
+    (workdir / 'html').mkdir()
+    (workdir / 'html' / 'template.html').write_text('<html><body>\n%content%</body></html>', encoding='utf-8')
+    return importlib.import_module('screen2text').DictLookup
+
+
+def soup_html(page):
+    """The result tables as `output_html` rendered them from a BeautifulSoup tree of the page"""
+    soup = bs(page.decode('utf-8'), features="lxml")
+    headers = soup.find_all('td', attrs={'class': 'search-table-header'})
+    tables = soup.find_all('table', attrs={'class': 'search-result-table'})
+    return [str(table).replace("black", "white") for header, table in zip(headers, tables)
+            if not ('Subtitles' in header.text or 'German-Thai:' in header.text or 'French-Thai:' in header.text)]
+
+
+def canonical(markup):
+    return lxml.html.tostring(lxml.html.fragment_fromstring(markup), encoding='unicode')
+
+
+def test_parsed_like_soup(dict_lookup, page):
+    extract = importlib.import_module('bench_longdo_parse').soup_extract
+    record = dict_lookup.parse_results(page)
+    assert [section[:2] for section in record] == extract(page)
+    assert len(record) > 5
+
+
+def test_html_keeps_tables_as_served(dict_lookup, page, workdir):
+    lookup = dict_lookup()
+    lookup.word = 'word'
+    lookup.record = dict_lookup.parse_results(page)
+    lookup.output_html()
+    out = lxml.html.document_fromstring((workdir / 'html' / 'out.html').read_text(encoding='utf-8'))
+    tables = [lxml.html.tostring(table, encoding='unicode', with_tail=False) for table in out.iter('table')]
+    assert tables == [canonical(table) for table in soup_html(page)]
+    assert any(table.xpath('.//a[@href]') for table in out.iter('table'))  # links to other lookups
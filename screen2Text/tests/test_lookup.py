@@ -0,0 +1,103 @@
+"""Dictionary lookups against LongdoStub, a local stand-in for dict.longdo.com: both tiers of the lookup cache and
+connection reuse by the pooled session."""
+import importlib
+
+import pytest
+
+import lookup_cache
+from lookup_cache import LookupCache
+from stub_servers import LongdoStub
+
+WORDS = ('แมว', 'หมา', 'เกล้า', 'ภาษา', 'หนังสือ')
+
+
+@pytest.fixture
+def longdo():
+    with LongdoStub() as stub:
+        yield stub
+
+
+@pytest.fixture
+def dict_lookup(workdir, longdo, monkeypatch):
+    """DictLookup pointed at the stub, with its shared session, cache and prefetcher made afresh"""
+    screen2text = importlib.import_module('screen2text')
+    lookup = screen2text.DictLookup
+    monkeypatch.setattr(lookup, 'dic_url', longdo.search_url)
+    monkeypatch.setattr(lookup, 'cache_path', str(workdir / 'lookup_cache.sqlite3'))
+    for shared in ('_session', '_cache', '_prefetcher'):
+        monkeypatch.setattr(lookup, shared, None)
+    yield lookup
+    if lookup._cache:
+        lookup._cache.close()
+    if lookup._session:
+        lookup._session.close()
+
+
+def test_memory_hit(dict_lookup, longdo):
+    first = dict_lookup()
+    assert first.lookup(WORDS[0])
+    second = dict_lookup()
+    assert second.lookup(WORDS[0])
+    assert second.record == first.record
+    assert longdo.requests == 1
+    assert dict_lookup.get_cache().hits == {'memory': 1, 'disk': 0}
+
+
+def test_disk_hit_after_restart(dict_lookup, longdo, monkeypatch):
+    assert dict_lookup().lookup(WORDS[1])
+    record = dict_lookup.get_cache().get(WORDS[1])
+    dict_lookup._cache.close()
+    monkeypatch.setattr(dict_lookup, '_cache', None)  # as after a restart: nothing in memory
+    lookup = dict_lookup()
+    assert lookup.lookup(WORDS[1])
+    assert lookup.record == record
+    assert longdo.requests == 1
+    assert dict_lookup.get_cache().hits == {'memory': 0, 'disk': 1}
+
+
+def test_ttl_expiry(workdir, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lookup_cache.time, 'time', lambda: now[0])
+    cache = LookupCache(str(workdir / 'cache.sqlite3'), capacity=4, ttl=60)
+    cache.put(WORDS[2], 'meaning')
+    now[0] += 59
+    assert cache.get(WORDS[2]) == 'meaning'
+    now[0] += 2
+    assert cache.get(WORDS[2]) is None
+    assert WORDS[2] not in cache
+    cache.close()
+    reopened = LookupCache(str(workdir / 'cache.sqlite3'), capacity=4, ttl=60)
+    assert reopened.get(WORDS[2]) is None  # expired on disk as well
+    reopened.close()
+
+
+def test_memory_tier_is_lru(workdir):
+    cache = LookupCache(None, capacity=2)
+    cache.put('a', '1')
+    cache.put('b', '2')
+    cache.get('a')
+    cache.put('c', '3')  # evicts b, the least recently used
+    assert list(cache.memory) == ['a', 'c']
+    assert cache.get('b') is None
+
+
+def test_session_reuses_connections(dict_lookup, longdo):
+    for word in WORDS:
+        assert dict_lookup.fetch(word) is not None
+    assert longdo.requests == len(WORDS)
+    assert longdo.connections == 1
+
+
+def test_disk_tier_purged_as_it_goes(workdir, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lookup_cache.time, 'time', lambda: now[0])
+    cache = LookupCache(str(workdir / 'cache.sqlite3'), capacity=4, ttl=60, purge_every=10)
+    for i in range(10):
+        cache.put(f'old {i}', 'meaning')
+    now[0] += 61
+    for i in range(9):
+        cache.put(f'new {i}', 'meaning')
+    assert cache.db.execute('SELECT COUNT(*) FROM lookups').fetchone()[0] == 19
+    cache.put('new 9', 'meaning')  # the 20th put purges
+    assert cache.db.execute('SELECT COUNT(*) FROM lookups').fetchone()[0] == 10
+    cache.close()
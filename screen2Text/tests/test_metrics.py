@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import metrics
+from metrics import Registry
+
+
+@pytest.fixture
+def traced(tmp_path, monkeypatch):
+    """Instrumentation on, with request traces rotated at a few hundred bytes, restored afterwards"""
+    monkeypatch.setattr(metrics, 'serve', lambda port: 'server')
+    monkeypatch.setattr(metrics, 'enabled', False)
+    monkeypatch.setattr(metrics, 'registry', Registry())
+    handlers, level = list(metrics._trace_log.handlers), metrics._trace_log.level
+    log_path = tmp_path / 'logs' / 'metrics.jsonl'
+    assert metrics.configure(port=9999, log_path=str(log_path), max_bytes=300, backups=2) == 'server'
+    yield log_path
+    for handler in metrics._trace_log.handlers:
+        handler.close()
+    metrics._trace_log.handlers[:] = handlers
+    metrics._trace_log.setLevel(level)
+
+
+def test_exposes_counters_histograms_and_gauges():
+    registry = Registry()
+    registry.inc('bot_requests_total', kind='image', status='ok')
+    registry.inc('bot_requests_total', 2, kind='image', status='ok')
+    registry.observe('bot_stage_seconds', .02, buckets=(.01, .1), stage='ocr')
+    registry.observe('bot_stage_seconds', 5, buckets=(.01, .1), stage='ocr')
+    registry.register_gauges('bot_cache_entries', lambda: {'lookups': 7})
+    registry.register_gauges('bot_broken', lambda: 1 / 0)
+    assert registry.exposition().splitlines() == [
+        '# TYPE bot_requests_total counter',
+        'bot_requests_total{kind="image",status="ok"} 3',
+        '# TYPE bot_stage_seconds histogram',
+        'bot_stage_seconds_bucket{stage="ocr",le="0.01"} 0',
+        'bot_stage_seconds_bucket{stage="ocr",le="0.1"} 1',
+        'bot_stage_seconds_bucket{stage="ocr",le="+Inf"} 2',
+        'bot_stage_seconds_sum{stage="ocr"} 5.02',
+        'bot_stage_seconds_count{stage="ocr"} 2',
+        '# TYPE bot_cache_entries gauge',
+        'bot_cache_entries{key="lookups"} 7',
+    ]
+
+
+def test_escapes_label_values():
+    registry = Registry()
+    registry.inc('bot_errors_total', error='bad "word"\\n\nnext')
+    registry.register_gauges('bot_cache_entries', lambda: {'C:\\cache': 1})
+    lines = registry.exposition().splitlines()
+    assert 'bot_errors_total{error="bad \\"word\\"\\\\n\\nnext"} 1' in lines
+    assert 'bot_cache_entries{key="C:\\\\cache"} 1' in lines
+
+
+def test_configure_stays_off_without_a_port(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    assert metrics.configure(port=0) is None
+    assert metrics.request('image') is metrics._null
+
+
+def test_writes_a_trace_per_request_and_rotates(traced):
+    for i in range(20):
+        with metrics.request('image', user=i):
+            with metrics.stage('ocr'):
+                pass
+    with pytest.raises(ValueError):
+        with metrics.request('lookup', user='last'):
+            raise ValueError
+    files = sorted(path.name for path in traced.parent.iterdir())
+    assert files == ['metrics.jsonl', 'metrics.jsonl.1', 'metrics.jsonl.2']
+    traces = [json.loads(line) for name in reversed(files) for line in (traced.parent / name).read_text().splitlines()]
+    assert all(path.stat().st_size <= 300 for path in traced.parent.iterdir())
+    assert traces[-1]['kind'] == 'lookup' and traces[-1]['user'] == 'last' and traces[-1]['status'] == 'error'
+    assert [trace['user'] for trace in traces[:-1]] == list(range(20 - len(traces) + 1, 20))
+    assert all(set(trace['stages']) == {'ocr'} for trace in traces[:-1])
+    assert 'bot_requests_total{kind="lookup",status="error"} 1' in metrics.registry.exposition().splitlines()
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from prefetch import Prefetcher
+
+
+class Lookups:
+    """Stands for DictLookup.fetch with a cache: records what is fetched, optionally held until released"""
+
+    def __init__(self, cached=(), results=None):
+        self.cached = set(cached)
+        self.results = results or {}
+        self.fetched = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def fetch(self, word):
+        self.fetched.append(word)
+        self.release.wait(5)
+        result = self.results.get(word, [['dictionary', [[word, 'meaning']]]])
+        if isinstance(result, Exception):
+            raise result
+        if result is not None:
+            self.cached.add(word)
+        return result
+
+
+@pytest.fixture
+def lookups():
+    return Lookups(cached={'b'})
+
+
+@pytest.fixture
+def prefetcher(lookups):
+    prefetcher = Prefetcher(lookups.fetch, lookups.cached.__contains__, top=3, workers=1)
+    yield prefetcher
+    lookups.release.set()
+    prefetcher.close()
+
+
+def test_top_words_in_order_without_duplicates(prefetcher, lookups):
+    prefetcher.prefetch('user', ['a', 'b', 'a', 'c', 'd'])
+    batch = prefetcher.batches['user']
+    assert list(batch.futures) == ['a', 'c'] and batch.cached == {'b'}  # d is not in the top 3
+    prefetcher.executor.shutdown(wait=True)
+    assert lookups.fetched == ['a', 'c']
+    assert prefetcher.stats['scheduled'] == 2 and prefetcher.stats['already_cached'] == 1
+
+
+def test_new_batch_cancels_what_has_not_started(prefetcher, lookups):
+    lookups.release.clear()
+    prefetcher.prefetch('user', ['x', 'y', 'z'])
+    first = prefetcher.batches['user'].futures
+    while not first['x'].running():  # taken by the only worker
+        time.sleep(.01)
+    prefetcher.prefetch('user', ['w'])
+    assert first['y'].cancelled() and first['z'].cancelled()
+    lookups.release.set()
+    prefetcher.executor.shutdown(wait=True)
+    assert lookups.fetched == ['x', 'w']
+    assert prefetcher.stats['cancelled'] == 2
+    assert prefetcher.stats['wasted'] == 1  # x, fetched for nothing
+
+
+def test_claims(prefetcher, lookups):
+    prefetcher.prefetch('user', ['a', 'b', 'c'])
+    assert prefetcher.claim('user', 'a')
+    assert not prefetcher.claim('user', 'b')  # was cached already, neither hit nor miss
+    assert not prefetcher.claim('user', 'e')
+    assert not prefetcher.claim('other', 'a')
+    stats = prefetcher.stats
+    assert stats['hits'] + stats['late_hits'] == 1 and stats['misses'] == 1
+    assert prefetcher.hit_rate == .5
+
+
+def test_no_results_counted_apart_from_failures():
+    lookups = Lookups(results={'none': [], 'down': None, 'boom': RuntimeError('connection reset')})
+    prefetcher = Prefetcher(lookups.fetch, lookups.cached.__contains__, top=4, workers=2)
+    prefetcher.prefetch('user', ['found', 'none', 'down', 'boom'])
+    prefetcher.executor.shutdown(wait=True)
+    stats = prefetcher.stats
+    assert (stats['completed'], stats['no_results'], stats['failed']) == (1, 1, 2)
+    assert 'none' in lookups.cached  # not fetched again
@@ -0,0 +1,42 @@
+import importlib
+import os
+
+import pytest
+from PIL import Image
+
+ENTRY = {'suggestions': [('แมว', 1.0)], 'report': {'calls': 3}}
+
+
+@pytest.fixture
+def clip(workdir, monkeypatch):
+    """ClipImg2Text with a memory only recognition cache of its own and a word list in the work directory"""
+    clip = importlib.import_module('screen2text').ClipImg2Text
+    (workdir / 'words.txt').write_text('แมว\nหมา\n', encoding='utf-8')
+    monkeypatch.setattr(clip, 'corpus_path', 'words.txt')
+    monkeypatch.setattr(clip, 'recognition_cache_path', None)
+    monkeypatch.setattr(clip, '_recognition_cache', None)
+    return clip
+
+
+def test_empty_results_not_cached(clip):
+    clip.remember_recognition(['empty'], dict(ENTRY, suggestions=[]))
+    clip.remember_recognition(['found'], ENTRY)
+    assert clip.recall_recognition(['empty']) is None
+    assert clip.recall_recognition(['found']) == ENTRY
+
+
+def test_keys_change_with_recognition_version(clip, monkeypatch):
+    x = clip()
+    x.im = Image.new('L', (40, 20), 255)
+    keys = x.image_key('tha'), clip.file_key('id', 'tha')
+    assert keys == (x.image_key('tha'), clip.file_key('id', 'tha'))
+    monkeypatch.setattr(clip, 'recognition_version', clip.recognition_version + 1)
+    assert x.image_key('tha') != keys[0] and clip.file_key('id', 'tha') != keys[1]
+
+
+def test_keys_change_with_word_list(clip, workdir):
+    key = clip.file_key('id', 'tha')
+    with open(workdir / 'words.txt', 'a', encoding='utf-8') as words:
+        words.write('ภาษา\n')
+    os.utime(workdir / 'words.txt', ns=(0, os.stat(workdir / 'words.txt').st_mtime_ns + 10 ** 9))
+    assert clip.file_key('id', 'tha') != key
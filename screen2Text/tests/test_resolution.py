@@ -0,0 +1,41 @@
+import importlib
+
+import pytest
+from PIL import Image, ImageDraw
+
+
+def text_image(lines, line_height, width=800):
+    """White image with :lines: black bars of :line_height: px, as many lines of text"""
+    im = Image.new('L', (width, lines * line_height * 2 + line_height), 255)
+    draw = ImageDraw.Draw(im)
+    for i in range(lines):
+        top = line_height + 2 * i * line_height
+        draw.rectangle((10, top, width - 10, top + line_height - 1), fill=0)
+    return im
+
+
+@pytest.fixture
+def clip(workdir):
+    return importlib.import_module('screen2text').ClipImg2Text()
+
+
+@pytest.mark.parametrize('kind', [None, 'block'])
+def test_multiline_images_left_as_they_are(clip, kind):
+    clip.im = im = text_image(lines=10, line_height=20)
+    clip.normalize_resolution(kind)
+    assert clip.im is im
+    assert clip.input_scale == 1.0
+
+
+@pytest.mark.parametrize('kind', ['word', 'line'])
+def test_oversized_line_scaled_to_text_height(clip, kind):
+    clip.im = text_image(lines=1, line_height=200)
+    clip.normalize_resolution(kind)
+    assert clip.input_scale == pytest.approx(clip.text_height / 200, abs=.001)
+    assert clip.ink_height() == pytest.approx(clip.text_height, abs=2)
+
+
+def test_line_within_range_left_as_it_is(clip):
+    clip.im = im = text_image(lines=1, line_height=48)
+    clip.normalize_resolution('line')
+    assert clip.im is im
@@ -0,0 +1,7 @@
+import importlib
+
+
+def test_one_engine_module(workdir):
+    screen2text = importlib.import_module('screen2text')
+    batch = importlib.import_module('pages2Text.batch')
+    assert screen2text.ocr is batch.ocr  # one engine and pool, configured once for both
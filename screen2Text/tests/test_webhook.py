@@ -0,0 +1,67 @@
+import importlib
+import json
+import os
+import queue
+import signal
+import threading
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from webhook import UpdateReceiver
+
+UPDATE = {'update_id': 7, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+                                      'text': 'lookup แมว'}}
+
+
+@pytest.fixture
+def receiver(tmp_path):
+    dispatcher = SimpleNamespace(bot=None, update_queue=queue.Queue())
+    receiver = UpdateReceiver(dispatcher, port=0, path='/secret-path', record=str(tmp_path / 'updates.jsonl'),
+                              secret_token='token')
+    thread = threading.Thread(target=receiver.serve_forever, daemon=True)
+    thread.start()
+    yield receiver
+    receiver.shutdown()
+    receiver.server_close()
+    thread.join()
+
+
+def post(receiver, data, path='/secret-path', token='token'):
+    url = f'http://127.0.0.1:{receiver.server_address[1]}{path}'
+    headers = {'X-Telegram-Bot-Api-Secret-Token': token} if token is not None else {}
+    return requests.post(url, data=data, headers=headers, timeout=5).status_code
+
+
+def test_update_queued_and_recorded(receiver, tmp_path):
+    assert post(receiver, json.dumps(UPDATE).encode()) == 200
+    update = receiver.dispatcher.update_queue.get(timeout=5)
+    assert update.update_id == 7 and update.message.text == 'lookup แมว'
+    receiver.record.flush()
+    assert json.loads((tmp_path / 'updates.jsonl').read_text(encoding='utf-8')) == UPDATE
+
+
+def test_malformed_payload_rejected(receiver):
+    assert post(receiver, b'{"update_id": ') == 400
+    assert receiver.dispatcher.update_queue.empty()
+
+
+@pytest.mark.parametrize('path, token, status', [('/other', 'token', 404), ('/secret-path', 'wrong', 403),
+                                                 ('/secret-path', None, 403)])
+def test_posts_without_the_secrets_rejected(receiver, path, token, status):
+    assert post(receiver, json.dumps(UPDATE).encode(), path, token) == status
+    assert receiver.dispatcher.update_queue.empty()
+
+
+def test_sigterm_stops_webhook_mode(workdir):
+    bot = importlib.import_module('Screen2DictBot')
+    stopped = threading.Event()
+    dispatcher = SimpleNamespace(bot=None, update_queue=queue.Queue(), start=stopped.wait, stop=stopped.set)
+    args = bot.parse_args(['--mode', 'webhook', '--port', '0'])
+    timer = threading.Timer(.5, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+    bot.run_webhook(SimpleNamespace(dispatcher=dispatcher, bot=None), args)  # returns once the signal is handled
+    assert stopped.is_set()
+    assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+    bot.jobs.shutdown()
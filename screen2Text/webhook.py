@@ -0,0 +1,80 @@
+"""
+Webhook receiver of the bot: a small HTTP server taking update payloads Telegram posts to the webhook URL and
+putting them on the dispatcher's update queue, to be handled by the same handlers as in polling mode. Answers right
+away and lets the dispatcher and the job runner do the work, so Telegram never waits on recognition.
+Incoming payloads can be recorded one JSON object per line (:record:) for replaying with replay_updates.py.
+Posts are taken only on the secret path and, with a :secret_token: (registered with setWebhook), only if they carry
+it in the X-Telegram-Bot-Api-Secret-Token header.
+"""
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        if self.path.split('?')[0] != server.path:
+            self.send_error(404)
+            return
+        if server.secret_token is not None:
+            token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(token.encode(), server.secret_token.encode()):
+                logger.warning(f'rejected webhook post from {self.client_address[0]}: wrong secret token')
+                self.send_error(403)
+                return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = self.rfile.read(length)
+            update = Update.de_json(json.loads(payload), server.dispatcher.bot)
+        except Exception as e:
+            logger.warning(f'rejected webhook payload: {e}')
+            self.send_error(400)
+            return
+        server.dispatcher.update_queue.put(update)
+        if server.record:
+            with server.lock:
+                server.record.write(payload.decode('utf-8').replace('\n', ' ') + '\n')
+                server.record.flush()
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UpdateReceiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, dispatcher, listen='127.0.0.1', port=8443, path='/telegram', record=None, secret_token=None):
+        """
+        :param dispatcher: telegram.ext.Dispatcher with the bot's handlers registered.
+        :param listen: address to listen on.
+        :param port: port to listen on, 0 for any free one.
+        :param path: URL path updates are posted to, better hard to guess, as anyone knowing it can post updates.
+        :param record: path of a file to append received payloads to, None not to record.
+        :param secret_token: token posts have to carry (the secret_token given to setWebhook), None not to check.
+        """
+        super().__init__((listen, port), UpdateHandler)
+        self.dispatcher = dispatcher
+        self.path = path if path.startswith('/') else f'/{path}'
+        self.record = open(record, 'a', encoding='utf-8') if record else None
+        self.secret_token = secret_token
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}{self.path}'
+
+    def server_close(self):
+        super().server_close()
+        if self.record:
+            self.record.close()
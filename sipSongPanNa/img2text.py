@@ -10,6 +10,9 @@ import matplotlib.pyplot as plt
 from skimage.filters import *
 import pytesseract
 
+from pages2Text import ocr_engine as ocr
+from pages2Text.kernels import clean_margins_array, estimate_skew_array, segment_array, smart_binarize_rows
+
 tess_path = 'C:/Program Files/Tesseract-OCR/tesseract.exe'
 # tess_path = r'C:\Users\User\AppData\Local\Tesseract-OCR\tesseract.exe'
 pytesseract.pytesseract.tesseract_cmd = tess_path
@@ -136,13 +139,14 @@ def clean_edges_as_array(array, threshold):
     return array
 
 
-def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False):
+def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False, last_pixel_quirk=True):
     """Takes a PIL image in 'L' mode and changes each pixel value to O (black) or 255 (white) over the dynamically
     adjusted row-specific threshold
     :image: PIL image object
     :threshold: a value over which to binarize. If not specified, set automatically to the midpoint
     between minimum and maximum luminosity values in the entire image, then dynamically adjusted for rows
     potentially containing pale text according to row-specific extremes
+    :last_pixel_quirk: leave the last pixel of each text row as is (compatibility with the former per-pixel loop)
     :returns a PIL image object in binary mode ('1')
     """
     array = np.asarray(im).copy()
@@ -166,26 +170,9 @@ def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False):
         array = array.T
         print(' - transposed')
         transposed = True
-    for row in array:
-        bottom = int(row.min())
-        top = int(row.max())
-        if bottom > threshold * 1.5:  # entire row well above the threshold - no text, turn to white
-            row[:] = 255
-        elif bottom > (floor + (ceiling - floor) * .02):
-            # might have some pale text - cautiously binarize over row-specific threshold
-            row_threshold = (bottom + top) // t_factor
-            # print(row_threshold, end=', ')
-            for i in range(len(row) - 1):
-                if row[i] > row_threshold:
-                    row[i] = 255
-                else:
-                    row[i] = 0
-        else:  # such rows are most likely to have normal black text - binarize over the base threshold
-            for i in range(len(row) - 1):
-                if row[i] > threshold:
-                    row[i] = 255
-                else:
-                    row[i] = 0
+    # rows well above the threshold turn white, rows that might have some pale text are cautiously binarized
+    # over row-specific thresholds, the rest (most likely normal black text) over the base threshold
+    smart_binarize_rows(array, threshold, floor, ceiling, t_factor, last_pixel_quirk)
     if transposed:
         print(' - transposing back...')
         array = array.T
@@ -193,7 +180,7 @@ def smart_binarize_as_array(im, threshold=None, t_factor=2.2, edges=False):
 
 
 def count_white_rows(im):
-    """Utility function used by deskew.
+    """Utility function used by orientation.
     Takes a binarized image, returns the number of pixel rows with zero black pixels"""
     array = np.asarray(im)
     count = 0
@@ -263,96 +250,43 @@ def clip_sides_3d(im):
     return Image.fromarray(array)
 
 
-def clean_margins(im):
+def clean_margins(im, ray_fraction=.02, trigger=.995):
     """Takes a binarized PIL image object (mode '1'), identifies left and right content boundaries and clears all
-    black pixels towards the edges. A scanning 'ray' of set width will start some reasonable distance into the image
-    and scan towards each edge. As soon as it can shoot through from top to bottom detecting no or very few non-white
-    pixels - this is considered content boundary. Any black pixels from this line towards the edge will be cleared.
+    black pixels towards the edges. A scanning 'ray' of :ray_fraction: of the image width will start some reasonable
+    distance into the image and scan towards each edge. As soon as it can shoot through from top to bottom detecting
+    no or very few non-white pixels (white fraction over :trigger:) - this is considered content boundary. Any black
+    pixels from this line towards the edge will be cleared.
     Upper and lower halves of vertical images are processed separately to deal with possible distortions.
     Returns image with clean margins """
     array = np.asarray(im).copy()  # converting the image to Numpy array
-    ray_width = int(im.width * .02)  # setting scanning ray width to a fraction of the image width
-    trigger = .995
-    if ray_width < 3:
-        ray_width = 3  # but no less than 3 pixels
-    start = im.width // 4
-    if im.width < im.height:  # vertical image processing in two halves
-        slash = im.height // 2
-        # Processing the upper half
-        # Wiping the right margin clean
-        for i in range(im.width - start, im.width - ray_width):
-            if np.mean(array[:slash, i: (i + ray_width)]) > trigger:
-                array[:slash, (i + ray_width):] = True
-                break
-        # Wiping the left margin clean
-        for i in range(start):
-            i = start - i
-            if np.mean(array[:slash, i: (i + ray_width)]) > trigger:
-                array[:slash, :i] = True
-                break
-        # Processing the lower half
-        # Wiping the right margin clean
-        for i in range(im.width - start, im.width - ray_width):
-            if np.mean(array[slash:, i: (i + ray_width)]) > trigger:
-                array[slash:, (i + ray_width):] = True
-                break
-        # Wiping the left margin clean
-        for i in range(start):
-            i = start - i
-            if np.mean(array[slash:, i: (i + ray_width)]) > trigger:
-                array[slash:, : i] = True
-                break
-    else:  # horizontal image, processing entire image in one go
-        # Wiping the right margin clean
-        for i in range(im.width - start, im.width - ray_width):
-            if np.mean(array[:, i: (i + ray_width)]) > trigger:
-                array[:, (i + ray_width):] = True
-                break
-        # Wiping the left margin clean
-        for i in range(start):
-            i = start - i
-            if np.mean(array[:, i: (i + ray_width)]) > trigger:
-                array[:, :i] = True
-                break
-    return Image.fromarray(array)
+    return Image.fromarray(clean_margins_array(array, ray_fraction, trigger))
 
 
-def deskew(im, echo=False):
-    """Takes a (slightly) skewed image with text as PIL Image object and returns its straightened copy"""
-    angle = 0
+def estimate_skew(im, span=5, proxy_size=800):
+    """Takes an image with text as PIL Image object and estimates its skew from horizontal projection profiles
+    of a reduced (and binarized if needed) central crop, sweeping ±:span: degrees coarse-to-fine down to a tenth
+    of a degree.
+    :returns: a 2-tuple of the angle to rotate the image by (degrees, counterclockwise) and the confidence score
+    in [0, 1]"""
     trial = im.crop((int(im.width * 0.1), int(im.height * 0.1),
                      int(im.width * 0.9), int(im.height * 0.9)))
     if trial.mode != '1':
         trial = binarize_as_array(trial)
-        trial.save('pages/tmp/' + 'trial.png')
-    if max(trial.size) > 800:
-        trial = small(trial, factor=(max(im.size) // 800)).convert('1', dither=0)
+    if max(trial.size) > proxy_size:
+        trial = small(trial, factor=(max(trial.size) // proxy_size + 1)).convert('1', dither=0)
     print(f' - reduced to {trial.size}')
-    # Trying positive tilt
-    if count_white_rows(clean_edges(trial.rotate(1))) > count_white_rows(trial):
-        trial = clean_edges(trial.rotate(1))
-        angle += 1
-        if echo:
-            print(f' {angle}', end=' ')
-        # and incrementing if helps
-        while count_white_rows(clean_edges(trial.rotate(1))) > count_white_rows(trial):
-            trial = clean_edges(trial.rotate(1))
-            angle += 1
-            if echo:
-                print(f' {angle}', end=' ')
-    # Trying negative tilt
-    elif count_white_rows(clean_edges(trial.rotate(-1))) > count_white_rows(trial):
-        trial = clean_edges(trial.rotate(-1))
-        angle -= 1
-        if echo:
-            print(f' {angle}', end=' ')
-        # and incrementing if helps
-        while count_white_rows(clean_edges(trial.rotate(-1))) > count_white_rows(trial):
-            trial = clean_edges(trial.rotate(-1))
-            angle -= 1
-            if echo:
-                print(f' {angle}', end=' ')
-    else:  # returning unchanged image
+    ink = ~np.asarray(trial.convert('1', dither=0))
+    return estimate_skew_array(ink, span=span)
+
+
+def deskew(im, echo=False, min_confidence=.2):
+    """Takes a (slightly) skewed image with text as PIL Image object and returns its straightened copy,
+    rotated once by the angle found with `estimate_skew`. The image is returned unchanged if it is already straight
+    or the estimate is less confident than :min_confidence: (no clear text lines to go by)"""
+    angle, confidence = estimate_skew(im)
+    if echo:
+        print(f' - skew estimate {angle} degrees, confidence {confidence:.2f}')
+    if not angle or confidence < min_confidence:
         if echo:
             print(' - no adjustment needed')
         return im
@@ -362,7 +296,7 @@ def deskew(im, echo=False):
 
 def tesseract_osd(im):
     """Checks image orientation with tesseract and rotates it if necessary"""
-    osd = pytesseract.image_to_osd(im).split('\n')
+    osd = ocr.image_to_osd(im).split('\n')
     print(f'Tesseract: {osd}', sep='\n')
     angle = int(osd[1].split(': ')[1])
     if angle != 0:
@@ -394,53 +328,27 @@ def preprocess(image, threshold=None):
 def segment(im,
             threshold=.0009,  # minimal proportion of black pixels in a row for it to qualify as a dark one
             gap=2,  # minimal gap between lines of text in pixels
-            line_height_cap=0.2  # max height of text line relative to image height (to skip large objects)
+            line_height_cap=0.2,  # max height of text line relative to image height (to skip large objects)
+            max_ink_density=.5,  # max proportion of black pixels in a text line (to skip pictures)
+            columns=False  # look for text lines in each column of a multi-column page separately
             ):
-    """returns a list of text line boxes, each as a four-tuple defining x, y for left upper and right bottom corners.
-    needed dependencies:
-    - PIL.Image[,
-    - PIL.ImageDraw - only to display image with text boxes on it]"""
-
-    # Finding rows with proportion of black pixels above the threshold value ('dark rows')
-    dark_rows = []
-    left = 0
-    right = im.width
-    for y in range(im.height):
-        black = 0
-        for x in range(left, right):
-            if im.getpixel((x, y)) == 0:
-                black += 1
-        if black / (right - left) > threshold:
-            dark_rows.append(y)
-    # Identifying lines of text as bands where dark rows are closer to each other than the gap value
-    # and adding the pad value at top and bottom of each line
-    text_lines = []
-    pad = gap * 2
-    top = dark_rows[0]
-    for i in range(1, len(dark_rows)):
-        if dark_rows[i] - dark_rows[i - 1] > gap:
-            bottom = dark_rows[i - 1]
-            text_lines.append((top - pad, bottom + pad))
-            top = dark_rows[i]
-    if dark_rows[-1] - top > pad:
-        text_lines.append((top - pad, dark_rows[-1] + pad))
-    # preparing crop boxes for each detected text line:
-    boxes = []
-    # visualizing text lines as crop boxes on the image
-    # and storing crop boxes to the list
-    draw = ImageDraw.Draw(im)
-    for line in text_lines:
-        box = (left, line[0], right, line[1])
-        if line[1] - line[0] < im.height * line_height_cap:  # large pictures won't pass
-            draw.rectangle(box, fill=None, width=2, outline=0)
-            boxes.append(box)
-    im.show()
-
-    return boxes
-
-
-# TODO: Rewrite the **segment** function using numpy array (and some other improvements)
-# TODO: Teach it to avoid pictures but keep the sideways text lines
+    """returns text line boxes as a NumPy array, each row defining x, y for left upper and right bottom corners.
+    Black pixel counts are taken from the image array in one go, lines of text are found as runs of dark rows
+    and pictures are skipped by their height and ink density (see `pages2Text.kernels.segment_array`).
+    The image is left as is; use `draw_boxes` to see the boxes on it."""
+    return segment_array(np.asarray(im) == 0, threshold, gap, line_height_cap, max_ink_density, columns)
+
+
+def draw_boxes(im, boxes, width=2, outline=0):
+    """Returns a copy of the image with text line :boxes: drawn on it"""
+    boxed = im.copy()
+    draw = ImageDraw.Draw(boxed)
+    for box in boxes:
+        draw.rectangle(tuple(box), fill=None, width=width, outline=outline)
+    return boxed
+
+
+# TODO: Teach it to keep the sideways text lines
 
 
 def recognize_by_lines(im, boxes):
@@ -450,7 +358,7 @@ def recognize_by_lines(im, boxes):
     if not lang:
         lang = 'tha'
     for box in boxes:
-        line = pytesseract.image_to_string(im.crop(box), config='--psm 7', lang=lang)
+        line = ocr.image_to_string(im.crop(tuple(box)), config='--psm 7', lang=lang)
         text_lines.append(line)
 
     return text_lines
@@ -470,9 +378,9 @@ class Preprocessor:
             im = im.convert('L')
         if mode == '1':
             im = binarize_as_array(im, thresh)
-        self.data = pd.DataFrame(pytesseract.image_to_data(im,
-                                                           lang=lang, config=f'--psm {psm}',
-                                                           output_type='data.frame'))
+        self.data = pd.DataFrame(ocr.image_to_data(im,
+                                                   lang=lang, config=f'--psm {psm}',
+                                                   output_type='data.frame'))
 
     def find_all_blocks(self, lang='tha', psm=3, mode='RGB', thresh=None):
         self.block_boxes.clear()
@@ -558,7 +466,7 @@ class Image2Text:
     def recognize_as_is(self, lang=None):
         if not lang:
             lang = input('Recognition language(s): ')
-        self.text = pytesseract.image_to_string(self.im, lang=lang)
+        self.text = ocr.image_to_string(self.im, lang=lang)
         print('Recognition with no segmentation completed.')
 
     def recognize_by_lines(self):